@@ -6,15 +6,16 @@ ChatBI Web Backend - FastAPI应用
 import os
 import sys
 import logging
-from typing import Optional, Dict, Any, List, Tuple
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 from datetime import datetime
 
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-import uvicorn
-import mysql.connector
+import threading
 import traceback
 
 # 添加父目录到路径，以便导入语义模块
@@ -22,8 +23,24 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__f
 if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
-from translator import nl_to_mysql
+from translator import nl_to_mysql, render_mysql_sql, render_mysql_sql_params
+from conversation import conversations, remember_turn, translate_turn
 from semantic_schema import semantic_manager
+from cache import translation_cache, result_cache, delta_cache
+from result_store import result_store, MaterializedResult
+from rollup import ROLLUP_ENABLED, rollup_manager
+from approximate import APPROX_SAMPLE_TABLES, approximate_query, sample_manager
+from index_advisor import INDEX_ADVISOR_ENABLED, index_advisor
+from metrics import metrics, track_stages, record_stage
+from query_log import query_log, KIND_TRANSLATE, KIND_EXECUTE
+from sql_fingerprint import parameterize_sql
+from downsample import downsample
+from delta_refresh import incremental_refresh
+from db_pool import MYSQL_POOL_SIZE, MYSQL_PREPARED_STATEMENTS, statement_cache
+from datasource import DatasourceRegistry, Endpoint, is_connection_error
+from fast_response import FastJSONResponse, CompressionMiddleware, model_response, dumps
+from warmup import CacheWarmer, traffic_gate, load_top_questions_from_log
+from llm_router import get_router
 
 # 配置日志
 logging.basicConfig(
@@ -39,9 +56,13 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="ChatBI API",
     description="自然语言转SQL的Web API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
+# 按 Accept-Encoding 对较大的响应做 brotli/gzip 压缩
+app.add_middleware(CompressionMiddleware)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -51,12 +72,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求未指定模型时使用的模型；缓存预热也使用该模型，翻译缓存键中包含模型名
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2.5:7b")
+
 # 请求模型
 class QueryRequest(BaseModel):
     question: str = Field(..., description="自然语言问题")
     db_name: str = Field(default="shop", description="数据库名称")
     use_semantic: bool = Field(default=True, description="是否使用语义模式")
-    model: str = Field(default="qwen2.5:7b", description="使用的模型")
+    model: str = Field(default=OLLAMA_MODEL, description="使用的模型，默认取 OLLAMA_MODEL")
+    translation_mode: Optional[str] = Field(default=None, description="翻译模式：direct 直接使用模型，cascade 先用小模型、必要时升级；默认取 TRANSLATION_MODE")
+    approximate: bool = Field(default=False, description="近似模式：聚合查询改写为在样本上执行，返回估计值与误差范围")
+    conversation_id: Optional[str] = Field(default=None, description="会话ID：同一会话中的追问按上一轮的语义SQL增量翻译")
+    followup: bool = Field(default=True, description="会话有上一轮时是否按追问翻译，false 时作为新问题完整翻译")
 
 class QueryResponse(BaseModel):
     success: bool
@@ -64,6 +92,9 @@ class QueryResponse(BaseModel):
     intent: str
     semantic_sql: Dict[str, Any]
     mysql_sql: str
+    approximate: Optional[Dict[str, Any]] = Field(default=None, description="近似信息；已改写时 mysql_sql 为样本查询，exact_sql 为精确查询")
+    conversation_id: Optional[str] = None
+    followup: bool = Field(default=False, description="是否按追问在上一轮语义SQL上增量翻译")
     execution_time: float
     timestamp: str
     error: Optional[str] = None
@@ -82,6 +113,11 @@ class HealthResponse(BaseModel):
 class ExecuteSQLRequest(BaseModel):
     sql: str = Field(..., description="要执行的 MySQL SQL 语句")
     db_name: str = Field(default="shop", description="数据库名称")
+    downsample: Optional[int] = Field(default=None, description="时序结果降采样的目标点数，不传则返回原始结果")
+    downsample_method: str = Field(default="lttb", description="降采样方法：lttb 或 minmax")
+    incremental: bool = Field(default=False, description="增量刷新：只查询水位线之后的时间桶，与上一次的结果合并")
+    since: Optional[str] = Field(default=None, description="上一次响应中的水位线（incremental.watermark），首次请求不传")
+    time_column: Optional[str] = Field(default=None, description="结果中的时间桶列，不传时取第一个时间类型的列")
 
 class ExecuteSQLResponse(BaseModel):
     success: bool
@@ -89,10 +125,34 @@ class ExecuteSQLResponse(BaseModel):
     data: Optional[List[Dict[str, Any]]] = None
     columns: Optional[List[str]] = None
     row_count: int
+    result_id: Optional[str] = Field(default=None, description="结果超出内存预算落盘时的结果ID，data 只包含第一页")
+    downsampled: Optional[Dict[str, Any]] = Field(default=None, description="降采样信息；已降采样时 data 为覆盖全部结果的采样点")
+    incremental: Optional[Dict[str, Any]] = Field(default=None, description="增量刷新信息，watermark 为下次请求的 since")
     execution_time: float
     timestamp: str
     error: Optional[str] = None
 
+class AskRequest(BaseModel):
+    question: str = Field(..., description="自然语言问题")
+    db_name: str = Field(default="shop", description="数据库名称")
+    use_semantic: bool = Field(default=True, description="是否使用语义模式")
+    model: str = Field(default=OLLAMA_MODEL, description="使用的模型，默认取 OLLAMA_MODEL")
+    translation_mode: Optional[str] = Field(default=None, description="翻译模式：direct 或 cascade，默认取 TRANSLATION_MODE")
+    approximate: bool = Field(default=False, description="近似模式：聚合查询改写为在样本上执行，返回估计值与误差范围")
+    conversation_id: Optional[str] = Field(default=None, description="会话ID：同一会话中的追问按上一轮的语义SQL增量翻译")
+    followup: bool = Field(default=True, description="会话有上一轮时是否按追问翻译，false 时作为新问题完整翻译")
+    downsample: Optional[int] = Field(default=None, description="时序结果降采样的目标点数")
+    downsample_method: str = Field(default="lttb", description="降采样方法：lttb 或 minmax")
+
+class ResultPageResponse(BaseModel):
+    success: bool
+    result_id: str
+    columns: List[str]
+    data: List[Dict[str, Any]]
+    offset: int
+    row_count: int
+    error: Optional[str] = None
+
 # 全局配置
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 MYSQL_CONFIG = {
@@ -103,6 +163,57 @@ MYSQL_CONFIG = {
     "database": os.getenv("MYSQL_DATABASE", "shop")
 }
 
+# 缓存预热配置
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "3600"))
+WARMUP_IDLE_SECONDS = float(os.getenv("WARMUP_IDLE_SECONDS", "2"))
+WARMUP_EXECUTE = os.getenv("WARMUP_EXECUTE", "0") == "1"
+WARMUP_QUERY_LOG = os.getenv("WARMUP_QUERY_LOG", "")
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "20"))
+
+# ip_flow 汇总表所在的MySQL数据库
+ROLLUP_DATABASE = os.getenv("ROLLUP_DATABASE", MYSQL_CONFIG["database"])
+
+# db_name -> 主库与只读副本，未配置的数据库使用 MYSQL_CONFIG 的主机
+datasources = DatasourceRegistry.from_env(MYSQL_CONFIG)
+
+# 启动后在后台线程预先导入LLM客户端和MySQL驱动，服务先就绪，首个请求也不必承担导入耗时
+PRELOAD_HEAVY_IMPORTS = os.getenv("PRELOAD_HEAVY_IMPORTS", "1") == "1"
+HEAVY_MODULES = ("langchain_ollama", "mysql.connector")
+
+# 示例查询（/examples 接口与缓存预热共用）
+EXAMPLE_DB_NAME = "shop"
+EXAMPLE_QUERIES = [
+    {
+        "category": "基础查询",
+        "queries": [
+            "查询所有用户的信息",
+            "查询所有商品信息，包括名称、价格和库存",
+            "查询所有订单信息"
+        ]
+    },
+    {
+        "category": "聚合查询",
+        "queries": [
+            "统计每个用户的订单总数和总金额",
+            "查询最近一周的订单趋势，按日期统计订单数量和总金额",
+            "统计商品销售情况，按商品分组"
+        ]
+    },
+    {
+        "category": "复杂查询",
+        "queries": [
+            "找出最活跃的用户，按订单总金额排序",
+            "查询最近7天每天的新增订单数量，按日期排序",
+            "统计每个商品类别的平均价格"
+        ]
+    }
+]
+
+# 计入线上流量的接口，后台预热任务会为这些请求让路；
+# /ask 是流式响应，响应头发出后翻译和执行才开始，在事件流内部计入
+LIVE_TRAFFIC_PATHS = ("/query", "/execute-sql")
+
 def is_safe_sql(sql: str) -> bool:
     """检查 SQL 是否安全（只允许 SELECT 语句）"""
     import re
@@ -133,41 +244,54 @@ def is_safe_sql(sql: str) -> bool:
     
     return True
 
-def execute_mysql_query(sql: str, db_name: str = "shop") -> Tuple[List[Dict[str, Any]], List[str], int]:
-    """执行 MySQL 查询并返回结果"""
-    if not is_safe_sql(sql):
+# 预处理失败后改为直接执行的错误码：不支持预处理的语句、占位符位置不被接受
+_PREPARE_FALLBACK_ERRNOS = {1064, 1210, 1295}
+
+def execute_mysql_query(
+    sql: str,
+    db_name: str = "shop",
+    use_cache: bool = True,
+    prepared: Optional[Tuple[str, List[Any]]] = None
+) -> Tuple[List[Dict[str, Any]], List[str], int, Optional[str]]:
+    """执行 MySQL 查询并返回 (数据, 列名, 总行数, result_id)
+
+    只读查询分配到该数据库的主库或副本，连接从对应节点的连接池借用，用完归还。结果超出内存预算时落盘，数据只包含第一页，
+    result_id 用于分页读取或下载完整结果。
+    prepared 为渲染器输出的 (参数化SQL, 参数)，未提供时从 sql 中提取 WHERE / HAVING 的字面量。
+    """
+    if prepared is None:
+        prepared = parameterize_sql(sql)
+    # 优先执行参数化SQL，服务端不能预处理时改为直接执行原SQL，两者都要检查
+    if not is_safe_sql(sql) or not is_safe_sql(prepared[0]):
         raise ValueError("不安全的 SQL 语句：只允许 SELECT 查询")
     
-    # 使用指定的数据库名称
-    config = MYSQL_CONFIG.copy()
-    config["database"] = db_name
+    # 按SQL原文缓存：未起别名的查询表达式就是结果列名，大小写、反引号不同的SQL返回的列名也不同
+    cache_key = (db_name, sql)
+    if use_cache:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
     
-    conn = None
+    import mysql.connector
+
+    # 只读查询优先分配到复制延迟可接受的副本
+    endpoint = datasources.choose(db_name)
+    started = datetime.now()
     try:
-        conn = mysql.connector.connect(**config)
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute(sql)
-        results = cursor.fetchall()
-        
-        # 获取列名
-        columns = [desc[0] for desc in cursor.description] if cursor.description else []
-        
-        # 转换结果为标准格式
-        data = []
-        for row in results:
-            row_dict = {}
-            for key, value in row.items():
-                # 处理特殊类型
-                if hasattr(value, 'isoformat'):  # datetime 对象
-                    row_dict[key] = value.isoformat()
-                elif isinstance(value, bytes):  # bytes 对象
-                    row_dict[key] = value.decode('utf-8')
-                else:
-                    row_dict[key] = value
-            data.append(row_dict)
+        try:
+            result = _materialize_query(endpoint, sql, prepared)
+        except mysql.connector.Error as e:
+            if endpoint.role != "replica" or not is_connection_error(e):
+                raise
+            # 副本不可达：标记为不可用，本次查询改在主库上执行
+            endpoint.mark_down(str(e))
+            metrics.incr("datasource.replica_retry")
+            result = _materialize_query(datasources.get(db_name).primary, sql, prepared)
+        record_stage("db", (datetime.now() - started).total_seconds())
         
-        return data, columns, len(data)
+        if result.result_id is None:
+            result_cache.set(cache_key, (result.data, result.columns, result.row_count, None))
+        return result.data, result.columns, result.row_count, result.result_id
         
     except mysql.connector.Error as e:
         logger.error(f"MySQL 执行错误: {e}")
@@ -175,27 +299,130 @@ def execute_mysql_query(sql: str, db_name: str = "shop") -> Tuple[List[Dict[str,
     except Exception as e:
         logger.error(f"SQL 执行异常: {e}")
         raise HTTPException(status_code=500, detail=f"执行错误: {str(e)}")
+
+def _materialize_query(endpoint: Endpoint, sql: str,
+                       prepared: Optional[Tuple[str, List[Any]]] = None) -> MaterializedResult:
+    """在指定节点的连接池连接上执行查询；出错的连接可能还有未读完的结果或已断开，不再放回连接池
+
+    有参数时使用连接上按参数化SQL原文缓存的预处理语句；服务端不能预处理该语句时改为直接执行 sql。
+    """
+    with endpoint.pool.connection() as conn:
+        if MYSQL_PREPARED_STATEMENTS and prepared is not None and prepared[1]:
+            import mysql.connector
+
+            param_sql, params = prepared
+            cursor, operation = statement_cache.cursor(conn, param_sql)
+            try:
+                cursor.execute(operation, tuple(params))
+                # 结果读完后游标留在缓存中，参数化SQL相同的下一次查询直接执行
+                return result_store.materialize(cursor)
+            except mysql.connector.Error as e:
+                statement_cache.discard(conn, param_sql)
+                if e.errno not in _PREPARE_FALLBACK_ERRNOS:
+                    raise
+                metrics.incr("prepared.fallback")
+                logger.warning(f"预处理语句执行失败，改为直接执行: {e}")
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        # 按批读取，超出内存预算的结果落盘，只返回第一页
+        result = result_store.materialize(cursor)
+        cursor.close()
+        return result
+
+def _warmup_questions() -> List[Tuple[str, str]]:
+    """本轮预热问题：示例查询 + 日志中的高频问题"""
+    items = [(q, EXAMPLE_DB_NAME) for group in EXAMPLE_QUERIES for q in group["queries"]]
+    items.extend(load_top_questions_from_log(WARMUP_QUERY_LOG, WARMUP_TOP_N))
+    items.extend(query_log.top_questions(WARMUP_TOP_N))
+    return items
+
+def _warmup_translate(question: str, db_name: str) -> Tuple[Any, str]:
+    return nl_to_mysql(
+        question=question,
+        model=OLLAMA_MODEL,
+        base_url=OLLAMA_BASE_URL,
+        db_name=db_name
+    )
+
+cache_warmer = CacheWarmer(
+    translate=_warmup_translate,
+    questions=_warmup_questions,
+    execute=execute_mysql_query if WARMUP_EXECUTE else None,
+    interval=WARMUP_INTERVAL,
+    idle_seconds=WARMUP_IDLE_SECONDS
+)
+
+@app.middleware("http")
+async def track_live_traffic(request, call_next):
+    """记录线上请求，供后台预热任务让路"""
+    if request.url.path not in LIVE_TRAFFIC_PATHS:
+        return await call_next(request)
+    traffic_gate.enter()
+    try:
+        return await call_next(request)
     finally:
-        if conn and conn.is_connected():
-            conn.close()
+        traffic_gate.exit()
+
+def _rollup_connect():
+    return datasources.connect_primary(ROLLUP_DATABASE)
+
+if ROLLUP_ENABLED:
+    rollup_manager.connect = _rollup_connect
+
+# EXPLAIN 需要与执行计划一致的主库统计信息
+index_advisor.connect = datasources.connect_primary
+# 样本表在主库上维护，经复制同步到副本
+sample_manager.connect = datasources.connect_primary
+
+def _preload_heavy_modules():
+    import importlib
+    import time
+
+    started = time.perf_counter()
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"预加载模块失败 - 模块: {name}, 错误: {e}")
+    metrics.observe("startup.preload_seconds", time.perf_counter() - started)
+    logger.info(f"重型依赖预加载完成 - 耗时: {time.perf_counter() - started:.2f}秒")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    if PRELOAD_HEAVY_IMPORTS:
+        threading.Thread(target=_preload_heavy_modules, name="preload", daemon=True).start()
+    semantic_manager.start_watcher()
+    datasources.start()
+    if ROLLUP_ENABLED:
+        logger.info(f"启动流量汇总表刷新任务 - 数据库: {ROLLUP_DATABASE}, 间隔: {rollup_manager.interval}秒")
+        rollup_manager.start()
+    if sample_manager.enabled:
+        logger.info(f"启动样本表刷新任务 - 表: {APPROX_SAMPLE_TABLES}, 间隔: {sample_manager.interval}秒")
+        sample_manager.start()
+    if WARMUP_ENABLED:
+        logger.info(f"启动缓存预热任务 - 间隔: {WARMUP_INTERVAL}秒, 预热结果缓存: {WARMUP_EXECUTE}")
+        cache_warmer.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    cache_warmer.stop()
+    semantic_manager.stop_watcher()
+    rollup_manager.stop()
+    sample_manager.stop()
+    result_store.clear()
+    query_log.close()
+    datasources.stop()
 
 @app.get("/", response_model=HealthResponse)
 async def health_check():
     """健康检查接口"""
     logger.info("执行健康检查")
     try:
-        # 检查Ollama连接
-        import requests
-        ollama_available = False
-        try:
-            response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-            ollama_available = response.status_code == 200
-            logger.debug(f"Ollama连接检查 - 可用: {ollama_available}, 状态码: {response.status_code}")
-        except Exception as e:
-            logger.warning(f"Ollama连接检查失败: {e}")
-            pass
+        # 检查Ollama连接（节点池中任一节点可用即可）
+        ollama_available = get_router(OLLAMA_BASE_URL).refresh()
+        logger.debug(f"Ollama连接检查 - 可用: {ollama_available}")
         
-        schemas_count = len(semantic_manager.schemas)
+        schemas_count = len(semantic_manager.list_databases())
         logger.info(f"健康检查完成 - Ollama可用: {ollama_available}, 语义模式数量: {schemas_count}")
         
         return HealthResponse(
@@ -219,7 +446,10 @@ async def get_schemas():
     logger.info("获取语义模式列表请求")
     try:
         schemas = []
-        for name, schema in semantic_manager.schemas.items():
+        for name in semantic_manager.list_databases():
+            schema = semantic_manager.get_schema(name)
+            if schema is None:
+                continue
             schemas.append({
                 "name": schema.name,
                 "description": schema.description,
@@ -244,51 +474,46 @@ async def get_schemas():
 async def process_query(request: QueryRequest):
     """处理自然语言查询"""
     start_time = datetime.now()
+    stages = track_stages()
+    semantic = None
     
     # 记录请求开始信息
     logger.info(f"开始处理查询请求 - 问题: '{request.question}', 数据库: {request.db_name}, "
                 f"使用语义模式: {request.use_semantic}, 模型: {request.model}")
     
     try:
-        # 准备参数
-        schema = None
-        if MYSQL_CONFIG["host"]:
-            try:
-                # 这里可以添加MySQL模式自省逻辑
-                # 暂时跳过，直接使用语义模式
-                logger.debug(f"MySQL配置检测到，主机: {MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}")
-                pass
-            except Exception as e:
-                logger.error(f"MySQL连接失败: {e}")
-        
-        # 调用翻译器
+        # 调用翻译器（表结构来自语义模式）
         logger.info(f"开始自然语言到SQL转换 - 使用语义模式: {request.use_semantic}")
         
-        if request.use_semantic:
-            semantic, sql = nl_to_mysql(
-                question=request.question,
-                schema=schema,
-                model=request.model,
-                base_url=OLLAMA_BASE_URL,
-                db_name=request.db_name
-            )
-        else:
-            # 不使用语义模式
+        if not request.use_semantic:
             logger.info("使用非语义模式进行转换")
-            semantic, sql = nl_to_mysql(
-                question=request.question,
-                schema=schema,
-                model=request.model,
-                base_url=OLLAMA_BASE_URL,
-                db_name="unknown_db"  # 使用未知数据库名禁用语义模式
-            )
+        # /query 不执行SQL，翻译成功即记为会话的最近一轮；执行失败时客户端用 followup=false 重新翻译
+        semantic, sql, followup = translate_turn(
+            question=request.question,
+            conversation_id=request.conversation_id,
+            followup=request.followup,
+            model=request.model,
+            base_url=OLLAMA_BASE_URL,
+            # 使用未知数据库名禁用语义模式
+            db_name=request.db_name if request.use_semantic else "unknown_db",
+            mode=request.translation_mode
+        )
+        
+        approximate = None
+        if request.approximate:
+            sql, approximate = _approximate(semantic, sql, request.db_name)
         
         execution_time = (datetime.now() - start_time).total_seconds()
+        if INDEX_ADVISOR_ENABLED:
+            index_advisor.remember(semantic, sql)
         
         # 记录成功处理信息
         logger.info(f"查询处理成功 - 意图: {semantic.intent}, SQL长度: {len(sql)}字符, "
                     f"执行时间: {execution_time:.3f}秒")
         logger.debug(f"生成的SQL: {sql}")
+        query_log.log(KIND_TRANSLATE, question=request.question, db_name=request.db_name,
+                      model=request.model, semantic=semantic, sql=sql,
+                      total_seconds=execution_time, stages=stages)
         
         return QueryResponse(
             success=True,
@@ -296,6 +521,9 @@ async def process_query(request: QueryRequest):
             intent=semantic.intent,
             semantic_sql=semantic.model_dump(by_alias=True),
             mysql_sql=sql,
+            approximate=approximate,
+            conversation_id=request.conversation_id,
+            followup=followup,
             execution_time=execution_time,
             timestamp=datetime.now().isoformat()
         )
@@ -306,6 +534,9 @@ async def process_query(request: QueryRequest):
         # 记录错误信息
         logger.error(f"查询处理失败 - 问题: '{request.question}', 错误: {str(e)}, "
                      f"执行时间: {execution_time:.3f}秒", exc_info=True)
+        query_log.log(KIND_TRANSLATE, question=request.question, db_name=request.db_name,
+                      model=request.model, semantic=semantic, success=False,
+                      total_seconds=execution_time, stages=stages)
         
         return QueryResponse(
             success=False,
@@ -318,31 +549,61 @@ async def process_query(request: QueryRequest):
             error=str(e)
         )
 
+def _approximate(semantic, sql: str, db_name: str) -> Tuple[str, Dict[str, Any]]:
+    """近似模式下改写为样本查询；不可改写时保留原SQL，近似信息中说明原因"""
+    approx_sql, info = approximate_query(semantic, db_name)
+    if approx_sql is None:
+        logger.info(f"查询未改写为近似查询 - 原因: {info['reason']}")
+        return sql, info
+    logger.info(f"查询改写为近似查询 - 方式: {info['method']}, 表: {info['table']}, 采样率: {info['sample_rate']}")
+    return approx_sql, info
+
 @app.post("/execute-sql", response_model=ExecuteSQLResponse)
 async def execute_sql(request: ExecuteSQLRequest):
     """执行生成的 MySQL SQL 查询"""
     start_time = datetime.now()
+    stages = track_stages()
     
     logger.info(f"开始执行 SQL 查询 - 数据库: {request.db_name}")
     logger.debug(f"要执行的 SQL: {request.sql}")
     
     try:
         # 执行 SQL 查询
-        data, columns, row_count = execute_mysql_query(request.sql, request.db_name)
+        incremental = None
+        if request.incremental:
+            data, columns, row_count, result_id, incremental = incremental_refresh(
+                request.sql, request.db_name, execute_mysql_query,
+                since=request.since, time_column=request.time_column
+            )
+        else:
+            data, columns, row_count, result_id = execute_mysql_query(request.sql, request.db_name)
+        
+        downsampled = None
+        if request.downsample:
+            data, downsampled = _downsample_result(data, columns, row_count, result_id,
+                                                   request.downsample, request.downsample_method)
         
         execution_time = (datetime.now() - start_time).total_seconds()
+        if INDEX_ADVISOR_ENABLED:
+            index_advisor.observe_execution(request.db_name, request.sql, execution_time)
         
         logger.info(f"SQL 执行成功 - 返回 {row_count} 行数据, 执行时间: {execution_time:.3f}秒")
+        query_log.log(KIND_EXECUTE, db_name=request.db_name, sql=request.sql,
+                      total_seconds=execution_time, stages=stages, row_count=row_count)
         
-        return ExecuteSQLResponse(
+        # 结果行不再经过 response_model 逐行校验，直接用 orjson 序列化
+        return model_response(ExecuteSQLResponse.model_construct(
             success=True,
             sql=request.sql,
             data=data,
             columns=columns,
             row_count=row_count,
+            result_id=result_id,
+            downsampled=downsampled,
+            incremental=incremental,
             execution_time=execution_time,
             timestamp=datetime.now().isoformat()
-        )
+        ))
         
     except ValueError as e:
         # 安全检查失败
@@ -364,6 +625,8 @@ async def execute_sql(request: ExecuteSQLRequest):
         # 数据库执行错误
         execution_time = (datetime.now() - start_time).total_seconds()
         logger.error(f"SQL 执行失败: {e.detail}")
+        query_log.log(KIND_EXECUTE, db_name=request.db_name, sql=request.sql, success=False,
+                      total_seconds=execution_time, stages=stages)
         
         return ExecuteSQLResponse(
             success=False,
@@ -380,6 +643,8 @@ async def execute_sql(request: ExecuteSQLRequest):
         # 其他未知错误
         execution_time = (datetime.now() - start_time).total_seconds()
         logger.error(f"SQL 执行发生未知错误: {str(e)}", exc_info=True)
+        query_log.log(KIND_EXECUTE, db_name=request.db_name, sql=request.sql, success=False,
+                      total_seconds=execution_time, stages=stages)
         
         return ExecuteSQLResponse(
             success=False,
@@ -392,42 +657,268 @@ async def execute_sql(request: ExecuteSQLRequest):
             error=f"执行错误: {str(e)}"
         )
 
+# /ask 在SQL生成后立即在此执行，与翻译事件的发送并行
+_ask_executor = ThreadPoolExecutor(max_workers=MYSQL_POOL_SIZE, thread_name_prefix="ask")
+
+def _ask_event(event: str, **fields: Any) -> bytes:
+    return dumps({"event": event, **fields}) + b"\n"
+
+def _ask_execute(request: AskRequest, sql: str,
+                 prepared: Optional[Tuple[str, List[Any]]] = None) -> Dict[str, Any]:
+    """执行 /ask 生成的SQL，返回 result 事件的字段（与 /execute-sql 的响应相同）"""
+    start_time = datetime.now()
+    stages = track_stages()
+    try:
+        data, columns, row_count, result_id = execute_mysql_query(sql, request.db_name, prepared=prepared)
+        downsampled = None
+        if request.downsample:
+            data, downsampled = _downsample_result(data, columns, row_count, result_id,
+                                                   request.downsample, request.downsample_method)
+        execution_time = (datetime.now() - start_time).total_seconds()
+        if INDEX_ADVISOR_ENABLED:
+            index_advisor.observe_execution(request.db_name, sql, execution_time)
+        query_log.log(KIND_EXECUTE, db_name=request.db_name, sql=sql,
+                      total_seconds=execution_time, stages=stages, row_count=row_count)
+        return dict(success=True, sql=sql, data=data, columns=columns, row_count=row_count,
+                    result_id=result_id, downsampled=downsampled, execution_time=execution_time)
+    except Exception as e:
+        execution_time = (datetime.now() - start_time).total_seconds()
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        if not isinstance(e, ValueError):
+            # 安全检查失败不计入查询日志，与 /execute-sql 一致
+            query_log.log(KIND_EXECUTE, db_name=request.db_name, sql=sql, success=False,
+                          total_seconds=execution_time, stages=stages)
+        logger.error(f"/ask SQL 执行失败: {error}")
+        return dict(success=False, sql=sql, data=None, columns=None, row_count=0,
+                    execution_time=execution_time, error=error)
+
+def _ask_events(request: AskRequest) -> Iterator[bytes]:
+    """/ask 的事件流：translation（字段同 /query 响应）→ result（字段同 /execute-sql 响应）→ done
+
+    读取事件流期间计入线上流量，翻译和执行时后台预热任务让路；客户端断开时生成器关闭，同样退出。
+    """
+    traffic_gate.enter()
+    try:
+        yield from _ask_stream(request)
+    finally:
+        traffic_gate.exit()
+
+def _ask_stream(request: AskRequest) -> Iterator[bytes]:
+    start_time = datetime.now()
+    stages = track_stages()
+    semantic = None
+    # 与 /query 相同，使用未知数据库名禁用语义模式；执行仍在 db_name 上
+    translate_db = request.db_name if request.use_semantic else "unknown_db"
+    try:
+        # 执行成功后才记为会话的最近一轮，执行失败的SQL不作为下一次追问的基础
+        semantic, sql, followup = translate_turn(
+            question=request.question,
+            conversation_id=request.conversation_id,
+            followup=request.followup,
+            model=request.model,
+            base_url=OLLAMA_BASE_URL,
+            db_name=translate_db,
+            mode=request.translation_mode,
+            remember=False
+        )
+    except Exception as e:
+        translation_time = (datetime.now() - start_time).total_seconds()
+        logger.error(f"/ask 翻译失败 - 问题: '{request.question}', 错误: {str(e)}")
+        query_log.log(KIND_TRANSLATE, question=request.question, db_name=request.db_name,
+                      model=request.model, success=False, total_seconds=translation_time, stages=stages)
+        yield _ask_event("translation", success=False, question=request.question, intent="",
+                         semantic_sql={}, mysql_sql="", execution_time=translation_time, error=str(e))
+        yield _ask_event("done", success=False, total_time=translation_time)
+        return
+
+    approximate = None
+    if request.approximate:
+        sql, approximate = _approximate(semantic, sql, request.db_name)
+
+    # 未被汇总表或近似执行改写的SQL直接使用渲染器输出的参数化形式
+    prepared = None
+    if sql == render_mysql_sql(semantic):
+        prepared = render_mysql_sql_params(semantic)
+
+    # SQL一生成就开始执行，翻译事件的序列化和发送不再挡在数据库执行前面
+    execution = _ask_executor.submit(contextvars.copy_context().run, _ask_execute, request, sql, prepared)
+    translation_time = (datetime.now() - start_time).total_seconds()
+    if INDEX_ADVISOR_ENABLED:
+        index_advisor.remember(semantic, sql)
+    query_log.log(KIND_TRANSLATE, question=request.question, db_name=request.db_name,
+                  model=request.model, semantic=semantic, sql=sql,
+                  total_seconds=translation_time, stages=stages)
+    logger.info(f"/ask 翻译完成 - 意图: {semantic.intent}, 耗时: {translation_time:.3f}秒")
+    yield _ask_event("translation", success=True, question=request.question, intent=semantic.intent,
+                     semantic_sql=semantic.model_dump(by_alias=True), mysql_sql=sql,
+                     approximate=approximate, conversation_id=request.conversation_id, followup=followup,
+                     execution_time=translation_time)
+
+    result = execution.result()
+    if result["success"]:
+        remember_turn(request.conversation_id, translate_db, request.question, semantic, followup)
+    yield _ask_event("result", timestamp=datetime.now().isoformat(), **result)
+    total_time = (datetime.now() - start_time).total_seconds()
+    logger.info(f"/ask 处理完成 - 返回 {result['row_count']} 行数据, 总耗时: {total_time:.3f}秒")
+    yield _ask_event("done", success=result["success"], total_time=total_time)
+
+@app.post("/ask")
+async def ask(request: AskRequest):
+    """一次请求完成翻译与执行，以NDJSON流式返回事件
+
+    省去客户端先调 /query、再调 /execute-sql 的一次往返；执行使用连接池中的连接。
+    """
+    logger.info(f"开始处理 /ask 请求 - 问题: '{request.question}', 数据库: {request.db_name}, 模型: {request.model}")
+    return StreamingResponse(_ask_events(request), media_type="application/x-ndjson")
+
+def _downsample_result(
+    data: List[Dict[str, Any]],
+    columns: List[str],
+    row_count: int,
+    result_id: Optional[str],
+    target: int,
+    method: str
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """对时序结果降采样；落盘结果从文件读取全部行，而不只是第一页"""
+    spilled = result_store.get(result_id) if result_id else None
+    if spilled is not None:
+        rows = spilled.iter_rows
+    else:
+        rows = lambda: ([row.get(c) for c in columns] for row in data)
+    sampled, info = downsample(columns, rows, row_count, target, method)
+    if sampled is None:
+        logger.info(f"结果未降采样 - 原因: {info['reason']}")
+        return data, info
+    logger.info(f"结果已降采样 - 方法: {info['method']}, {row_count} 行 -> {info['points']} 个点")
+    return sampled, info
+
+def _get_spilled_result(result_id: str):
+    result = result_store.get(result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"结果不存在或已过期: {result_id}")
+    return result
+
+@app.get("/results/{result_id}", response_model=ResultPageResponse)
+async def get_result_page(result_id: str, offset: int = 0, limit: Optional[int] = None):
+    """分页读取落盘的查询结果"""
+    result = _get_spilled_result(result_id)
+    limit = result.page_size if limit is None else max(0, min(limit, result_store.page_size * 10))
+    return model_response(ResultPageResponse.model_construct(
+        success=True,
+        result_id=result_id,
+        columns=result.columns,
+        data=result.page(max(0, offset), limit),
+        offset=offset,
+        row_count=result.row_count
+    ))
+
+@app.get("/results/{result_id}/download")
+async def download_result(result_id: str, format: str = "csv"):
+    """流式下载落盘的完整查询结果，format 为 csv 或 ndjson"""
+    result = _get_spilled_result(result_id)
+    if format == "ndjson":
+        return StreamingResponse(result.iter_ndjson(), media_type="application/x-ndjson")
+    if format != "csv":
+        raise HTTPException(status_code=400, detail=f"不支持的下载格式: {format}")
+    return StreamingResponse(
+        result.iter_csv(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{result_id}.csv"'}
+    )
+
+@app.delete("/results/{result_id}")
+async def delete_result(result_id: str):
+    """提前删除落盘的查询结果"""
+    if not result_store.delete(result_id):
+        raise HTTPException(status_code=404, detail=f"结果不存在或已过期: {result_id}")
+    return {"success": True, "result_id": result_id}
+
+@app.get("/index-advisor")
+async def get_index_advice(db_name: Optional[str] = None, top: int = 5):
+    """根据已执行的生成查询给出按表排序的索引建议"""
+    return {
+        "enabled": INDEX_ADVISOR_ENABLED,
+        "suggestions": index_advisor.report(db_name=db_name, top=top)
+    }
+
+@app.get("/query-log/top")
+def get_top_queries(order: str = "slow", top: int = 10, since: Optional[float] = None,
+                    kind: Optional[str] = None):
+    """从查询日志统计最慢（order=slow）或最频繁（order=frequent）的查询
+
+    since 为Unix时间戳，只统计此后的记录；kind 可选 translate 或 execute。
+    扫描日志文件耗时较长，定义为同步函数由线程池执行，不阻塞事件循环上的其他请求。
+    """
+    if order not in ("slow", "frequent"):
+        raise HTTPException(status_code=400, detail=f"不支持的排序方式: {order}")
+    if kind not in (None, "translate", "execute"):
+        raise HTTPException(status_code=400, detail=f"不支持的记录类型: {kind}")
+    return {
+        "enabled": query_log.enabled,
+        "order": order,
+        "queries": query_log.top_queries(order=order, top=top, since=since, kind=kind)
+    }
+
+@app.post("/rollups/refresh")
+async def refresh_rollups(full: bool = False):
+    """立即刷新 ip_flow 汇总表，full=true 时从头重建"""
+    if not ROLLUP_ENABLED:
+        raise HTTPException(status_code=400, detail="未启用流量汇总表（ROLLUP_ENABLED=0）")
+    try:
+        return {"success": True, **rollup_manager.refresh(full=full)}
+    except Exception as e:
+        logger.error(f"刷新流量汇总表失败: {e}")
+        raise HTTPException(status_code=500, detail=f"刷新失败: {str(e)}")
+
+@app.post("/samples/refresh")
+async def refresh_samples(full: bool = False):
+    """立即刷新近似查询的样本表，full=true 时清空重建"""
+    if not sample_manager.enabled:
+        raise HTTPException(status_code=400, detail="未配置样本表（APPROX_SAMPLE_TABLES）")
+    return {"success": True, "tables": sample_manager.refresh(full=full)}
+
+@app.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    """结束会话：清除保存的上一轮语义SQL，之后的问题按新问题完整翻译"""
+    if not conversations.forget(conversation_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {conversation_id}")
+    return {"success": True, "conversation_id": conversation_id}
+
 @app.get("/examples")
 async def get_examples():
     """获取示例查询"""
+    return {"examples": EXAMPLE_QUERIES}
+
+@app.get("/metrics")
+async def get_metrics():
+    """获取运行指标：缓存命中、预热状态等"""
     return {
-        "examples": [
-            {
-                "category": "基础查询",
-                "queries": [
-                    "查询所有用户的信息",
-                    "查询所有商品信息，包括名称、价格和库存",
-                    "查询所有订单信息"
-                ]
-            },
-            {
-                "category": "聚合查询",
-                "queries": [
-                    "统计每个用户的订单总数和总金额",
-                    "查询最近一周的订单趋势，按日期统计订单数量和总金额",
-                    "统计商品销售情况，按商品分组"
-                ]
-            },
-            {
-                "category": "复杂查询",
-                "queries": [
-                    "找出最活跃的用户，按订单总金额排序",
-                    "查询最近7天每天的新增订单数量，按日期排序",
-                    "统计每个商品类别的平均价格"
-                ]
-            }
-        ]
+        "caches": {
+            "translation": translation_cache.stats(),
+            "result": result_cache.stats(),
+            "delta": delta_cache.stats(),
+            "conversation": conversations.stats()
+        },
+        "results": result_store.stats(),
+        "datasources": datasources.status(),
+        "prepared_statements": statement_cache.stats(),
+        "rollups": rollup_manager.status(),
+        "samples": sample_manager.status(),
+        "llm_endpoints": get_router(OLLAMA_BASE_URL).status(),
+        "warmup": {
+            "enabled": WARMUP_ENABLED,
+            "last_run": cache_warmer.last_run,
+            "live_requests": traffic_gate.active
+        },
+        **metrics.snapshot()
     }
 
 if __name__ == "__main__":
     logger.info("启动ChatBI服务器")
-    logger.info(f"Ollama基础URL: {OLLAMA_BASE_URL}")
+    logger.info(f"Ollama节点: {', '.join(get_router(OLLAMA_BASE_URL).urls)}")
     logger.info(f"MySQL配置: {MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}")
+    import uvicorn
+
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
@@ -0,0 +1,359 @@
+"""
+近似查询模块 - 探索性的大表聚合查询先在样本上执行，返回按采样率放大的估计值与误差范围
+样本按主键哈希确定性抽取并维护在样本表中，只有样本表足够新时才改写到样本表
+（在原表上加哈希过滤条件仍要扫描全表，省不下I/O）；只改写 SUM/COUNT/AVG 聚合查询，精确SQL随结果一并返回，需要时可重新精确执行
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 采样率（按主键哈希分到 10000 个桶，取前 rate * 10000 个桶）
+APPROX_SAMPLE_RATE = float(os.getenv("APPROX_SAMPLE_RATE", "0.01"))
+# 需要维护样本表的表，格式 db_name.table，逗号分隔；未配置的表不做近似改写
+APPROX_SAMPLE_TABLES = os.getenv("APPROX_SAMPLE_TABLES", "")
+APPROX_REFRESH_INTERVAL = float(os.getenv("APPROX_REFRESH_INTERVAL", "300"))
+# 每次刷新回溯的时间（秒），覆盖迟到的数据
+APPROX_LATENESS = int(os.getenv("APPROX_LATENESS", "600"))
+# 样本表超过该时间（秒）未成功刷新时不再改写到样本表
+APPROX_MAX_STALENESS = float(os.getenv("APPROX_MAX_STALENESS", "900"))
+
+HASH_BUCKETS = 10000
+# 误差范围为95%置信区间的半宽
+CONFIDENCE = 0.95
+_Z = 1.96
+
+_CREATE_SAMPLE_SQL = "CREATE TABLE IF NOT EXISTS `{sample}` LIKE `{source}`"
+# 样本只取决于主键，重复插入同一行会被忽略，回溯刷新是幂等的
+_REFRESH_SAMPLE_SQL = "INSERT IGNORE INTO `{sample}` SELECT * FROM `{source}` WHERE {where}"
+
+
+def sample_buckets(rate: float) -> int:
+    return max(1, min(HASH_BUCKETS, round(rate * HASH_BUCKETS)))
+
+
+def sample_table_name(table: str, buckets: int) -> str:
+    """样本表名带上采样率（万分比），调整采样率后会建新表而不是混用旧样本"""
+    return f"{table}_sample_{buckets}bp"
+
+
+def _hash_expr(primary_key: List[str]) -> str:
+    columns = ", ".join(f"`{c}`" for c in primary_key)
+    # 用 MOD 而不是 %，SQL中没有需要驱动转义的百分号
+    return f"MOD(CRC32(CONCAT_WS('|', {columns})), {HASH_BUCKETS})"
+
+
+def _table_semantic(db_name: str, table: str):
+    from semantic_schema import semantic_manager
+
+    return semantic_manager.get_table_semantic(db_name, table)
+
+
+def _primary_key(table_semantic) -> List[str]:
+    if table_semantic is None or not table_semantic.primary_key:
+        return []
+    return [c.strip().strip("`") for c in table_semantic.primary_key.split(",") if c.strip()]
+
+
+def _time_column(table_semantic) -> Optional[str]:
+    from semantic_schema import DataType
+
+    for field in table_semantic.fields if table_semantic else []:
+        if field.data_type in (DataType.DATETIME, DataType.DATE):
+            return field.name
+    return None
+
+
+class SampleTableManager:
+    """样本表的建表、增量刷新与新鲜度状态"""
+
+    def __init__(
+        self,
+        connect: Optional[Callable[[str], Any]] = None,
+        tables: str = APPROX_SAMPLE_TABLES,
+        rate: float = APPROX_SAMPLE_RATE,
+        interval: float = APPROX_REFRESH_INTERVAL,
+        lateness: int = APPROX_LATENESS,
+        max_staleness: float = APPROX_MAX_STALENESS,
+    ):
+        """
+        Args:
+            connect: 按 db_name 返回一个指向该数据库主库的新连接
+            tables: db_name.table 列表，逗号分隔
+        """
+        self.connect = connect
+        self.buckets = sample_buckets(rate)
+        self.tables: List[Tuple[str, str]] = [
+            tuple(item.strip().split(".", 1)) for item in tables.split(",") if "." in item
+        ]
+        self.interval = interval
+        self.lateness = lateness
+        self.max_staleness = max_staleness
+        self.last_refresh: Dict[str, Dict[str, Any]] = {}
+        self._last_success: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.connect is not None and bool(self.tables)
+
+    def sample_table(self, db_name: str, table: str) -> Optional[str]:
+        """足够新的样本表名；没有维护或已过期时返回 None"""
+        last = self._last_success.get((db_name, table), 0.0)
+        if last > 0 and time.monotonic() - last <= self.max_staleness:
+            return sample_table_name(table, self.buckets)
+        return None
+
+    def refresh(self, full: bool = False) -> Dict[str, Dict[str, Any]]:
+        """增量刷新所有样本表；full=True 时清空重建"""
+        if self.connect is None:
+            raise RuntimeError("未配置样本表的数据库连接")
+        results = {}
+        for db_name, table in self.tables:
+            key = f"{db_name}.{table}"
+            try:
+                results[key] = self._refresh_table(db_name, table, full)
+            except Exception as e:
+                metrics.incr("approx.sample_refresh_failed")
+                logger.warning(f"样本表刷新失败 - 表: {key}, 错误: {e}")
+                results[key] = {"error": str(e), "finished_at": time.time()}
+        return results
+
+    def _refresh_table(self, db_name: str, table: str, full: bool) -> Dict[str, Any]:
+        table_semantic = _table_semantic(db_name, table)
+        primary_key = _primary_key(table_semantic)
+        if not primary_key:
+            raise RuntimeError("语义模式中没有主键，无法确定性采样")
+        time_column = _time_column(table_semantic)
+        sample = sample_table_name(table, self.buckets)
+        started = time.monotonic()
+        with self._lock:
+            conn = self.connect(db_name)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(_CREATE_SAMPLE_SQL.format(sample=sample, source=table))
+                if full:
+                    cursor.execute(f"TRUNCATE TABLE `{sample}`")
+                since = None
+                if time_column and not full:
+                    cursor.execute(f"SELECT MAX(`{time_column}`) FROM `{sample}`")
+                    row = cursor.fetchone()
+                    if row and isinstance(row[0], datetime):
+                        since = row[0] - timedelta(seconds=self.lateness)
+                where = f"{_hash_expr(primary_key)} < %s"
+                params: Tuple[Any, ...] = (self.buckets,)
+                if since is not None:
+                    where = f"`{time_column}` >= %s AND {where}"
+                    params = (since,) + params
+                cursor.execute(_REFRESH_SAMPLE_SQL.format(sample=sample, source=table, where=where), params)
+                inserted = cursor.rowcount
+                conn.commit()
+            finally:
+                conn.close()
+
+        self._last_success[(db_name, table)] = time.monotonic()
+        stats = {
+            "sample_table": sample,
+            "since": since.isoformat() if since else None,
+            "rows": inserted,
+            "duration": time.monotonic() - started,
+            "finished_at": time.time(),
+        }
+        self.last_refresh[f"{db_name}.{table}"] = stats
+        metrics.observe("approx.sample_refresh_seconds", stats["duration"])
+        logger.info(f"样本表刷新完成 - 表: {db_name}.{sample}, 起点: {stats['since'] or '全量'}, "
+                    f"新增行数: {inserted}, 耗时: {stats['duration']:.2f}秒")
+        return stats
+
+    def start(self) -> None:
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sample-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.refresh()
+            if self._stop.wait(self.interval):
+                break
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.buckets / HASH_BUCKETS,
+            "tables": {
+                f"{db}.{table}": {
+                    "sample_table": sample_table_name(table, self.buckets),
+                    "fresh": self.sample_table(db, table) is not None,
+                }
+                for db, table in self.tables
+            },
+            "last_refresh": self.last_refresh,
+        }
+
+
+# 全局样本表管理器，由服务启动时配置连接
+sample_manager = SampleTableManager()
+
+
+# ---------------- 查询改写 ----------------
+
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_AGGREGATE_PATTERN = re.compile(
+    r"\b(SUM|AVG|MIN|MAX|COUNT)\s*\(\s*(DISTINCT\s+)?([^()]*?)\s*\)", re.IGNORECASE
+)
+
+
+class _Ineligible(Exception):
+    """查询无法在样本上估计"""
+
+
+class _Rewriter:
+    def __init__(self, source: str, target: str, buckets: int):
+        self.target = target
+        self.buckets = buckets
+        self.rate = buckets / HASH_BUCKETS
+        self._qualifier = re.compile(rf"`?\b{re.escape(source)}\b`?\s*\.\s*") if target != source else None
+
+    def retarget(self, expr: str) -> str:
+        """样本表上执行时把 原表.列 改为 样本表.列"""
+        if self._qualifier is None:
+            return expr
+        return self._qualifier.sub(f"`{self.target}`.", expr)
+
+    def _check(self, func: str, distinct: Optional[str], expr: str) -> None:
+        if func in ("MIN", "MAX"):
+            raise _Ineligible(f"{func} 无法从样本估计")
+        if distinct:
+            raise _Ineligible(f"{expr} 无法从样本估计")
+
+    def scale(self, expr: str) -> str:
+        """把 SUM/COUNT 放大到全表规模，AVG 不需要放大"""
+        if _AGGREGATE_PATTERN.search(_STRING_PATTERN.sub("''", expr)) is None:
+            return self.retarget(expr)
+
+        def aggregate(match: re.Match) -> str:
+            func = match.group(1).upper()
+            self._check(func, match.group(2), match.group(0))
+            if func == "AVG":
+                return match.group(0)
+            return f"({match.group(0)} * {HASH_BUCKETS} / {self.buckets})"
+
+        return _AGGREGATE_PATTERN.sub(aggregate, self.retarget(expr))
+
+    def estimate(self, expr: str) -> Tuple[str, str]:
+        """单个聚合列的 (估计值表达式, 误差范围表达式)
+
+        伯努利抽样下 SUM 的方差估计为 (1-p)/p² · Σx²，COUNT 为 (1-p)/p² · n；
+        AVG 为比率估计，方差约为 (1-p) · s²/n。
+        """
+        expr = self.retarget(expr)
+        match = _AGGREGATE_PATTERN.fullmatch(expr.strip())
+        if match is None:
+            raise _Ineligible(f"只支持单个聚合函数: {expr}")
+        func, distinct, arg = match.group(1).upper(), match.group(2), match.group(3)
+        self._check(func, distinct, expr)
+        keep = 1 - self.rate
+        if func == "COUNT":
+            spread = f"SQRT({keep:g} * COUNT({arg})) * {HASH_BUCKETS} / {self.buckets}"
+        elif func == "SUM":
+            # POW 返回 DOUBLE，避免 BIGINT 平方溢出
+            spread = f"SQRT({keep:g} * SUM(POW({arg}, 2))) * {HASH_BUCKETS} / {self.buckets}"
+        else:
+            spread = (f"SQRT({keep:g} * GREATEST(AVG(POW({arg}, 2)) - POW(AVG({arg}), 2), 0)"
+                      f" / COUNT({arg}))")
+        return self.scale(expr), f"{_Z} * {spread}"
+
+    def condition(self, cond, scale: bool) -> Any:
+        left = self.scale(cond.left) if scale else self.retarget(cond.left)
+        right = self.scale(cond.right) if scale else self.retarget(cond.right)
+        return cond.model_copy(update={"left": left, "right": right})
+
+
+def approximate_query(semantic, db_name: str, rate: float = APPROX_SAMPLE_RATE) -> Tuple[Optional[str], Dict[str, Any]]:
+    """把单表 SUM/COUNT/AVG 聚合查询改写为样本上的近似查询
+
+    每个聚合列输出按采样率放大的估计值，并增加一列 <列名>_margin 表示95%置信区间的半宽；
+    HAVING 与 ORDER BY 中的聚合同样放大，阈值和排序按全表规模比较。分组很小（样本中没有行）的结果可能缺失。
+
+    Returns:
+        (近似SQL，不可改写时为 None, 近似信息，包含 exact_sql)
+    """
+    from translator import render_mysql_sql, ColumnRef
+    from rollup import route_to_rollup
+
+    exact_sql = render_mysql_sql(semantic)
+    buckets = sample_buckets(rate)
+    info: Dict[str, Any] = {"applied": False, "exact_sql": exact_sql}
+    q = semantic.query
+    try:
+        if len(q.from_) != 1 or q.joins:
+            raise _Ineligible("只支持单表查询")
+        source = q.from_[0].strip("`")
+        if route_to_rollup(semantic):
+            raise _Ineligible("可由汇总表精确回答")
+        sample = sample_manager.sample_table(db_name, source) if buckets == sample_manager.buckets else None
+        if sample is None:
+            # MOD(CRC32(主键)) 无法使用索引，直接在原表上过滤仍要扫描每一行
+            raise _Ineligible(f"表 {source} 没有可用的样本表（未在 APPROX_SAMPLE_TABLES 中、采样率不同或未及时刷新）")
+
+        rewriter = _Rewriter(source, sample, buckets)
+        select: List[Any] = []
+        margin_columns: List[Any] = []
+        margins: Dict[str, str] = {}
+        for col in q.select:
+            if col.column.strip() == "*":
+                raise _Ineligible("SELECT *")
+            if not _AGGREGATE_PATTERN.search(_STRING_PATTERN.sub("''", col.column)):
+                select.append(col.model_copy(update={"table": sample}) if col.table else col)
+                continue
+            if col.table:
+                raise _Ineligible(f"无法识别的聚合列: {col.table}.{col.column}")
+            alias = col.alias or col.column.replace("`", "")
+            value, margin = rewriter.estimate(col.column)
+            select.append(ColumnRef(column=value, alias=alias))
+            margins[alias] = f"{alias}_margin"
+            margin_columns.append(ColumnRef(column=margin, alias=margins[alias]))
+        if not margins:
+            raise _Ineligible("不是聚合查询")
+        # 误差列放在原有列之后，结果的前几列与精确查询一致
+        select.extend(margin_columns)
+
+        where = [rewriter.condition(c, scale=False) for c in q.where or []]
+        rewritten = q.model_copy(update={
+            "select": select,
+            "from_": [sample],
+            "where": where,
+            "group_by": [rewriter.retarget(g) for g in q.group_by or []] or None,
+            "having": [rewriter.condition(c, scale=True) for c in q.having or []] or None,
+            "order_by": [o.model_copy(update={"by": rewriter.scale(o.by)}) for o in q.order_by or []] or None,
+        })
+    except _Ineligible as e:
+        metrics.incr("approx.ineligible")
+        info["reason"] = str(e)
+        return None, info
+
+    metrics.incr("approx.applied.sample_table")
+    info.update(
+        applied=True,
+        method="sample_table",
+        table=sample,
+        sample_rate=buckets / HASH_BUCKETS,
+        confidence=CONFIDENCE,
+        margins=margins,
+    )
+    return render_mysql_sql(semantic.model_copy(update={"query": rewritten})), info
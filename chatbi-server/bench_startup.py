@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+冷启动基准
+在全新的子进程中多次导入 app，统计就绪耗时，并用 -X importtime 输出按顶层包汇总的导入耗时明细
+
+用法: python bench_startup.py [重复次数] [明细条数]
+"""
+
+import os
+import re
+import sys
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+from app import HEAVY_MODULES
+
+_IMPORTTIME_PATTERN = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (场景, 导入语句)；第二个场景相当于把重型依赖放在模块顶层导入时的启动成本
+SCENARIOS = [
+    ("app（延迟导入）", "import app"),
+    ("app + 重型依赖（即时导入）", "import app; " + "; ".join(f"import {m}" for m in HEAVY_MODULES)),
+]
+
+
+def _run(code: str, importtime: bool = False) -> Tuple[float, str]:
+    """在新进程中执行代码，返回 (耗时秒数, stderr)"""
+    script = (
+        "import time; _t = time.perf_counter(); "
+        f"{code}; "
+        "print(time.perf_counter() - _t)"
+    )
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", script]
+    env = dict(os.environ, WARMUP_ENABLED="0")
+    proc = subprocess.run(args, cwd=_HERE, env=env, capture_output=True, text=True, check=True)
+    return float(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def import_breakdown(stderr: str) -> Dict[str, int]:
+    """把 -X importtime 输出按顶层包汇总自身耗时（微秒）"""
+    totals: Dict[str, int] = {}
+    for self_us, _, _, module in _IMPORTTIME_PATTERN.findall(stderr):
+        package = module.split(".")[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return totals
+
+
+def run(repeat: int = 5, top: int = 15):
+    print(f"=== 冷启动基准: 每个场景 {repeat} 次 ===")
+    for name, code in SCENARIOS:
+        timings: List[float] = [_run(code)[0] for _ in range(repeat)]
+        print(f"{name}: 中位数 {statistics.median(timings) * 1000:.0f} ms, "
+              f"最小 {min(timings) * 1000:.0f} ms, 最大 {max(timings) * 1000:.0f} ms")
+
+    _, stderr = _run("import app", importtime=True)
+    totals = import_breakdown(stderr)
+    overall = sum(totals.values()) or 1
+    print(f"\n=== import app 导入耗时明细（按顶层包，前 {top} 项）===")
+    for package, us in sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        print(f"{package:<28} {us / 1000:8.1f} ms  {us / overall:6.1%}")
+
+    loaded = [m for m in HEAVY_MODULES if re.search(rf"\|\s+{re.escape(m)}$", stderr, re.MULTILINE)]
+    print(f"\n启动时已导入的重型依赖: {', '.join(loaded) or '无'}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
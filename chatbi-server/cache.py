@@ -0,0 +1,105 @@
+"""
+缓存模块 - 翻译结果与查询结果的进程内缓存
+翻译缓存避免相同问题重复调用LLM，结果缓存避免短时间内重复执行相同SQL
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from metrics import metrics
+
+
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 3600.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """读取缓存，过期条目视为未命中"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at >= time.monotonic():
+                    self._data.move_to_end(key)
+                    metrics.incr(f"cache.{self.name}.hit")
+                    return value
+                del self._data[key]
+        metrics.incr(f"cache.{self.name}.miss")
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def contains(self, key: Hashable) -> bool:
+        """判断是否存在未过期条目（不计入命中统计）"""
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] >= time.monotonic()
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """按条件删除缓存条目，不传条件则清空，返回删除数量"""
+        with self._lock:
+            if predicate is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            size = len(self._data)
+        hits = metrics.get(f"cache.{self.name}.hit")
+        misses = metrics.get(f"cache.{self.name}.miss")
+        total = hits + misses
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+# 翻译缓存：键为 (db_name, model, 规范化问题, 物理结构摘要)
+translation_cache = TTLCache(
+    "translation",
+    maxsize=int(os.getenv("TRANSLATION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("TRANSLATION_CACHE_TTL", "86400")),
+)
+
+# 结果缓存：键为 (db_name, SQL)，默认短TTL以控制数据陈旧
+result_cache = TTLCache(
+    "result",
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", "60")),
+)
+
+# 增量刷新缓存：键为 (db_name, 查询形态, 参数, 时间列)，值为上一次的完整结果与水位线；
+# 过期后重新完整执行一次，纳入水位线之前迟到的数据
+delta_cache = TTLCache(
+    "delta",
+    maxsize=int(os.getenv("DELTA_CACHE_SIZE", "128")),
+    ttl=float(os.getenv("DELTA_CACHE_TTL", "600")),
+)
@@ -0,0 +1,105 @@
+"""
+会话模块 - 保存每个会话上一轮的语义SQL
+同一会话中的追问（如“只看最近7天”“按类别分组”）只让LLM输出对上一轮语义SQL的修改，
+合并后重新渲染，不再带着完整表结构重新生成整个查询
+"""
+
+import os
+import logging
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from cache import TTLCache
+from metrics import metrics
+from rollup import route_to_rollup
+from translator import (SemanticSQL, TranslationError, followup_to_semantic, nl_to_mysql,
+                        render_mysql_sql)
+
+logger = logging.getLogger(__name__)
+
+# 保存的会话数上限与会话空闲过期时间（秒）
+CONVERSATION_MAX = int(os.getenv("CONVERSATION_MAX", "1000"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "1800"))
+
+
+class Turn(NamedTuple):
+    """会话的最近一轮"""
+    db_name: str
+    question: str
+    semantic: SemanticSQL
+    turns: int
+
+
+class ConversationStore:
+    """conversation_id -> 最近一轮的语义SQL，按LRU淘汰，空闲超过 ttl 过期"""
+
+    def __init__(self, maxsize: int = CONVERSATION_MAX, ttl: float = CONVERSATION_TTL):
+        self._turns = TTLCache("conversation", maxsize=maxsize, ttl=ttl)
+
+    def last(self, conversation_id: str, db_name: str) -> Optional[Turn]:
+        """会话的最近一轮；换了数据库的会话不作为追问"""
+        turn = self._turns.get(conversation_id)
+        if turn is None or turn.db_name != db_name:
+            return None
+        return turn
+
+    def remember(self, conversation_id: str, db_name: str, question: str, semantic: SemanticSQL,
+                 previous: Optional[Turn] = None) -> Turn:
+        turn = Turn(db_name, question, semantic.model_copy(deep=True), previous.turns + 1 if previous else 1)
+        self._turns.set(conversation_id, turn)
+        return turn
+
+    def forget(self, conversation_id: str) -> bool:
+        return self._turns.invalidate(lambda key: key == conversation_id) > 0
+
+    def stats(self) -> Dict[str, Any]:
+        return self._turns.stats()
+
+
+conversations = ConversationStore()
+
+
+def translate_turn(
+    question: str,
+    conversation_id: Optional[str] = None,
+    followup: bool = True,
+    model: str = "qwen2.5:7b",
+    base_url: Optional[str] = None,
+    db_name: str = "shop",
+    mode: Optional[str] = None,
+    remember: bool = True,
+) -> Tuple[SemanticSQL, str, bool]:
+    """翻译会话中的一轮问题，返回 (语义SQL, SQL, 是否按追问增量翻译)
+
+    会话有上一轮且 followup 为真时按追问翻译；模型判断为新问题或追问解析失败时完整翻译。
+    没有 conversation_id 时与 nl_to_mysql 相同。
+    remember 为真时翻译成功即记为会话的最近一轮；需要执行成功才记录的调用方传 False，
+    执行成功后再调用 remember_turn。
+    """
+    previous = conversations.last(conversation_id, db_name) if conversation_id and followup else None
+    semantic = None
+    if previous is not None:
+        try:
+            semantic = followup_to_semantic(question, previous.semantic, model=model, base_url=base_url,
+                                            db_name=db_name)
+        except TranslationError as e:
+            metrics.incr("followup.failed")
+            logger.warning(f"追问增量翻译失败，改为完整翻译 - 问题: '{question}', 错误: {e}")
+
+    followed = semantic is not None
+    if followed:
+        sql = route_to_rollup(semantic) or render_mysql_sql(semantic)
+    else:
+        semantic, sql = nl_to_mysql(question=question, model=model, base_url=base_url, db_name=db_name, mode=mode)
+
+    if remember:
+        remember_turn(conversation_id, db_name, question, semantic, followed)
+    return semantic, sql, followed
+
+
+def remember_turn(conversation_id: Optional[str], db_name: str, question: str, semantic: SemanticSQL,
+                  followed: bool) -> Optional[Turn]:
+    """把一轮记为会话的最近一轮；按追问翻译的轮次累加轮数，完整翻译的轮次作为会话的新起点"""
+    if not conversation_id:
+        return None
+    previous = conversations.last(conversation_id, db_name) if followed else None
+    return conversations.remember(conversation_id, db_name, question, semantic, previous)
@@ -0,0 +1,273 @@
+"""
+数据源注册模块 - 把每个 db_name 映射到主库与只读副本
+每个节点有独立的有上限连接池；只读查询在复制延迟可接受的健康副本间按负载分配，
+没有可用副本时回退到主库，写入和维护任务始终使用主库
+"""
+
+import os
+import json
+import time
+import itertools
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from db_pool import ConnectionPool, MYSQL_POOL_SIZE
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 数据源配置：DATASOURCES 为JSON字符串，DATASOURCES_FILE 为JSON/YAML文件路径，前者优先
+DATASOURCES = os.getenv("DATASOURCES", "")
+DATASOURCES_FILE = os.getenv("DATASOURCES_FILE", "")
+# 副本健康检查间隔（秒）与默认的最大可接受复制延迟（秒）
+DATASOURCE_HEALTH_INTERVAL = float(os.getenv("DATASOURCE_HEALTH_INTERVAL", "5"))
+DATASOURCE_MAX_LAG = float(os.getenv("DATASOURCE_MAX_LAG", "30"))
+
+# 连接参数中不传给 mysql.connector 的字段
+_ENDPOINT_OPTIONS = ("name", "pool_size")
+_LAG_COLUMNS = ("Seconds_Behind_Source", "Seconds_Behind_Master")
+# 表示节点不可达或连接断开的客户端错误码（区别于SQL本身的错误）
+_CONNECTION_ERRNOS = {2002, 2003, 2005, 2006, 2013, 2055}
+
+
+def is_connection_error(error: Exception) -> bool:
+    return getattr(error, "errno", None) in _CONNECTION_ERRNOS
+
+
+class Endpoint:
+    """数据源中的一个MySQL节点"""
+
+    def __init__(self, name: str, role: str, config: Dict[str, Any], pool_size: int = MYSQL_POOL_SIZE,
+                 db_name: str = ""):
+        self.name = name
+        self.role = role
+        self.config = config
+        self.pool = ConnectionPool(self.connect, size=pool_size, name=f"{db_name}.{name}")
+        self.healthy = True
+        self.lag: Optional[float] = 0.0
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def connect(self):
+        import mysql.connector
+
+        # 连接会被连接池复用，autocommit 避免停留在上一次查询的事务快照上
+        return mysql.connector.connect(**{**self.config, "autocommit": True})
+
+    @property
+    def load(self) -> float:
+        stats = self.pool.stats()
+        return stats["in_use"] / max(1, stats["size"])
+
+    def mark_down(self, error: str) -> None:
+        if self.healthy:
+            logger.warning(f"数据库节点不可用 - 节点: {self.name}, 错误: {error}")
+        self.healthy = False
+        self.last_error = error
+        self.pool.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "role": self.role,
+            "host": f"{self.config.get('host')}:{self.config.get('port')}",
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+            "pool": self.pool.stats(),
+        }
+
+
+class Datasource:
+    """一个 db_name 对应的主库与只读副本"""
+
+    def __init__(self, db_name: str, primary: Endpoint, replicas: List[Endpoint], max_lag: float):
+        self.db_name = db_name
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self._next = itertools.count()
+
+    def choose(self, read_only: bool = True) -> Endpoint:
+        """只读查询在复制延迟不超过 max_lag 的健康副本中选负载最低的，负载相同时轮询；没有可用副本时使用主库"""
+        if read_only:
+            candidates = [r for r in self.replicas
+                          if r.healthy and r.lag is not None and r.lag <= self.max_lag]
+            if candidates:
+                lowest = min(r.load for r in candidates)
+                idle = [r for r in candidates if r.load == lowest]
+                return idle[next(self._next) % len(idle)]
+            if self.replicas:
+                metrics.incr("datasource.replica_fallback")
+        return self.primary
+
+    @property
+    def endpoints(self) -> List[Endpoint]:
+        return [self.primary] + self.replicas
+
+
+def _load_config() -> Dict[str, Any]:
+    if DATASOURCES:
+        return json.loads(DATASOURCES)
+    if DATASOURCES_FILE:
+        with open(DATASOURCES_FILE, "r", encoding="utf-8") as f:
+            if DATASOURCES_FILE.endswith(".json"):
+                return json.load(f)
+            import yaml  # 只有用到YAML文件时才需要 PyYAML
+            return yaml.safe_load(f) or {}
+    return {}
+
+
+class DatasourceRegistry:
+    """db_name -> 数据源
+
+    未配置的 db_name 使用默认连接参数（MYSQL_HOST 等）上同名的数据库，只有主库。
+    配置格式（节点中未写的连接参数取默认值，database 默认为 db_name）：
+
+        {"network": {"primary": {"host": "db1"},
+                     "replicas": [{"host": "db2"}, {"host": "db3", "pool_size": 16}],
+                     "max_lag": 10}}
+    """
+
+    def __init__(self, default_config: Dict[str, Any], config: Optional[Dict[str, Any]] = None,
+                 health_interval: float = DATASOURCE_HEALTH_INTERVAL):
+        self.default_config = dict(default_config)
+        self.config = config or {}
+        self.health_interval = health_interval
+        self._datasources: Dict[str, Datasource] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, default_config: Dict[str, Any]) -> "DatasourceRegistry":
+        try:
+            config = _load_config()
+        except (OSError, ValueError) as e:
+            logger.error(f"加载数据源配置失败，所有数据库使用默认连接: {e}")
+            config = {}
+        return cls(default_config, config)
+
+    def _endpoint(self, db_name: str, name: str, role: str, spec: Dict[str, Any]) -> Endpoint:
+        config = {**self.default_config, "database": db_name}
+        config.update({k: v for k, v in spec.items() if k not in _ENDPOINT_OPTIONS})
+        return Endpoint(spec.get("name", name), role, config,
+                        pool_size=int(spec.get("pool_size", MYSQL_POOL_SIZE)), db_name=db_name)
+
+    def _build(self, db_name: str) -> Datasource:
+        spec = self.config.get(db_name) or {}
+        primary = self._endpoint(db_name, "primary", "primary", spec.get("primary") or {})
+        replicas = [self._endpoint(db_name, f"replica{i}", "replica", r)
+                    for i, r in enumerate(spec.get("replicas") or [], 1)]
+        return Datasource(db_name, primary, replicas, float(spec.get("max_lag", DATASOURCE_MAX_LAG)))
+
+    def get(self, db_name: str) -> Datasource:
+        with self._lock:
+            datasource = self._datasources.get(db_name)
+            if datasource is None:
+                datasource = self._datasources[db_name] = self._build(db_name)
+            return datasource
+
+    def choose(self, db_name: str, read_only: bool = True) -> Endpoint:
+        endpoint = self.get(db_name).choose(read_only)
+        metrics.incr(f"datasource.routed.{endpoint.role}")
+        return endpoint
+
+    def connect_primary(self, db_name: str):
+        """新建一个主库连接（不经过连接池），用于 EXPLAIN、汇总表刷新等后台任务"""
+        return self.get(db_name).primary.connect()
+
+    # ---- 副本健康检查 ----
+
+    def check_replica(self, endpoint: Endpoint) -> None:
+        """读取副本的复制延迟；复制线程停止（延迟为 NULL）或无法连接时标记为不可用"""
+        endpoint.last_check = time.time()
+        try:
+            with endpoint.pool.connection(timeout=self.health_interval) as conn:
+                lag = self._replication_lag(conn)
+        except Exception as e:
+            metrics.incr("datasource.health_failures")
+            endpoint.mark_down(str(e))
+            return
+        endpoint.lag = lag
+        if lag is None:
+            endpoint.mark_down("复制已停止")
+            return
+        if not endpoint.healthy:
+            logger.info(f"数据库节点恢复可用 - 节点: {endpoint.name}, 复制延迟: {lag}秒")
+        endpoint.healthy = True
+        endpoint.last_error = None
+
+    @staticmethod
+    def _replication_lag(conn) -> Optional[float]:
+        cursor = conn.cursor()
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Exception:
+                # MySQL 8.0.22 之前只有 SHOW SLAVE STATUS
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            names = [d[0] for d in cursor.description or []]
+        finally:
+            cursor.close()
+        if row is None:
+            # 没有配置复制的只读节点视为没有延迟
+            return 0.0
+        status = dict(zip(names, row))
+        for column in _LAG_COLUMNS:
+            if column in status:
+                value = status[column]
+                return None if value is None else float(value)
+        return 0.0
+
+    def check_all(self) -> None:
+        with self._lock:
+            datasources = list(self._datasources.values())
+        for datasource in datasources:
+            for replica in datasource.replicas:
+                self.check_replica(replica)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"数据源健康检查异常: {e}")
+
+    def start(self) -> None:
+        """预先创建配置中的数据源并启动副本健康检查线程（没有配置副本时不启动）"""
+        for db_name in self.config:
+            self.get(db_name)
+        if not any(ds.replicas for ds in self._datasources.values()):
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.check_all()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="datasource-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            datasources = list(self._datasources.values())
+        for datasource in datasources:
+            for endpoint in datasource.endpoints:
+                endpoint.pool.close()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            datasources = list(self._datasources.values())
+        return {
+            ds.db_name: {
+                "max_lag": ds.max_lag,
+                "endpoints": [e.status() for e in ds.endpoints],
+            }
+            for ds in datasources
+        }
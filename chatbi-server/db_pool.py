@@ -0,0 +1,197 @@
+"""
+数据库连接池模块 - 复用MySQL连接，避免每次查询都重新建立连接
+连接数有上限，借用时超过上限会等待；空闲超过回收时间的连接丢弃重建，执行出错的连接不再放回。
+每个连接上按查询形态缓存服务端预处理语句，同一形态的查询再次执行时跳过解析
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "8"))
+# 借用连接的最长等待时间（秒）
+MYSQL_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "10"))
+# 空闲超过该时间的连接不再复用（应小于MySQL的 wait_timeout）
+MYSQL_POOL_RECYCLE = float(os.getenv("MYSQL_POOL_RECYCLE", "1800"))
+# 是否使用服务端预处理语句执行参数化查询，以及每个连接上最多缓存的预处理语句数
+MYSQL_PREPARED_STATEMENTS = os.getenv("MYSQL_PREPARED_STATEMENTS", "1") == "1"
+MYSQL_PREPARED_CACHE_SIZE = int(os.getenv("MYSQL_PREPARED_CACHE_SIZE", "64"))
+
+
+class PoolTimeout(TimeoutError):
+    """等待可用连接超时"""
+
+
+class ConnectionPool:
+    """有上限的连接池
+
+    connect 每次返回一个新连接；连接应为 autocommit 模式，否则复用的连接会停留在旧的事务快照上。
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        size: int = MYSQL_POOL_SIZE,
+        timeout: float = MYSQL_POOL_TIMEOUT,
+        recycle: float = MYSQL_POOL_RECYCLE,
+        name: str = "mysql",
+    ):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.name = name
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: Deque[Tuple[Any, float]] = deque()
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._created = 0
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        """借用一个连接，用完必须调用 release"""
+        started = time.time()
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            metrics.incr(f"pool.{self.name}.timeouts")
+            raise PoolTimeout(f"等待数据库连接超时 - 连接池: {self.name}, 上限: {self.size}")
+        metrics.observe(f"pool.{self.name}.wait_seconds", time.time() - started)
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = self.connect()
+                with self._lock:
+                    self._created += 1
+                metrics.incr(f"pool.{self.name}.created")
+            else:
+                metrics.incr(f"pool.{self.name}.reused")
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def _take_idle(self) -> Any:
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, released_at = self._idle.pop()
+            if now - released_at < self.recycle:
+                return conn
+            self._close(conn)
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        """归还连接；discard 为真（执行出错、结果未读完）时关闭连接而不是放回"""
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if discard:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.time()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Any]:
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+
+    @staticmethod
+    def _close(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """关闭所有空闲连接，借出的连接归还时仍会放回"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "created": self._created,
+            }
+
+
+class StatementCache:
+    """每个连接上的预处理语句缓存，按参数化SQL原文LRU淘汰
+
+    mysql.connector 的预处理游标只有再次执行同一个SQL字符串对象时才跳过 PREPARE，
+    所以缓存保存游标和首次执行的SQL字符串，之后相同文本的查询都用这个字符串对象执行。
+    按原文而不是查询形态区分：大小写、反引号不同的SQL返回的列名也不同。
+    连接同一时刻只借给一个线程，连接关闭后其缓存随连接一起释放。
+    """
+
+    def __init__(self, size: int = MYSQL_PREPARED_CACHE_SIZE):
+        self.size = size
+        self._statements: "WeakKeyDictionary[Any, OrderedDict]" = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _for(self, conn: Any) -> "OrderedDict[str, Tuple[Any, str]]":
+        with self._lock:
+            statements = self._statements.get(conn)
+            if statements is None:
+                statements = self._statements[conn] = OrderedDict()
+            return statements
+
+    def cursor(self, conn: Any, sql: str) -> Tuple[Any, str]:
+        """返回 (预处理游标, 要执行的SQL字符串)；没有缓存时新建游标，超出上限时关闭最久未用的语句"""
+        statements = self._for(conn)
+        entry = statements.get(sql)
+        if entry is not None:
+            statements.move_to_end(sql)
+            metrics.incr("prepared.reused")
+            return entry
+        entry = statements[sql] = (conn.cursor(prepared=True), sql)
+        metrics.incr("prepared.created")
+        while len(statements) > self.size:
+            _, (cursor, _) = statements.popitem(last=False)
+            self._close(cursor)
+            metrics.incr("prepared.evicted")
+        return entry
+
+    def discard(self, conn: Any, sql: str) -> None:
+        """执行出错后丢弃该语句"""
+        entry = self._for(conn).pop(sql, None)
+        if entry is not None:
+            self._close(entry[0])
+
+    @staticmethod
+    def _close(cursor: Any) -> None:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = [len(statements) for statements in self._statements.values()]
+        return {"enabled": MYSQL_PREPARED_STATEMENTS, "connections": len(counts), "statements": sum(counts)}
+
+
+statement_cache = StatementCache()
@@ -0,0 +1,366 @@
+"""
+增量刷新模块 - 自动刷新的时序查询只重新查询水位线之后的时间桶，与缓存的上一次结果合并
+在原SQL的 WHERE 中加上 原始时间列 >= 水位线 的条件：时间桶是原始时间向下取整，在桶起点上两者等价；
+水位线所在的桶可能还不完整，会与之后的新桶一起重新计算，刷新开销只取决于新数据量
+"""
+
+import re
+import logging
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from cache import delta_cache
+from metrics import metrics
+from sql_fingerprint import Token, iter_tokens
+
+logger = logging.getLogger(__name__)
+
+# 顶层子句关键字，用于定位 WHERE 的范围和插入位置
+_CLAUSES = ("FROM", "WHERE", "GROUP", "HAVING", "WINDOW", "ORDER", "LIMIT", "FOR", "LOCK", "INTO", "UNION")
+# 取当前时间的函数：出现在 WHERE 中表示相对时间窗口，窗口起点随时间移动
+_NOW_FUNCTIONS = {"NOW", "CURDATE", "CURRENT_DATE", "CURRENT_TIMESTAMP", "SYSDATE", "UTC_DATE",
+                  "UTC_TIMESTAMP", "LOCALTIME", "LOCALTIMESTAMP", "UNIX_TIMESTAMP"}
+# 时间桶表达式必须是向下取整（桶 <= 原始时间），出现这些函数或运算时可能把时间往后移
+_NON_FLOOR = {"INTERVAL", "DATE_ADD", "ADDDATE", "ADDTIME", "TIMESTAMPADD", "CEIL", "CEILING", "ROUND",
+              "LAST_DAY", "+", "-"}
+# 聚合函数：时间列是聚合值（如 MAX(时间) AS 最后出现）时，按时间过滤会改变旧分组的值
+_AGGREGATES = {"COUNT", "SUM", "AVG", "MIN", "MAX", "GROUP_CONCAT", "STD", "STDDEV", "STDDEV_POP", "STDDEV_SAMP",
+               "VARIANCE", "VAR_POP", "VAR_SAMP", "BIT_AND", "BIT_OR", "BIT_XOR", "JSON_ARRAYAGG",
+               "JSON_OBJECTAGG", "ANY_VALUE"}
+# 表达式中不是列名的关键字
+_NON_COLUMN_WORDS = {"AS", "AND", "OR", "NOT", "NULL", "IS", "IN", "LIKE", "BETWEEN", "CASE", "WHEN", "THEN",
+                     "ELSE", "END", "DIV", "MOD", "DISTINCT", "TRUE", "FALSE", "SIGNED", "UNSIGNED", "CHAR",
+                     "DATE", "DATETIME", "DECIMAL", "BINARY", "MICROSECOND", "SECOND", "MINUTE", "HOUR", "DAY",
+                     "WEEK", "MONTH", "QUARTER", "YEAR"}
+_DATETIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$")
+
+
+class _Ineligible(Exception):
+    """查询无法增量刷新"""
+
+
+class DeltaPlan(NamedTuple):
+    time_column: str
+    # 时间桶表达式引用的原始时间列（SQL原文）
+    source_column: str
+    # WHERE 关键字之后的位置，没有 WHERE 时为 None
+    where_at: Optional[int]
+    # WHERE 子句结束（没有 WHERE 时为插入 WHERE）的位置
+    where_end: int
+    # 相对时间窗口的起点表达式
+    window_start: Optional[str]
+    limit: Optional[int]
+
+    def render(self, sql: str, since: datetime) -> str:
+        condition = f"{self.source_column} >= '{since.isoformat(sep=' ')}'"
+        if self.where_at is None:
+            return f"{sql[:self.where_end].rstrip()} WHERE {condition} {sql[self.where_end:].lstrip()}".rstrip()
+        return (f"{sql[:self.where_at]} {condition} AND ({sql[self.where_at:self.where_end].strip()}) "
+                f"{sql[self.where_end:].lstrip()}").rstrip()
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str) and _DATETIME_PATTERN.match(value):
+        return datetime.fromisoformat(value)
+    return None
+
+
+def _split(tokens: List[Token], depths: List[int], start: int, end: int, sep: str) -> List[Tuple[int, int]]:
+    """在顶层（括号外）按分隔符切分 tokens[start:end]，返回各段的下标范围"""
+    parts, begin = [], start
+    for i in range(start, end):
+        if depths[i] == 0 and tokens[i].text.upper() == sep:
+            parts.append((begin, i))
+            begin = i + 1
+    parts.append((begin, end))
+    return parts
+
+
+def _identifier(token: Token) -> str:
+    return token.text[1:-1].replace("``", "`") if token.kind == "quoted" else token.text
+
+
+def _column_refs(tokens: List[Token]) -> List[Tuple[str, str]]:
+    """表达式中引用的列：(SQL原文, 不带表名的列名)"""
+    refs = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        following = tokens[i + 1].text if i + 1 < len(tokens) else ""
+        is_name = token.kind == "quoted" or (token.kind == "word" and token.text.upper() not in _NON_COLUMN_WORDS)
+        if not is_name or following == "(":
+            i += 1
+            continue
+        # 表名.列名
+        if following == "." and i + 2 < len(tokens) and tokens[i + 2].kind in ("word", "quoted"):
+            refs.append((f"{token.text}.{tokens[i + 2].text}", _identifier(tokens[i + 2])))
+            i += 3
+            continue
+        refs.append((token.text, _identifier(token)))
+        i += 1
+    return refs
+
+
+def _select_item(tokens: List[Token], sql: str) -> Tuple[str, List[Token]]:
+    """(结果列名, 表达式tokens)；未写别名的表达式以原文作为列名，与MySQL一致"""
+    if tokens and tokens[0].text.upper() == "DISTINCT":
+        tokens = tokens[1:]
+    if len(tokens) >= 3 and tokens[-2].text.upper() == "AS":
+        return _identifier(tokens[-1]), tokens[:-2]
+    if len(tokens) >= 2 and tokens[-1].kind in ("word", "quoted") and tokens[-2].text not in (".",) \
+            and (tokens[-2].kind in ("word", "quoted") or tokens[-2].text == ")"):
+        return _identifier(tokens[-1]), tokens[:-1]
+    if len(tokens) == 1 or (len(tokens) == 3 and tokens[1].text == "."):
+        return _identifier(tokens[-1]), tokens
+    return sql[tokens[0].start:tokens[-1].end], tokens
+
+
+def _has_aggregate(tokens: List[Token]) -> bool:
+    return any(t.kind == "word" and t.text.upper() in _AGGREGATES and i + 1 < len(tokens) and tokens[i + 1].text == "("
+               for i, t in enumerate(tokens))
+
+
+def _normalized(tokens: List[Token]) -> str:
+    return "".join(_identifier(t) if t.kind == "quoted" else t.text for t in tokens).upper()
+
+
+def _check_grouping(tokens: List[Token], depths: List[int], clauses: Dict[str, int], select_index: int,
+                    name: str, expr: List[Token]) -> None:
+    """聚合查询必须按时间桶分组：每个分组只包含一个时间桶，水位线之后的分组才可以整体替换"""
+    if "GROUP" not in clauses:
+        raise _Ineligible("聚合查询没有按时间列分组")
+    start = clauses["GROUP"] + 1
+    if start < len(tokens) and tokens[start].text.upper() == "BY":
+        start += 1
+    end = min((clauses[c] for c in ("HAVING", "WINDOW", "ORDER", "LIMIT", "FOR", "LOCK") if c in clauses),
+              default=len(tokens))
+    if any(t.text.upper() == "ROLLUP" for t in tokens[start:end]):
+        raise _Ineligible("不支持 WITH ROLLUP")
+    accepted = {name.upper(), _normalized(expr), str(select_index)}
+    for begin, stop in _split(tokens, depths, start, end, ","):
+        item = tokens[begin:stop]
+        if item and item[-1].text.upper() in ("ASC", "DESC"):
+            item = item[:-1]
+        if _normalized(item) in accepted:
+            return
+    raise _Ineligible(f"聚合查询的 GROUP BY 中没有时间列: {name}")
+
+
+def plan_delta(sql: str, time_column: str) -> DeltaPlan:
+    """分析时序查询，确定时间桶列对应的原始时间列和条件插入位置"""
+    tokens = list(iter_tokens(sql))
+    while tokens and tokens[-1].text == ";":
+        tokens.pop()
+    if not tokens or tokens[0].text.upper() != "SELECT":
+        raise _Ineligible("不是 SELECT 查询")
+
+    depths: List[int] = []
+    clauses: Dict[str, int] = {}
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.text == ")":
+            depth -= 1
+        depths.append(depth)
+        if token.text == "(":
+            depth += 1
+        upper = token.text.upper()
+        if depth == 0 and token.kind == "word" and upper in _CLAUSES and upper not in clauses:
+            clauses[upper] = i
+    if "UNION" in clauses or "INTO" in clauses:
+        raise _Ineligible("不支持 UNION / INTO")
+    if "FROM" not in clauses:
+        raise _Ineligible("没有 FROM 子句")
+
+    # 在 SELECT 列表中找到时间桶列
+    source = None
+    for index, (begin, end) in enumerate(_split(tokens, depths, 1, clauses["FROM"], ","), start=1):
+        name, expr = _select_item(tokens[begin:end], sql)
+        if name.lower() != time_column.lower():
+            continue
+        if _has_aggregate(expr):
+            raise _Ineligible(f"时间列是聚合值: {sql[expr[0].start:expr[-1].end]}")
+        if "GROUP" in clauses or "HAVING" in clauses or _has_aggregate(tokens[1:clauses["FROM"]]):
+            _check_grouping(tokens, depths, clauses, index, name, expr)
+        words = {t.text.upper() for t in expr}
+        if words & _NON_FLOOR:
+            raise _Ineligible(f"时间桶表达式不是向下取整: {sql[expr[0].start:expr[-1].end]}")
+        refs = {text for text, _ in _column_refs(expr)}
+        if len(refs) != 1:
+            raise _Ineligible(f"时间桶表达式应只引用一个时间列: {sql[expr[0].start:expr[-1].end]}")
+        source = refs.pop()
+        break
+    if source is None:
+        raise _Ineligible(f"SELECT 中没有时间列: {time_column}")
+
+    after_where = [clauses[c] for c in ("GROUP", "HAVING", "WINDOW", "ORDER", "LIMIT", "FOR", "LOCK") if c in clauses]
+    end_index = min(after_where, default=len(tokens))
+    end_pos = tokens[end_index].start if end_index < len(tokens) else tokens[-1].end
+
+    window_start = None
+    where_at = None
+    if "WHERE" in clauses:
+        where = clauses["WHERE"]
+        where_at = tokens[where].end
+        if any(t.kind == "word" and t.text.upper() in _NOW_FUNCTIONS for t in tokens[where + 1:end_index]):
+            window_start = _window_start(tokens, depths, where + 1, end_index, source, sql)
+
+    limit = None
+    if "LIMIT" in clauses:
+        rest = tokens[clauses["LIMIT"] + 1:]
+        if len(rest) != 1 or not rest[0].text.isdigit():
+            raise _Ineligible("只支持 LIMIT n")
+        limit = int(rest[0].text)
+
+    return DeltaPlan(time_column, source, where_at, end_pos, window_start, limit)
+
+
+def _window_start(tokens: List[Token], depths: List[int], start: int, end: int, source: str, sql: str) -> str:
+    """相对时间窗口 原始时间列 >= 起点表达式 中的起点表达式"""
+    column = source.replace("`", "").split(".")[-1].lower()
+    parts = _split(tokens, depths, start, end, "AND")
+    for begin, stop in parts:
+        conjunct = tokens[begin:stop]
+        # BETWEEN a AND b 会被顶层 AND 拆开，不作为窗口起点条件
+        if any(t.text.upper() == "BETWEEN" for t in conjunct):
+            continue
+        refs = _column_refs(conjunct[:3])
+        op = next((i for i, t in enumerate(conjunct) if t.text in (">=", ">")), None)
+        if op is None or not refs or refs[0][1].lower() != column or op > 3 or op + 1 >= len(conjunct):
+            continue
+        return sql[conjunct[op + 1].start:conjunct[-1].end]
+    raise _Ineligible("相对时间窗口没有 时间列 >= 起点 的条件，无法确定窗口起点")
+
+
+def _detect_time_column(columns: List[str], data: List[Dict[str, Any]]) -> Optional[str]:
+    for column in columns:
+        value = next((row[column] for row in data if row.get(column) is not None), None)
+        if _as_datetime(value) is not None:
+            return column
+    return None
+
+
+def _order(rows: List[Dict[str, Any]], column: str) -> Optional[str]:
+    keys = [k for k in (_as_datetime(r.get(column)) for r in rows) if k is not None]
+    if len(keys) < 2:
+        return None
+    if all(a <= b for a, b in zip(keys, keys[1:])):
+        return "asc"
+    if all(a >= b for a, b in zip(keys, keys[1:])):
+        return "desc"
+    return None
+
+
+def merge_rows(
+    prior: List[Dict[str, Any]],
+    fresh: List[Dict[str, Any]],
+    column: str,
+    since: datetime,
+    window_start: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """水位线之前的旧行保留，之后的时间桶整体换成新查到的行
+
+    相对时间窗口中已移出窗口的旧桶被丢弃（窗口起点所在、不完整的旧桶也一并丢弃）。
+    结果按时间升序或降序时保持原有顺序，有 LIMIT 时合并后再截断。
+    """
+    order = _order(prior, column) or _order(fresh, column)
+    if limit is not None and order is None:
+        raise _Ineligible("带 LIMIT 的结果没有按时间排序")
+
+    kept = []
+    for row in prior:
+        key = _as_datetime(row.get(column))
+        if key is not None and (key >= since or (window_start is not None and key < window_start)):
+            continue
+        kept.append(row)
+    merged = fresh + kept if order == "desc" else kept + fresh
+    return merged[:limit] if limit is not None else merged
+
+
+class DeltaState(NamedTuple):
+    columns: List[str]
+    data: List[Dict[str, Any]]
+    time_column: str
+    watermark: datetime
+
+
+def _watermark(data: List[Dict[str, Any]], column: str) -> Optional[datetime]:
+    return max((k for k in (_as_datetime(r.get(column)) for r in data) if k is not None), default=None)
+
+
+def incremental_refresh(
+    sql: str,
+    db_name: str,
+    execute: Callable[..., Tuple[List[Dict[str, Any]], List[str], int, Optional[str]]],
+    since: Optional[str] = None,
+    time_column: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], List[str], int, Optional[str], Dict[str, Any]]:
+    """增量执行时序查询
+
+    有缓存的上一次结果且客户端传入水位线时，只查询 min(客户端水位线, 缓存水位线) 之后的时间桶并合并；
+    否则完整执行一次并缓存结果。
+
+    Args:
+        execute: 与 execute_mysql_query 相同签名的执行函数
+        since: 客户端上一次拿到的水位线（时间列的最大值）
+        time_column: 结果中的时间桶列，不传时取第一个时间类型的列
+
+    Returns:
+        (数据, 列名, 总行数, result_id, 增量刷新信息)
+    """
+    # 与结果缓存相同按SQL原文区分，保存的行以结果列名为键
+    key = (db_name, sql, time_column)
+    state: Optional[DeltaState] = delta_cache.get(key)
+    client_since = _as_datetime(since) if since else None
+    info: Dict[str, Any] = {"applied": False}
+
+    if state is not None and client_since is not None:
+        lower = min(client_since, state.watermark)
+        try:
+            plan = plan_delta(sql, state.time_column)
+            window_start = None
+            if plan.window_start is not None:
+                rows, _, _, _ = execute(f"SELECT {plan.window_start} AS window_start", db_name, use_cache=False)
+                window_start = _as_datetime(rows[0]["window_start"]) if rows else None
+            fresh, columns, _, result_id = execute(plan.render(sql, lower), db_name, use_cache=False)
+            if result_id is not None or columns != state.columns:
+                raise _Ineligible("增量结果过大或列发生变化")
+            data = merge_rows(state.data, fresh, state.time_column, lower, window_start, plan.limit)
+        except _Ineligible as e:
+            metrics.incr("delta.fallback")
+            logger.info(f"增量刷新回退为完整执行 - 原因: {e}")
+            info["reason"] = str(e)
+        else:
+            watermark = _watermark(data, state.time_column) or state.watermark
+            delta_cache.set(key, DeltaState(columns, data, state.time_column, watermark))
+            metrics.incr("delta.applied")
+            metrics.observe("delta.fetched_rows", len(fresh))
+            info.update(applied=True, time_column=state.time_column, since=lower.isoformat(sep=" "),
+                        fetched_rows=len(fresh), watermark=watermark.isoformat(sep=" "))
+            return data, columns, len(data), None, info
+    elif state is None:
+        info["reason"] = "没有可合并的上一次结果"
+    else:
+        info["reason"] = "未提供水位线"
+
+    data, columns, row_count, result_id = execute(sql, db_name)
+    column = time_column or _detect_time_column(columns, data)
+    if result_id is not None:
+        info["reason"] = "结果过大，不缓存用于增量刷新"
+    elif column is None or column not in columns:
+        info["reason"] = "结果中没有时间列"
+    else:
+        try:
+            plan_delta(sql, column)
+        except _Ineligible as e:
+            info["reason"] = str(e)
+        else:
+            watermark = _watermark(data, column)
+            if watermark is not None:
+                delta_cache.set(key, DeltaState(columns, data, column, watermark))
+                info.update(time_column=column, watermark=watermark.isoformat(sep=" "))
+    return data, columns, row_count, result_id, info
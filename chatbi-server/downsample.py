@@ -0,0 +1,234 @@
+"""
+时序结果降采样模块 - 在返回给图表之前把大结果压缩到目标点数
+自动识别时间/数值类型的横轴列与数值序列列，按 LTTB（最大三角形三桶）或分桶最小/最大值保留形状特征点，
+返回的点数只取决于目标点数，与查询结果大小无关
+"""
+
+import os
+import re
+import logging
+from array import array
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 客户端可请求的最大目标点数
+DOWNSAMPLE_MAX_POINTS = int(os.getenv("DOWNSAMPLE_MAX_POINTS", "10000"))
+# 识别列类型时检查的非空值个数
+DOWNSAMPLE_SAMPLE_ROWS = 100
+
+METHODS = ("lttb", "minmax")
+
+_DATETIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?$")
+_NUMERIC_PATTERN = re.compile(r"^[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?$")
+_NAN = float("nan")
+
+
+def _is_datetime(value: Any) -> bool:
+    # DATE 列在内存结果中是 date，落盘后是字符串，两者都作为时间横轴
+    return isinstance(value, date) or (isinstance(value, str) and bool(_DATETIME_PATTERN.match(value)))
+
+
+def _is_number(value: Any) -> bool:
+    if isinstance(value, bool):
+        return False
+    # 落盘结果中的 Decimal 以字符串保存
+    if isinstance(value, str):
+        return bool(_NUMERIC_PATTERN.match(value))
+    return isinstance(value, (int, float, Decimal))
+
+
+def _time_to_float(value: Any) -> float:
+    if value is None:
+        return _NAN
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value.timestamp()
+
+
+def _number_to_float(value: Any) -> float:
+    if value is None:
+        return _NAN
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+def detect_series(columns: List[str], rows: Iterable[Sequence[Any]]) -> Tuple[Optional[int], bool, List[int], str]:
+    """识别横轴列与数值序列列
+
+    Returns:
+        (横轴列下标, 横轴是否为时间, 序列列下标列表, 不可降采样时的原因)
+    """
+    samples: List[List[Any]] = [[] for _ in columns]
+    for row in rows:
+        for i, value in enumerate(row):
+            if value is not None and len(samples[i]) < DOWNSAMPLE_SAMPLE_ROWS:
+                samples[i].append(value)
+        if all(len(s) >= DOWNSAMPLE_SAMPLE_ROWS for s in samples):
+            break
+
+    kinds = []
+    for values in samples:
+        if values and all(_is_datetime(v) for v in values):
+            kinds.append("time")
+        elif values and all(_is_number(v) for v in values):
+            kinds.append("number")
+        else:
+            kinds.append("other")
+
+    x = kinds.index("time") if "time" in kinds else kinds.index("number") if "number" in kinds else None
+    if x is None:
+        return None, False, [], "没有时间或数值类型的横轴列"
+    others = [columns[i] for i, k in enumerate(kinds) if i != x and k != "number"]
+    if others:
+        # 按分类列拆分的多条序列（如每个IP一条线）交错在一起，按行降采样会打乱各条序列
+        return None, False, [], f"存在非数值列: {', '.join(others)}"
+    series = [i for i, k in enumerate(kinds) if i != x]
+    if not series:
+        return None, False, [], "没有数值序列列"
+    return x, kinds[x] == "time", series, ""
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets：首尾点保留，中间每个桶选出与前一选中点、后一桶均值构成三角形面积最大的点"""
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    selected = [0]
+    bucket = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        next_start, next_end = end, min(int((i + 2) * bucket) + 1, n)
+        # 下一个桶的平均点；最后一个桶取末尾点
+        count = next_end - next_start
+        if count > 0:
+            avg_x = sum(xs[next_start:next_end]) / count
+            valid = [y for y in ys[next_start:next_end] if y == y]
+            avg_y = sum(valid) / len(valid) if valid else 0.0
+        else:
+            avg_x, avg_y = xs[n - 1], ys[n - 1]
+        ax, ay = xs[a], ys[a]
+        if ay != ay:
+            ay = 0.0
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            y = ys[j]
+            if y != y:
+                continue
+            area = abs((ax - avg_x) * (y - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def minmax_indices(ys: Sequence[float], buckets: int) -> List[int]:
+    """按行数均分为若干桶，每桶保留最小值与最大值所在的点，峰值不会被平滑掉"""
+    n = len(ys)
+    if buckets * 2 >= n or buckets < 1:
+        return list(range(n))
+    selected = {0, n - 1}
+    size = n / buckets
+    for b in range(buckets):
+        start, end = int(b * size), int((b + 1) * size)
+        lo = hi = None
+        for j in range(start, end):
+            y = ys[j]
+            if y != y:
+                continue
+            if lo is None or y < ys[lo]:
+                lo = j
+            if hi is None or y > ys[hi]:
+                hi = j
+        if lo is not None:
+            selected.update((lo, hi))
+    return sorted(selected)
+
+
+def select_points(xs: Sequence[float], series: List[Sequence[float]], target: int, method: str) -> List[int]:
+    """对每条序列分别降采样后合并选中的下标，多条序列平分目标点数"""
+    selected: Set[int] = set()
+    if method == "minmax":
+        buckets = max(1, target // (2 * len(series)))
+        for ys in series:
+            selected.update(minmax_indices(ys, buckets))
+    else:
+        threshold = max(3, target // len(series))
+        for ys in series:
+            selected.update(lttb_indices(xs, ys, threshold))
+    return sorted(selected)
+
+
+def downsample(
+    columns: List[str],
+    rows: Callable[[], Iterable[Sequence[Any]]],
+    row_count: int,
+    target: int,
+    method: str = "lttb",
+) -> Tuple[Optional[List[Dict[str, Any]]], Dict[str, Any]]:
+    """对查询结果降采样
+
+    Args:
+        rows: 每次调用返回一个新的行迭代器（值按 columns 顺序），落盘结果会被读取两遍
+        row_count: 总行数
+
+    Returns:
+        (降采样后的行，未降采样时为 None, 降采样信息)
+    """
+    target = max(3, min(target, DOWNSAMPLE_MAX_POINTS))
+    info: Dict[str, Any] = {"applied": False, "method": method, "original_rows": row_count, "target": target}
+    if method not in METHODS:
+        info["reason"] = f"不支持的降采样方法: {method}"
+        return None, info
+    if row_count <= target:
+        info["reason"] = "行数未超过目标点数"
+        return None, info
+
+    x, x_is_time, series_cols, reason = detect_series(columns, rows())
+    if x is None:
+        info["reason"] = reason
+        metrics.incr("downsample.skipped")
+        return None, info
+
+    # 只把横轴和序列列转成紧凑的 double 数组，落盘的大结果也不必整体载入内存
+    xs = array("d")
+    series: List[array] = [array("d") for _ in series_cols]
+    x_to_float = _time_to_float if x_is_time else _number_to_float
+    for row in rows():
+        xs.append(x_to_float(row[x]))
+        for ys, i in zip(series, series_cols):
+            ys.append(_number_to_float(row[i]))
+
+    order = None
+    if any(xs[i] > xs[i + 1] for i in range(len(xs) - 1)):
+        # 结果未按横轴排序（没有 ORDER BY），先排序再降采样
+        order = sorted(range(len(xs)), key=xs.__getitem__)
+        xs = array("d", (xs[i] for i in order))
+        series = [array("d", (ys[i] for i in order)) for ys in series]
+
+    picked = select_points(xs, series, target, method)
+    wanted = set(picked if order is None else (order[i] for i in picked))
+    data = [dict(zip(columns, row)) for i, row in enumerate(rows()) if i in wanted]
+    if order is not None:
+        position = {row_index: rank for rank, row_index in enumerate(order)}
+        ranked = sorted(wanted, key=position.__getitem__)
+        by_index = dict(zip(sorted(wanted), data))
+        data = [by_index[i] for i in ranked]
+
+    metrics.incr(f"downsample.{method}")
+    metrics.observe("downsample.ratio", len(data) / row_count)
+    info.update(applied=True, points=len(data), x=columns[x], series=[columns[i] for i in series_cols])
+    info.pop("reason", None)
+    return data, info
@@ -0,0 +1,293 @@
+"""
+快速路径模块 - 基于语义模式的规则/模板匹配
+对"查询所有用户的信息"、"统计每个商品类别的平均价格"这类简单问题，
+直接利用表/字段的业务含义生成 SemanticSQL，跳过LLM调用；
+只有整句被模板完整匹配且表/字段解析置信度足够高时才会生效，否则回退到LLM。
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from semantic_schema import semantic_manager, TableSemantic, FieldSemantic, DataType
+from metrics import metrics
+
+# 快速路径配置
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+FAST_PATH_THRESHOLD = float(os.getenv("FAST_PATH_THRESHOLD", "0.85"))
+
+# 句首/句中的礼貌用语与无意义填充词
+_FILLER_PATTERN = re.compile(r"^(?:请|麻烦)?(?:帮我|给我|帮忙)?|一下|[。？?！!\s]+$")
+_SPLIT_PATTERN = re.compile(r"[、,，/]|和|及|与|以及")
+
+_VERB = r"(?:查询|查看|显示|列出|获取|展示|看看|查找)?"
+_ALL = r"(?:所有|全部)?(?:的)?"
+_DATA_SUFFIX = r"(?:的)?(?:信息|数据|记录|列表|明细|详情)?"
+_COUNT_WORD = r"(?:总数|数量|个数|总量|条数)"
+_STAT_VERB = r"(?:统计|查询|计算|查看)?"
+_EACH = r"(?:每个|各个|每种|每一个|各)"
+_AGG = r"(?P<agg>平均|总|最大|最小|最高|最低|合计)"
+
+# 模板：(名称, 正则, 基础置信度)，正则必须完整匹配整句
+_TEMPLATES: List[Tuple[str, "re.Pattern[str]", float]] = [
+    ("list_fields", re.compile(rf"^{_VERB}{_ALL}(?P<table>.+?){_DATA_SUFFIX}[,，:：]?(?:包括|包含|只要|字段有?)[:：]?(?P<fields>.+)$"), 0.95),
+    ("list_fields", re.compile(rf"^{_VERB}{_ALL}(?P<table>.+?)的(?P<fields>[^的]+?(?:(?:[、,，]|和|及|与).+?)+)$"), 0.9),
+    ("count", re.compile(rf"^{_STAT_VERB}{_ALL}(?P<table>.+?)(?:的)?{_COUNT_WORD}$"), 0.95),
+    ("count", re.compile(r"^(?:一共|总共)?有多少(?:个|条|名|位)?(?P<table>.+?)$"), 0.9),
+    ("group_count", re.compile(rf"^{_STAT_VERB}{_EACH}(?P<group>.+?)的(?P<table>.+?){_COUNT_WORD}$"), 0.9),
+    ("group_count", re.compile(rf"^按(?P<group>.+?)(?:分组)?统计(?P<table>.+?)(?:的)?{_COUNT_WORD}$"), 0.9),
+    ("group_agg", re.compile(rf"^{_STAT_VERB}{_EACH}(?P<group>.+?)的{_AGG}(?P<measure>.+?)$"), 0.9),
+    ("agg", re.compile(rf"^{_STAT_VERB}{_ALL}(?P<table>.+?)的{_AGG}(?P<measure>.+?)$"), 0.9),
+    ("list", re.compile(rf"^{_VERB}{_ALL}(?P<table>.+?){_DATA_SUFFIX}$"), 0.95),
+]
+
+_AGG_FUNCS: Dict[str, str] = {
+    "平均": "AVG",
+    "总": "SUM",
+    "合计": "SUM",
+    "最大": "MAX",
+    "最高": "MAX",
+    "最小": "MIN",
+    "最低": "MIN",
+}
+
+_NUMERIC_TYPES = {DataType.INTEGER, DataType.FLOAT, DataType.DECIMAL}
+
+# 常见同义词，统一到语义模式中惯用的说法
+_SYNONYMS: Dict[str, str] = {
+    "类别": "分类",
+    "种类": "分类",
+    "类型": "分类",
+    "名字": "名称",
+    "价钱": "价格",
+    "金额总数": "总金额",
+    "邮件": "邮箱",
+    "手机": "手机号码",
+    "电话": "手机号码",
+}
+
+_TABLE_SUFFIXES = ("信息表", "统计表", "记录表", "明细表", "表")
+_PHRASE_SUFFIXES = ("信息", "数据", "记录", "列表", "明细", "详情")
+
+
+class FastPathMatch:
+    """快速路径匹配结果"""
+
+    def __init__(self, semantic, confidence: float, template: str):
+        self.semantic = semantic
+        self.confidence = confidence
+        self.template = template
+
+
+def _table_terms(table: TableSemantic) -> List[str]:
+    """表的可识别称呼：表名、业务含义以及去掉"信息表"等后缀后的核心词"""
+    terms = {table.name.lower(), table.business_meaning}
+    for suffix in _TABLE_SUFFIXES:
+        if table.business_meaning.endswith(suffix) and len(table.business_meaning) > len(suffix):
+            core = table.business_meaning[: -len(suffix)]
+            terms.add(core)
+            for phrase_suffix in _PHRASE_SUFFIXES:
+                if core.endswith(phrase_suffix) and len(core) > len(phrase_suffix):
+                    terms.add(core[: -len(phrase_suffix)])
+    return sorted(terms, key=len, reverse=True)
+
+
+def _strip_phrase(phrase: str) -> str:
+    phrase = phrase.strip().lstrip("的")
+    for suffix in _PHRASE_SUFFIXES:
+        if phrase.endswith(suffix) and len(phrase) > len(suffix):
+            phrase = phrase[: -len(suffix)]
+            break
+    return phrase.rstrip("的")
+
+
+def _resolve_table(phrase: str, tables: List[TableSemantic]) -> Tuple[Optional[TableSemantic], float]:
+    """把短语解析为唯一的表，只接受与表称呼完全一致的短语"""
+    candidates = {phrase.strip().lower(), _strip_phrase(phrase).lower()}
+    matched = [t for t in tables if candidates & {term.lower() for term in _table_terms(t)}]
+    if len(matched) != 1:
+        return None, 0.0
+    return matched[0], 1.0
+
+
+def _field_meaning_core(field: FieldSemantic, table: TableSemantic) -> str:
+    """字段业务含义去掉表前缀、逗号后补充说明后的核心词"""
+    meaning = re.split(r"[，,（(]", field.business_meaning)[0]
+    for term in _table_terms(table):
+        if meaning.startswith(term) and len(meaning) > len(term):
+            return meaning[len(term):]
+    return meaning
+
+
+def _resolve_field(phrase: str, table: TableSemantic) -> Tuple[Optional[FieldSemantic], float]:
+    """把短语解析为表中的唯一字段，返回 (字段, 置信度)"""
+    phrase = _strip_phrase(phrase)
+    for term in _table_terms(table):
+        if phrase.startswith(term) and len(phrase) > len(term):
+            phrase = _strip_phrase(phrase[len(term):])
+            break
+    phrase = _SYNONYMS.get(phrase, phrase)
+    if not phrase:
+        return None, 0.0
+
+    scored: List[Tuple[float, FieldSemantic]] = []
+    for field in table.fields:
+        core = _field_meaning_core(field, table)
+        if phrase.lower() == field.name.lower() or phrase in (core, field.business_meaning):
+            scored.append((1.0, field))
+        elif len(phrase) >= 2 and (phrase in field.business_meaning or core in phrase):
+            scored.append((0.9, field))
+    if not scored:
+        return None, 0.0
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    best_score, best_field = scored[0]
+    # 同分候选说明短语有歧义，降低置信度
+    if len(scored) > 1 and scored[1][0] == best_score:
+        return best_field, best_score * 0.6
+    return best_field, best_score
+
+
+def _resolve_field_any(phrase: str, tables: List[TableSemantic]) -> List[Tuple[TableSemantic, FieldSemantic, float]]:
+    """在所有表中解析字段短语，用于问题里没有显式表名的模板"""
+    results = []
+    for table in tables:
+        field, score = _resolve_field(phrase, table)
+        if field is not None:
+            results.append((table, field, score))
+    return results
+
+
+def _normalize(question: str) -> str:
+    question = question.strip()
+    question = _FILLER_PATTERN.sub("", question)
+    return question.strip()
+
+
+def _build(intent: str, table: str, select, group_by=None):
+    # 延迟导入，避免与 translator 循环依赖
+    from translator import SemanticSQL, SelectQuery
+
+    return SemanticSQL(
+        intent=intent,
+        query=SelectQuery(select=select, from_=[table], group_by=group_by),
+    )
+
+
+def _agg_column(func: str, table: TableSemantic, field: FieldSemantic):
+    from translator import ColumnRef
+
+    return ColumnRef(column=f"{func}({table.name}.{field.name})", alias=f"{func.lower()}_{field.name}")
+
+
+def _match_template(name: str, groups: Dict[str, str], tables: List[TableSemantic]) -> Optional[Tuple[object, float]]:
+    from translator import ColumnRef
+
+    if name == "list":
+        table, score = _resolve_table(groups["table"], tables)
+        if table is None:
+            return None
+        return _build(f"查询{table.business_meaning}的全部记录", table.name, [ColumnRef(column="*")]), score
+
+    if name == "list_fields":
+        table, score = _resolve_table(groups["table"], tables)
+        if table is None:
+            return None
+        select = []
+        for phrase in filter(None, (p.strip() for p in _SPLIT_PATTERN.split(groups["fields"]))):
+            field, field_score = _resolve_field(phrase, table)
+            if field is None:
+                return None
+            score = min(score, field_score)
+            if all(c.column != field.name for c in select):
+                select.append(ColumnRef(table=table.name, column=field.name))
+        if not select:
+            return None
+        names = "、".join(c.column for c in select)
+        return _build(f"查询{table.business_meaning}的{names}", table.name, select), score
+
+    if name == "count":
+        table, score = _resolve_table(groups["table"], tables)
+        if table is None:
+            return None
+        return _build(f"统计{table.business_meaning}的记录数",
+                      table.name, [ColumnRef(column="COUNT(*)", alias="count")]), score
+
+    if name == "group_count":
+        table, score = _resolve_table(groups["table"], tables)
+        if table is None:
+            return None
+        group, group_score = _resolve_field(groups["group"], table)
+        if group is None:
+            return None
+        select = [ColumnRef(table=table.name, column=group.name), ColumnRef(column="COUNT(*)", alias="count")]
+        return _build(f"按{group.business_meaning}统计{table.business_meaning}的记录数",
+                      table.name, select, [f"{table.name}.{group.name}"]), min(score, group_score)
+
+    if name in ("agg", "group_agg"):
+        func = _AGG_FUNCS[groups["agg"]]
+        if name == "agg":
+            table, score = _resolve_table(groups["table"], tables)
+            if table is None:
+                return None
+            measure, measure_score = _resolve_field(groups["measure"], table)
+            candidates = [(table, measure, min(score, measure_score))] if measure else []
+        else:
+            candidates = _resolve_field_any(groups["measure"], tables)
+        if len(candidates) != 1:
+            return None
+        table, measure, score = candidates[0]
+        if not measure.aggregation_support or (func in ("SUM", "AVG") and measure.data_type not in _NUMERIC_TYPES):
+            return None
+
+        select = []
+        group_by = None
+        if name == "group_agg":
+            group, group_score = _resolve_field(groups["group"], table)
+            if group is None or group.name == measure.name:
+                return None
+            score = min(score, group_score)
+            select.append(ColumnRef(table=table.name, column=group.name))
+            group_by = [f"{table.name}.{group.name}"]
+        select.append(_agg_column(func, table, measure))
+        intent = f"统计{table.business_meaning}中{measure.business_meaning}的{groups['agg']}值"
+        return _build(intent, table.name, select, group_by), score
+
+    return None
+
+
+def match_fast_path(question: str, db_name: str) -> Optional[FastPathMatch]:
+    """用模板匹配问题，返回置信度最高的匹配结果（不做阈值过滤）"""
+    schema = semantic_manager.get_schema(db_name)
+    if not schema:
+        return None
+    text = _normalize(question)
+    if not text:
+        return None
+
+    best: Optional[FastPathMatch] = None
+    for name, pattern, base_confidence in _TEMPLATES:
+        m = pattern.match(text)
+        if not m:
+            continue
+        result = _match_template(name, m.groupdict(), schema.tables)
+        if result is None:
+            continue
+        semantic, score = result
+        confidence = base_confidence * score
+        if best is None or confidence > best.confidence:
+            best = FastPathMatch(semantic, confidence, name)
+    return best
+
+
+def try_fast_path(question: str, db_name: str):
+    """快速路径入口：命中且置信度达到阈值时返回 SemanticSQL，否则返回 None"""
+    if not FAST_PATH_ENABLED:
+        return None
+    match = match_fast_path(question, db_name)
+    if match is None or match.confidence < FAST_PATH_THRESHOLD:
+        metrics.incr("fast_path.miss")
+        return None
+    metrics.incr("fast_path.hit")
+    metrics.incr(f"fast_path.template.{match.template}")
+    return match.semantic
@@ -0,0 +1,193 @@
+"""
+快速响应模块 - 大结果的JSON序列化与压缩
+用 orjson 直接序列化（原生支持 datetime，Decimal 与 pydantic 一样输出为字符串），
+并按 Accept-Encoding 对超过阈值的响应做 brotli 或 gzip 压缩
+"""
+
+import os
+import zlib
+import logging
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import orjson
+from pydantic import BaseModel
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只协商 gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 响应体不少于该字节数时才压缩，小响应压缩的CPU开销不划算
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+_COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode("utf-8", errors="replace")
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", by_alias=True)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+
+
+class FastJSONResponse(Response):
+    """用 orjson 序列化的JSON响应"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def model_response(model: BaseModel, status_code: int = 200) -> FastJSONResponse:
+    """直接序列化响应模型的字段，不经过 FastAPI 对 response_model 的再次校验和 jsonable_encoder
+
+    结果行已经是数据库返回的基础类型，逐行再校验一遍对大结果是主要的CPU开销。
+    配合 Model.model_construct 构造模型可以完全跳过校验。
+    """
+    return FastJSONResponse(dict(model), status_code=status_code)
+
+
+def _negotiate(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩算法，brotli 优先"""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=RESPONSE_BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(RESPONSE_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        """flush 为真时把已有数据全部输出（流式响应的每个块需要及时送达客户端）"""
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + self._brotli.flush() if flush else out
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """按 Accept-Encoding 压缩响应的ASGI中间件
+
+    普通响应不小于 RESPONSE_COMPRESSION_MIN_BYTES 时整体压缩；流式响应（结果下载、NDJSON事件流）
+    逐块压缩并立即刷出，不会因为压缩而延迟事件到达。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = RESPONSE_COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = _negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                if not self._should_compress(start, body, more_body):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                response_headers = [
+                    (k, v) for k, v in start["headers"] if k.lower() not in (b"content-length", b"content-encoding")
+                ]
+                response_headers.append((b"content-encoding", encoding.encode()))
+                response_headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    compressed = compressor.finish(body)
+                    response_headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": response_headers})
+                    await send({"type": "http.response.body", "body": compressed})
+                    metrics.incr(f"response.compressed.{encoding}")
+                    metrics.observe("response.compression_ratio", len(compressed) / max(1, len(body)))
+                    return
+                await send({**start, "headers": response_headers})
+                metrics.incr(f"response.compressed.{encoding}")
+
+            if more_body:
+                chunk = compressor.compress(body, flush=True)
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.finish(body)})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _should_compress(self, start: Message, body: bytes, more_body: bool) -> bool:
+        headers: List = start["headers"]
+        content_type = b""
+        for key, value in headers:
+            key = key.lower()
+            if key == b"content-encoding":
+                return False
+            if key == b"content-type":
+                content_type = value
+        if not content_type.decode("latin-1").startswith(_COMPRESSIBLE_TYPES):
+            return False
+        # 流式响应的总大小未知，一律压缩
+        return more_body or len(body) >= self.minimum_size
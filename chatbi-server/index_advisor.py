@@ -0,0 +1,278 @@
+"""
+索引建议模块 - 根据实际执行的生成查询推荐索引
+记录 SemanticSQL 中用于过滤、连接、分组、排序的列，结合 EXPLAIN 中的全表扫描情况，
+按表汇总候选索引并按预计收益排序
+"""
+
+import os
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from cache import TTLCache
+from metrics import metrics
+from sql_fingerprint import sql_fingerprint
+
+logger = logging.getLogger(__name__)
+
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR_ENABLED", "1") == "1"
+# 是否对执行过的查询做 EXPLAIN，以及同一条SQL两次 EXPLAIN 的最短间隔（秒）
+INDEX_ADVISOR_EXPLAIN = os.getenv("INDEX_ADVISOR_EXPLAIN", "1") == "1"
+INDEX_ADVISOR_EXPLAIN_TTL = float(os.getenv("INDEX_ADVISOR_EXPLAIN_TTL", "3600"))
+# 等待执行的已生成查询数量上限
+INDEX_ADVISOR_MAX_PENDING = int(os.getenv("INDEX_ADVISOR_MAX_PENDING", "1024"))
+
+_QUALIFIED_PATTERN = re.compile(r"^`?([A-Za-z_]\w*)`?\s*\.\s*`?([A-Za-z_]\w*)`?$")
+_IDENTIFIER_PATTERN = re.compile(r"^`?([A-Za-z_]\w*)`?$")
+_JOIN_EQ_PATTERN = re.compile(
+    r"`?([A-Za-z_]\w*)`?\s*\.\s*`?([A-Za-z_]\w*)`?\s*=\s*`?([A-Za-z_]\w*)`?\s*\.\s*`?([A-Za-z_]\w*)`?"
+)
+_EQ_OPS = {"=", "in", "is", "<=>"}
+_RANGE_OPS = {">", "<", ">=", "<=", "between", "like"}
+# EXPLAIN 中表示整表/整索引扫描的访问类型
+_FULL_SCAN_TYPES = {"ALL", "index"}
+
+
+class QueryColumns:
+    """一条查询在每张表上用到的列"""
+
+    def __init__(self):
+        self.eq: Dict[str, List[str]] = {}
+        self.range: Dict[str, List[str]] = {}
+        self.group: Dict[str, List[str]] = {}
+        self.order: Dict[str, List[str]] = {}
+
+    def add(self, kind: Dict[str, List[str]], table: str, column: str) -> None:
+        columns = kind.setdefault(table, [])
+        if column not in columns:
+            columns.append(column)
+
+    @property
+    def tables(self) -> Set[str]:
+        return set(self.eq) | set(self.range) | set(self.group) | set(self.order)
+
+    def candidate(self, table: str) -> Optional[Tuple[FrozenSet[str], Tuple[str, ...]]]:
+        """该表的候选索引：(等值列集合, 后缀列)，后缀为一个范围列，或分组列，或排序列"""
+        eq = frozenset(self.eq.get(table, []))
+        tail: Tuple[str, ...] = ()
+        ranges = [c for c in self.range.get(table, []) if c not in eq]
+        if ranges:
+            tail = (ranges[0],)
+        elif self.group.get(table):
+            tail = tuple(c for c in self.group[table] if c not in eq)
+        elif self.order.get(table):
+            tail = tuple(c for c in self.order[table] if c not in eq)
+        if not eq and not tail:
+            return None
+        return eq, tail
+
+
+def extract_columns(semantic) -> QueryColumns:
+    """从 SemanticSQL 中提取可以利用索引的列（函数包裹的列无法走索引，不计入）"""
+    q = semantic.query
+    tables = list(q.from_) + [j.table for j in q.joins or []]
+    single = tables[0] if len(tables) == 1 else None
+    cols = QueryColumns()
+
+    def resolve(expr: str) -> Optional[Tuple[str, str]]:
+        expr = (expr or "").strip()
+        match = _QUALIFIED_PATTERN.match(expr)
+        if match and match.group(1) in tables:
+            return match.group(1), match.group(2)
+        match = _IDENTIFIER_PATTERN.match(expr)
+        if match and single:
+            return single, match.group(1)
+        return None
+
+    for cond in q.where or []:
+        ref = resolve(cond.left)
+        op = cond.op.strip().lower()
+        if ref is None:
+            continue
+        if op in _EQ_OPS:
+            cols.add(cols.eq, *ref)
+        elif op in _RANGE_OPS and not (op == "like" and cond.right.strip().strip("'\"").startswith("%")):
+            cols.add(cols.range, *ref)
+
+    for join in q.joins or []:
+        for left_table, left_col, right_table, right_col in _JOIN_EQ_PATTERN.findall(join.on or ""):
+            # 被连接的一侧需要连接列上的索引
+            for table, column in ((left_table, left_col), (right_table, right_col)):
+                if table == join.table:
+                    cols.add(cols.eq, table, column)
+
+    aliases = {c.alias for c in q.select if c.alias}
+    for expr in q.group_by or []:
+        ref = resolve(expr)
+        if ref and ref[1] not in aliases:
+            cols.add(cols.group, *ref)
+    for item in q.order_by or []:
+        ref = resolve(item.by)
+        if ref and ref[1] not in aliases:
+            cols.add(cols.order, *ref)
+    return cols
+
+
+class IndexCandidate:
+    """按 (数据库, 表, 等值列, 后缀列) 聚合的候选索引统计"""
+
+    def __init__(self):
+        self.executions = 0
+        self.total_seconds = 0.0
+        self.full_scans = 0
+        self.indexed = 0
+        self.max_rows = 0
+        # 全表扫描时该表扫描行数占整条查询扫描行数的比例之和
+        self.scan_share = 0.0
+
+
+class IndexAdvisor:
+    """索引建议器
+
+    remember 记录生成的 SQL 与 SemanticSQL 的对应关系，observe_execution 在 SQL 被执行时累计列使用情况，
+    并在后台线程中对该 SQL 做 EXPLAIN，判断各表是否全表扫描。
+    """
+
+    def __init__(
+        self,
+        connect: Optional[Callable[[str], Any]] = None,
+        explain: bool = INDEX_ADVISOR_EXPLAIN,
+        explain_ttl: float = INDEX_ADVISOR_EXPLAIN_TTL,
+        max_pending: int = INDEX_ADVISOR_MAX_PENDING,
+    ):
+        """
+        Args:
+            connect: (db_name) -> 新的数据库连接，用于 EXPLAIN
+        """
+        self.connect = connect
+        self.explain = explain
+        self._pending = TTLCache("index_advisor.pending", maxsize=max_pending, ttl=24 * 3600)
+        self._explained = TTLCache("index_advisor.explain", maxsize=max_pending, ttl=explain_ttl)
+        self._candidates: Dict[Tuple[str, str, FrozenSet[str], Tuple[str, ...]], IndexCandidate] = {}
+        self._eq_frequency: Dict[Tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-advisor")
+
+    def remember(self, semantic, sql: str) -> None:
+        """记录生成的 SQL 对应的 SemanticSQL，等待其被执行（按指纹与参数匹配，不受空白和引号差异影响）"""
+        self._pending.set(sql_fingerprint(sql).key, semantic)
+
+    def observe_execution(self, db_name: str, sql: str, seconds: float) -> None:
+        """记录一次SQL执行；只统计由 SemanticSQL 生成的查询
+
+        执行计划只与查询形态有关，同一形态的SQL在 explain_ttl 内只做一次 EXPLAIN。
+        """
+        fp = sql_fingerprint(sql)
+        semantic = self._pending.get(fp.key)
+        if semantic is None:
+            return
+        cols = extract_columns(semantic)
+        with self._lock:
+            for table in cols.tables:
+                candidate = cols.candidate(table)
+                if candidate is None:
+                    continue
+                stats = self._candidates.setdefault((db_name, table) + candidate, IndexCandidate())
+                stats.executions += 1
+                stats.total_seconds += seconds
+                for column in candidate[0]:
+                    freq_key = (db_name, table, column)
+                    self._eq_frequency[freq_key] = self._eq_frequency.get(freq_key, 0) + 1
+        metrics.incr("index_advisor.observed")
+
+        explain_key = (db_name, fp.fingerprint)
+        if self.explain and self.connect is not None and not self._explained.contains(explain_key):
+            self._explained.set(explain_key, True)
+            self._executor.submit(self._explain, db_name, sql.strip(), cols)
+
+    def _explain(self, db_name: str, sql: str, cols: QueryColumns) -> None:
+        try:
+            conn = self.connect(db_name)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"EXPLAIN {sql}")
+                names = [d[0] for d in cursor.description]
+                plan = [dict(zip(names, row)) for row in cursor.fetchall()]
+            finally:
+                conn.close()
+        except Exception as e:
+            metrics.incr("index_advisor.explain_failed")
+            logger.warning(f"EXPLAIN 失败 - 数据库: {db_name}, 错误: {e}")
+            return
+        self.record_plan(db_name, cols, plan)
+
+    def record_plan(self, db_name: str, cols: QueryColumns, plan: List[Dict[str, Any]]) -> None:
+        """把 EXPLAIN 结果记到对应表的候选索引上"""
+        total_rows = sum(int(r.get("rows") or 0) for r in plan) or 1
+        with self._lock:
+            for row in plan:
+                table = row.get("table")
+                candidate = cols.candidate(table) if table in cols.tables else None
+                stats = self._candidates.get((db_name, table) + candidate) if candidate else None
+                if stats is None:
+                    continue
+                if row.get("type") in _FULL_SCAN_TYPES:
+                    stats.full_scans += 1
+                    stats.scan_share += int(row.get("rows") or 0) / total_rows
+                    metrics.incr("index_advisor.full_scans")
+                elif row.get("key"):
+                    stats.indexed += 1
+                stats.max_rows = max(stats.max_rows, int(row.get("rows") or 0))
+
+    def report(self, db_name: Optional[str] = None, top: int = 5) -> Dict[str, List[Dict[str, Any]]]:
+        """按表输出排序后的索引建议
+
+        预计收益 = 该查询形态的累计执行耗时 × 该表全表扫描在执行计划扫描行数中的占比（未做 EXPLAIN 时按0.5估计），
+        EXPLAIN 显示已经走索引的候选不再推荐。
+        """
+        with self._lock:
+            items = list(self._candidates.items())
+            eq_frequency = dict(self._eq_frequency)
+
+        merged: Dict[Tuple[str, str, Tuple[str, ...]], Dict[str, Any]] = {}
+        for (db, table, eq, tail), stats in items:
+            if db_name is not None and db != db_name:
+                continue
+            explained = stats.full_scans + stats.indexed
+            if explained and not stats.full_scans:
+                continue
+            scan_ratio = stats.scan_share / explained if explained else 0.5
+            # 等值列按使用频率排在前面，后缀列保持原顺序
+            columns = tuple(sorted(eq, key=lambda c: (-eq_frequency.get((db, table, c), 0), c))) + tail
+            index_name = f"idx_{table}_{'_'.join(columns)}"[:64]
+            entry = merged.setdefault((db, table, columns), {
+                "columns": list(columns),
+                "ddl": f"CREATE INDEX `{index_name}` ON `{table}` ({', '.join(f'`{c}`' for c in columns)})",
+                "executions": 0,
+                "full_scans": 0,
+                "estimated_rows": 0,
+                "total_seconds": 0.0,
+                "benefit_seconds": 0.0,
+            })
+            entry["executions"] += stats.executions
+            entry["full_scans"] += stats.full_scans
+            entry["estimated_rows"] = max(entry["estimated_rows"], stats.max_rows)
+            entry["total_seconds"] += stats.total_seconds
+            entry["benefit_seconds"] += stats.total_seconds * scan_ratio
+
+        report: Dict[str, List[Dict[str, Any]]] = {}
+        for (db, table, _), entry in merged.items():
+            entry["total_seconds"] = round(entry["total_seconds"], 3)
+            entry["benefit_seconds"] = round(entry["benefit_seconds"], 3)
+            report.setdefault(f"{db}.{table}", []).append(entry)
+        for key, entries in report.items():
+            entries.sort(key=lambda e: (e["benefit_seconds"], e["executions"]), reverse=True)
+            report[key] = entries[:top]
+        return dict(sorted(report.items(), key=lambda kv: kv[1][0]["benefit_seconds"], reverse=True))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._candidates.clear()
+            self._eq_frequency.clear()
+        self._explained.invalidate()
+
+
+# 全局索引建议器，由服务启动时配置连接
+index_advisor = IndexAdvisor()
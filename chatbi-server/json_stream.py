@@ -0,0 +1,137 @@
+"""
+JSON流式解析模块 - 容错地从LLM输出中提取JSON对象
+支持流式喂入（顶层对象闭合即可停止生成），并修复代码块包裹、尾随逗号、
+Python风格字面量以及输出被截断等常见问题
+"""
+
+import json
+import re
+from typing import Any, List, Optional
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?")
+_PY_LITERALS = {"None": "null", "True": "true", "False": "false"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class StreamingJSONParser:
+    """增量扫描LLM输出，识别第一个顶层JSON对象何时闭合"""
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.done = False
+
+    def feed(self, text: str) -> bool:
+        """喂入一段输出，返回顶层对象是否已经闭合"""
+        if self.done or not text:
+            return self.done
+        self._chunks.append(text)
+        for ch in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"' and self._started:
+                self._in_string = True
+            elif ch in "{[":
+                if ch == "{" or self._started:
+                    self._started = True
+                    self._depth += 1
+            elif ch in "}]" and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    break
+        return self.done
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def result(self) -> Any:
+        return parse_json_tolerant(self.text)
+
+
+def _repair(text: str) -> str:
+    """单遍扫描修复：去除尾随逗号、转换Python字面量、补全被截断的字符串和括号"""
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+        elif ch in "}]":
+            # 去掉右括号前的尾随逗号
+            while out and out[-1] in " \t\r\n,":
+                if out.pop() == ",":
+                    break
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+        elif ch.isalpha():
+            j = i
+            while j < len(text) and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_PY_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    if stack:
+        # 输出被截断：去掉悬空的逗号/冒号后补齐括号
+        while out and out[-1] in " \t\r\n,:":
+            out.pop()
+        out.extend(_CLOSERS[c] for c in reversed(stack))
+    return "".join(out)
+
+
+def parse_json_tolerant(text: Optional[str]) -> Any:
+    """从LLM输出中解析出第一个JSON对象，无法解析时抛出 ValueError"""
+    if not text:
+        raise ValueError("LLM输出为空")
+    cleaned = _FENCE_PATTERN.sub("", text)
+    start = cleaned.find("{")
+    if start < 0:
+        raise ValueError("LLM输出中没有JSON对象")
+    candidate = cleaned[start:]
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    repaired = _repair(candidate)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON解析失败: {e.msg} (第{e.lineno}行第{e.colno}列)") from e
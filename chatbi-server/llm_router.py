@@ -0,0 +1,229 @@
+"""
+LLM路由模块 - 在多个Ollama节点之间做负载均衡
+按最少在途请求（或延迟加权）选择节点，依据 /api/tags 判断节点上是否有所需模型，
+连续失败的节点会被暂时摘除，失败请求自动换节点重试。
+"""
+
+import os
+import time
+import hashlib
+import threading
+import logging
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# 逗号分隔的多个Ollama地址，未配置时只使用 OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [u.strip().rstrip("/") for u in os.getenv("OLLAMA_BASE_URLS", "").split(",") if u.strip()]
+
+OLLAMA_LB_STRATEGY = os.getenv("OLLAMA_LB_STRATEGY", "least_outstanding")  # least_outstanding / latency
+OLLAMA_MAX_FAILURES = int(os.getenv("OLLAMA_MAX_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_TAGS_TTL = float(os.getenv("OLLAMA_TAGS_TTL", "60"))
+
+
+class OllamaEndpoint:
+    """单个Ollama节点的状态"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.ewma_latency = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.models: Optional[Set[str]] = None
+        self.models_checked_at = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "url": self.url,
+            "healthy": not self.is_ejected(now),
+            "outstanding": self.outstanding,
+            "ewma_latency": round(self.ewma_latency, 3),
+            "requests": self.requests,
+            "failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+        }
+
+
+class LLMRouter:
+    """Ollama节点池"""
+
+    def __init__(
+        self,
+        urls: List[str],
+        strategy: str = OLLAMA_LB_STRATEGY,
+        max_failures: int = OLLAMA_MAX_FAILURES,
+        eject_seconds: float = OLLAMA_EJECT_SECONDS,
+        tags_ttl: float = OLLAMA_TAGS_TTL,
+    ):
+        self.endpoints = [OllamaEndpoint(u.rstrip("/")) for u in dict.fromkeys(urls)]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.tags_ttl = tags_ttl
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> List[str]:
+        return [e.url for e in self.endpoints]
+
+    def refresh_models(self, endpoint: OllamaEndpoint, timeout: float = 3.0) -> bool:
+        """从 /api/tags 刷新节点上的模型列表，返回节点是否可达"""
+        import requests
+
+        try:
+            response = requests.get(f"{endpoint.url}/api/tags", timeout=timeout)
+            response.raise_for_status()
+            names = set()
+            for item in response.json().get("models", []):
+                names.update(filter(None, (item.get("name"), item.get("model"))))
+            with self._lock:
+                endpoint.models = names
+                endpoint.models_checked_at = time.monotonic()
+            return True
+        except Exception as e:
+            logger.warning(f"获取Ollama模型列表失败 - 节点: {endpoint.url}, 错误: {e}")
+            with self._lock:
+                endpoint.models_checked_at = time.monotonic()
+            return False
+
+    def refresh(self) -> bool:
+        """刷新所有节点的模型列表，返回是否至少有一个节点可用"""
+        return any([self.refresh_models(e) for e in self.endpoints])
+
+    def _serves(self, endpoint: OllamaEndpoint, model: str) -> bool:
+        if endpoint.models is None:
+            return True
+        return model in endpoint.models or f"{model}:latest" in endpoint.models
+
+    def _affinity_rank(self, endpoint: OllamaEndpoint, affinity_key: Optional[str]) -> str:
+        """会话亲和：相同前缀尽量落到同一节点，提高KV缓存复用率"""
+        if not affinity_key:
+            return ""
+        return hashlib.md5(f"{affinity_key}|{endpoint.url}".encode("utf-8")).hexdigest()
+
+    def _choose(self, model: str, tried: Set[str], affinity_key: Optional[str]) -> Optional[OllamaEndpoint]:
+        now = time.monotonic()
+        stale = [e for e in self.endpoints
+                 if e.url not in tried and not e.is_ejected(now) and now - e.models_checked_at > self.tags_ttl]
+        for endpoint in stale:
+            self.refresh_models(endpoint)
+
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.url not in tried and not e.is_ejected(now)]
+            candidates = [e for e in healthy if self._serves(e, model)] or healthy
+            if not candidates:
+                # 所有节点都被摘除时，仍然尝试最早恢复的节点
+                candidates = sorted((e for e in self.endpoints if e.url not in tried),
+                                    key=lambda e: e.ejected_until)[:1]
+            if not candidates:
+                return None
+
+            if self.strategy == "latency":
+                best = min(candidates, key=lambda e: ((e.outstanding + 1) * (e.ewma_latency or 1.0),
+                                                      self._affinity_rank(e, affinity_key)))
+            else:
+                best = min(candidates, key=lambda e: (e.outstanding,
+                                                      self._affinity_rank(e, affinity_key),
+                                                      e.ewma_latency))
+            best.outstanding += 1
+            best.requests += 1
+            return best
+
+    def _record_success(self, endpoint: OllamaEndpoint, latency: float) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.consecutive_failures = 0
+            endpoint.ewma_latency = latency if endpoint.ewma_latency == 0 else 0.8 * endpoint.ewma_latency + 0.2 * latency
+
+    def _record_failure(self, endpoint: OllamaEndpoint, model: str, error: Exception) -> None:
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.failures += 1
+            if getattr(error, "status_code", None) == 404:
+                # 节点上没有该模型，不算节点故障
+                if endpoint.models is not None:
+                    endpoint.models.discard(model)
+                return
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.max_failures:
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                endpoint.consecutive_failures = 0
+                metrics.incr("llm.router.ejected")
+                logger.warning(f"Ollama节点连续失败，暂时摘除 {self.eject_seconds} 秒 - 节点: {endpoint.url}")
+
+    def invoke(
+        self,
+        model: str,
+        make_llm: Callable[[str], Any],
+        messages: Any,
+        affinity_key: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """选择节点调用 llm.invoke，失败时换节点重试"""
+        return self.call(model, make_llm, lambda llm: llm.invoke(messages, **kwargs), affinity_key)
+
+    def call(
+        self,
+        model: str,
+        make_llm: Callable[[str], Any],
+        fn: Callable[[Any], Any],
+        affinity_key: Optional[str] = None,
+    ) -> Any:
+        """选择节点执行 fn(llm)，失败时换节点重试，所有节点都失败则抛出最后一个异常"""
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.endpoints):
+            endpoint = self._choose(model, tried, affinity_key)
+            if endpoint is None:
+                break
+            tried.add(endpoint.url)
+            started = time.monotonic()
+            try:
+                response = fn(make_llm(endpoint.url))
+            except Exception as e:
+                self._record_failure(endpoint, model, e)
+                metrics.incr("llm.router.failures")
+                logger.warning(f"Ollama调用失败 - 节点: {endpoint.url}, 模型: {model}, 错误: {e}")
+                last_error = e
+                continue
+            self._record_success(endpoint, time.monotonic() - started)
+            if len(tried) > 1:
+                metrics.incr("llm.router.retried")
+            return response
+        raise last_error or RuntimeError("没有可用的Ollama节点")
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [e.status() for e in self.endpoints]
+
+
+# 默认节点池
+default_router = LLMRouter(OLLAMA_BASE_URLS or [DEFAULT_OLLAMA_BASE_URL])
+_single_routers: Dict[str, LLMRouter] = {}
+_single_lock = threading.Lock()
+
+
+def get_router(base_url: Optional[str] = None) -> LLMRouter:
+    """获取节点池：未指定地址或地址属于默认池时使用默认池，否则使用单节点池"""
+    if base_url is None:
+        return default_router
+    url = base_url.rstrip("/")
+    if url in default_router.urls or url == DEFAULT_OLLAMA_BASE_URL.rstrip("/"):
+        return default_router
+    with _single_lock:
+        router = _single_routers.get(url)
+        if router is None:
+            router = LLMRouter([url])
+            _single_routers[url] = router
+        return router
@@ -1,10 +1,12 @@
 import os
+import sys
 import json
-from typing import Dict, List, Tuple, Optional
-
-import mysql.connector  # type: ignore
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Set, TextIO, Tuple, Optional
 
 from translator import nl_to_mysql
+from metrics import track_stages
 
 
 def _introspect_schema(
@@ -14,6 +16,8 @@ def _introspect_schema(
     password: str,
     database: str,
 ) -> Dict[str, List[Tuple[str, str]]]:
+    import mysql.connector  # type: ignore
+
     conn = mysql.connector.connect(
         host=host,
         port=port,
@@ -40,14 +44,13 @@ def _introspect_schema(
         conn.close()
 
 
-def run():
-    question = os.environ.get("QUESTION") or input("输入自然语言问题: ")
-
+def _load_schema(database: Optional[str] = None) -> Optional[Dict[str, List[Tuple[str, str]]]]:
+    """获取数据库结构；database 为空时取 MYSQL_DATABASE，未配置连接或获取失败时返回 None"""
     db_host = os.environ.get("MYSQL_HOST")
     db_port = int(os.environ.get("MYSQL_PORT", "3306"))
     db_user = os.environ.get("MYSQL_USER")
     db_password = os.environ.get("MYSQL_PASSWORD")
-    db_database = os.environ.get("MYSQL_DATABASE")
+    db_database = database or os.environ.get("MYSQL_DATABASE")
 
     schema: Optional[Dict[str, List[Tuple[str, str]]]] = None
     if all([db_host, db_user, db_password, db_database]):
@@ -56,7 +59,158 @@ def run():
                 host=db_host, port=db_port, user=db_user, password=db_password, database=db_database
             )
         except Exception as e:
-            print(f"[WARN] 无法获取数据库结构，将在无结构提示下生成: {e}")
+            print(f"[WARN] 无法获取数据库 {db_database} 的结构，将在无结构提示下生成: {e}", file=sys.stderr)
+    return schema
+
+
+def _read_questions(f: TextIO) -> Iterator[Dict[str, Any]]:
+    """逐行读取问题：每行一个JSON对象（至少包含 question，可选 id、db_name、model、mode）或JSON字符串
+
+    未给出 id 时以行号作为 id，续跑时按 id 跳过已完成的问题。
+    """
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            print(f"[WARN] 第 {line_no} 行不是合法的JSON，已跳过", file=sys.stderr)
+            continue
+        if isinstance(item, str):
+            item = {"question": item}
+        if not isinstance(item, dict) or not item.get("question"):
+            print(f"[WARN] 第 {line_no} 行缺少 question，已跳过", file=sys.stderr)
+            continue
+        item.setdefault("id", line_no)
+        yield item
+
+
+def _completed_ids(path: str, retry_failed: bool) -> Set[str]:
+    """读取已有输出中完成的 id，并截掉中断时写了一半的最后一行"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    valid = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            valid += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("success") or not retry_failed:
+                done.add(str(record.get("id")))
+    if valid < os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+    return done
+
+
+def _translate_one(
+    item: Dict[str, Any],
+    schema: Optional[Dict[str, List[Tuple[str, str]]]],
+    model: str,
+    base_url: Optional[str],
+    db_name: str,
+) -> Dict[str, Any]:
+    """翻译一个问题，返回输出记录；timings 为各阶段耗时（秒）"""
+    stages = track_stages()
+    started = time.perf_counter()
+    record: Dict[str, Any] = {
+        "id": item["id"],
+        "question": item["question"],
+        "db_name": item.get("db_name", db_name),
+    }
+    try:
+        # 回归测试要看到当前提示词的真实输出，不使用翻译缓存
+        semantic, sql = nl_to_mysql(
+            question=item["question"],
+            schema=schema,
+            model=item.get("model", model),
+            base_url=base_url,
+            db_name=record["db_name"],
+            use_cache=False,
+            mode=item.get("mode"),
+        )
+        record.update(success=True, intent=semantic.intent,
+                      semantic_sql=semantic.model_dump(by_alias=True), sql=sql)
+    except Exception as e:
+        record.update(success=False, error=str(e))
+    record["timings"] = {"total": time.perf_counter() - started, **stages}
+    return record
+
+
+def run_batch(input_path: str, output_path: Optional[str] = None) -> Dict[str, Any]:
+    """批量翻译：从文件（"-" 为标准输入）读取JSONL问题，并发翻译，按完成顺序逐行输出JSONL结果
+
+    数据库结构按 db_name 各获取一次：未指定 db_name 的问题使用 MYSQL_DATABASE 的结构，
+    指定了其他 db_name 的问题使用同名数据库的结构。输出到文件时以追加方式写入，BATCH_RESUME=1 时跳过输出中已有的 id，
+    可以从中断处继续；BATCH_RETRY_FAILED=1 时失败的问题也重新翻译。
+    """
+    workers = max(1, int(os.environ.get("BATCH_WORKERS", "4")))
+    resume = os.environ.get("BATCH_RESUME", "0") == "1"
+    retry_failed = os.environ.get("BATCH_RETRY_FAILED", "0") == "1"
+    model = os.environ.get("OLLAMA_MODEL", "qwen2.5:7b")
+    base_url = os.environ.get("OLLAMA_BASE_URL")
+    db_name = os.environ.get("DB_NAME", "shop")
+
+    done = _completed_ids(output_path, retry_failed) if output_path and resume else set()
+    schemas = {db_name: _load_schema()}
+
+    started = time.perf_counter()
+    summary = {"total": 0, "succeeded": 0, "failed": 0, "skipped": 0}
+    source = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8")
+    out = open(output_path, "a" if resume else "w", encoding="utf-8") if output_path else sys.stdout
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+            pending: Set[Future] = set()
+
+            def drain(return_when: str) -> None:
+                finished, still_pending = wait(pending, return_when=return_when)
+                pending.intersection_update(still_pending)
+                for future in finished:
+                    record = future.result()
+                    summary["succeeded" if record["success"] else "failed"] += 1
+                    out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                    out.flush()
+
+            for item in _read_questions(source):
+                summary["total"] += 1
+                if str(item["id"]) in done:
+                    summary["skipped"] += 1
+                    continue
+                # 边读边提交，同时在途的问题不超过并发数的两倍，大文件不会整体读入内存
+                if len(pending) >= workers * 2:
+                    drain(FIRST_COMPLETED)
+                item_db = item.get("db_name", db_name)
+                if item_db not in schemas:
+                    schemas[item_db] = _load_schema(item_db)
+                pending.add(executor.submit(_translate_one, item, schemas[item_db], model, base_url, db_name))
+            if pending:
+                drain(ALL_COMPLETED)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    summary["elapsed"] = time.perf_counter() - started
+    print(f"[批量翻译] 共 {summary['total']} 个问题，成功 {summary['succeeded']}，失败 {summary['failed']}，"
+          f"跳过 {summary['skipped']}，耗时 {summary['elapsed']:.1f}秒", file=sys.stderr)
+    return summary
+
+
+def run():
+    batch_input = os.environ.get("BATCH_INPUT")
+    if batch_input:
+        run_batch(batch_input, os.environ.get("BATCH_OUTPUT") or None)
+        return
+
+    question = os.environ.get("QUESTION") or input("输入自然语言问题: ")
+    schema = _load_schema()
 
     model = os.environ.get("OLLAMA_MODEL", "qwen2.5:7b")
     base_url = os.environ.get("OLLAMA_BASE_URL")  # e.g. http://localhost:11434
@@ -0,0 +1,72 @@
+"""
+运行指标模块 - 进程内的计数器与耗时统计
+供 /metrics 接口汇总展示缓存命中、预热进度等运行状态
+"""
+
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, Optional
+
+
+class Metrics:
+    """线程安全的简单指标收集器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """累加计数器"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """记录一次耗时（或其他数值）观测"""
+        with self._lock:
+            stat = self._timings.get(name)
+            if stat is None:
+                stat = {"count": 0, "total": 0.0, "min": value, "max": value}
+                self._timings[name] = stat
+            stat["count"] += 1
+            stat["total"] += value
+            stat["min"] = min(stat["min"], value)
+            stat["max"] = max(stat["max"], value)
+
+    def get(self, name: str) -> float:
+        """读取计数器当前值"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出当前全部指标"""
+        with self._lock:
+            timings = {}
+            for name, stat in self._timings.items():
+                timings[name] = {
+                    **stat,
+                    "avg": stat["total"] / stat["count"] if stat["count"] else 0.0,
+                }
+            return {"counters": dict(self._counters), "timings": timings}
+
+
+# 全局指标实例
+metrics = Metrics()
+
+
+# 当前请求各阶段的耗时，由 track_stages 开启，record_stage 在调用链深处累加
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("stages", default=None)
+
+
+def track_stages() -> Dict[str, float]:
+    """为当前上下文开启分阶段计时，返回累加结果的字典"""
+    stages: Dict[str, float] = {}
+    _stages.set(stages)
+    return stages
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """累加当前请求某个阶段的耗时，未开启计时时忽略"""
+    stages = _stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
@@ -0,0 +1,84 @@
+"""
+提示词预算模块 - 估算提示词token数，并按预算裁剪语义提示
+CPU上运行的Ollama中，提示词评估占每次调用的大头，提示越短延迟越低
+"""
+
+import math
+import re
+import threading
+from typing import List, Optional, Tuple
+
+from semantic_schema import semantic_manager
+
+# 超出预算时依次省略的细节，越靠前价值越低
+HINT_DROP_ORDER = [
+    "examples",
+    "business_rules",
+    "common_queries",
+    "description",
+    "constraints",
+    "field_meaning",
+]
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+_PIECE_PATTERN = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+
+class TokenEstimator:
+    """启发式token估算器
+
+    中文按每字约1个token、英文单词按每4个字母约1个token、数字与标点各1个token估算，
+    并用LLM返回的真实token数持续校准。
+    """
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.factor = 1.0
+        self._lock = threading.Lock()
+
+    def raw(self, text: str) -> int:
+        """未校准的估算值"""
+        cjk = len(_CJK_PATTERN.findall(text))
+        rest = _CJK_PATTERN.sub(" ", text)
+        count = cjk
+        for piece in _PIECE_PATTERN.findall(rest):
+            count += math.ceil(len(piece) / 4) if piece[0].isalpha() else 1
+        return count
+
+    def estimate(self, text: str) -> int:
+        """校准后的估算值"""
+        return math.ceil(self.raw(text) * self.factor)
+
+    def calibrate(self, raw_estimate: int, actual: int) -> None:
+        """用真实token数更新校准系数（指数滑动平均，限制在0.5~2倍之间）"""
+        if raw_estimate <= 0 or actual <= 0:
+            return
+        ratio = min(2.0, max(0.5, actual / raw_estimate))
+        with self._lock:
+            self.factor = (1 - self.alpha) * self.factor + self.alpha * ratio
+
+
+# 全局token估算器实例
+token_estimator = TokenEstimator()
+
+
+def fit_semantic_hint(
+    db_name: str,
+    budget: int,
+    table_names: Optional[List[str]] = None,
+) -> Tuple[str, int, List[str]]:
+    """在token预算内构建紧凑语义提示
+
+    Returns:
+        (提示文本, 估算token数, 被省略的细节列表)
+    """
+    dropped: List[str] = []
+    hint = semantic_manager.build_compact_hint(db_name, table_names, dropped)
+    tokens = token_estimator.estimate(hint)
+    for detail in HINT_DROP_ORDER:
+        if tokens <= budget:
+            break
+        dropped.append(detail)
+        hint = semantic_manager.build_compact_hint(db_name, table_names, dropped)
+        tokens = token_estimator.estimate(hint)
+    return hint, tokens, dropped
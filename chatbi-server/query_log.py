@@ -0,0 +1,302 @@
+"""
+查询日志模块 - 以紧凑的二进制格式追加记录每次翻译与执行
+每条记录包含问题、数据库、模型、SemanticSQL 哈希、SQL 形态指纹、各阶段耗时与返回行数，
+文件超过大小上限时按 RotatingFileHandler 的方式轮转，分析接口据此统计最慢/最频繁的查询
+"""
+
+import os
+import time
+import struct
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from metrics import metrics
+from sql_fingerprint import sql_fingerprint, stable_hash
+
+logger = logging.getLogger(__name__)
+
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG_ENABLED", "1") == "1"
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "chatbi-queries.bin")
+# 单个文件的大小上限（字节）与保留的轮转文件个数
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+
+KIND_TRANSLATE = 1
+KIND_EXECUTE = 2
+_KIND_NAMES = {KIND_TRANSLATE: "translate", KIND_EXECUTE: "execute"}
+
+_MAGIC = b"CBQL\x01"
+# 记录长度前缀
+_LENGTH = struct.Struct("<I")
+# 类型, 时间戳, 是否成功, 总耗时, LLM耗时, 数据库耗时, 行数(-1表示未知), SemanticSQL哈希, SQL形态指纹
+_HEADER = struct.Struct("<BdBfffqQQ")
+_STR_LENGTH = struct.Struct("<H")
+_MAX_STR_BYTES = 0xFFFF
+# 读取日志文件的缓冲区大小
+_READ_BUFFER = 1024 * 1024
+
+def semantic_hash(semantic) -> int:
+    return stable_hash(semantic.model_dump_json(by_alias=True)) if semantic is not None else 0
+
+
+def _pack_str(text: Optional[str]) -> bytes:
+    data = (text or "").encode("utf-8")[:_MAX_STR_BYTES]
+    # 截断可能切开多字节字符，解码时忽略残缺部分
+    return _STR_LENGTH.pack(len(data)) + data
+
+
+class QueryRecord:
+    """一条查询日志记录"""
+
+    __slots__ = ("kind", "ts", "success", "total_seconds", "llm_seconds", "db_seconds", "row_count",
+                 "semantic_hash", "sql_hash", "question", "db_name", "model", "sql")
+
+    def __init__(self, kind: int, ts: float, success: bool, total_seconds: float, llm_seconds: float,
+                 db_seconds: float, row_count: int, semantic_hash: int, sql_hash: int,
+                 question: str, db_name: str, model: str, sql: str):
+        self.kind = kind
+        self.ts = ts
+        self.success = success
+        self.total_seconds = total_seconds
+        self.llm_seconds = llm_seconds
+        self.db_seconds = db_seconds
+        self.row_count = row_count
+        self.semantic_hash = semantic_hash
+        self.sql_hash = sql_hash
+        self.question = question
+        self.db_name = db_name
+        self.model = model
+        self.sql = sql
+
+    def pack(self) -> bytes:
+        payload = _HEADER.pack(
+            self.kind, self.ts, 1 if self.success else 0, self.total_seconds, self.llm_seconds,
+            self.db_seconds, self.row_count, self.semantic_hash, self.sql_hash
+        ) + b"".join(_pack_str(s) for s in (self.question, self.db_name, self.model, self.sql))
+        return _LENGTH.pack(len(payload)) + payload
+
+    @classmethod
+    def unpack(cls, payload: bytes) -> "QueryRecord":
+        fields = list(_HEADER.unpack_from(payload))
+        fields[2] = bool(fields[2])
+        offset = _HEADER.size
+        texts = []
+        for _ in range(4):
+            (length,) = _STR_LENGTH.unpack_from(payload, offset)
+            offset += _STR_LENGTH.size
+            texts.append(payload[offset:offset + length].decode("utf-8", errors="ignore"))
+            offset += length
+        return cls(*fields, *texts)
+
+
+def _valid_length(f) -> int:
+    """按长度前缀走一遍文件，返回最后一条完整记录的结束位置"""
+    f.seek(0)
+    if f.read(len(_MAGIC)) != _MAGIC:
+        return 0
+    end = len(_MAGIC)
+    while True:
+        prefix = f.read(_LENGTH.size)
+        if len(prefix) < _LENGTH.size:
+            return end
+        (length,) = _LENGTH.unpack(prefix)
+        f.seek(length, os.SEEK_CUR)
+        if f.tell() > os.fstat(f.fileno()).st_size:
+            return end
+        end = f.tell()
+
+
+def read_records(path: str) -> Iterator[QueryRecord]:
+    """按长度前缀逐条读取一个日志文件，内存中只保留当前记录；末尾写了一半的记录（进程崩溃时）直接忽略"""
+    try:
+        f = open(path, "rb", buffering=_READ_BUFFER)
+    except OSError:
+        return
+    with f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            logger.warning(f"查询日志格式不识别，已跳过 - 文件: {path}")
+            return
+        while True:
+            prefix = f.read(_LENGTH.size)
+            if len(prefix) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(prefix)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            try:
+                yield QueryRecord.unpack(payload)
+            except struct.error:
+                return
+
+
+class QueryLog:
+    """追加写入的二进制查询日志"""
+
+    def __init__(self, path: str = QUERY_LOG_PATH, max_bytes: int = QUERY_LOG_MAX_BYTES,
+                 backups: int = QUERY_LOG_BACKUPS, enabled: bool = QUERY_LOG_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = enabled
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            # 上次进程崩溃可能留下写了一半的记录，截掉后再追加，否则后续记录都读不到
+            with open(self.path, "r+b") as f:
+                valid = _valid_length(f)
+                if valid < os.fstat(f.fileno()).st_size:
+                    f.truncate(valid)
+                    logger.warning(f"查询日志末尾有不完整的记录，已截断 - 文件: {self.path}")
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(_MAGIC)
+            self._size = len(_MAGIC)
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        metrics.incr("query_log.rotations")
+
+    def append(self, record: QueryRecord) -> None:
+        if not self.enabled:
+            return
+        data = record.pack()
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._open()
+                if self._size + len(data) > self.max_bytes and self._size > len(_MAGIC):
+                    self._rotate()
+                    self._open()
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+        except OSError as e:
+            # 日志写入失败不影响查询本身
+            metrics.incr("query_log.write_failed")
+            logger.warning(f"写入查询日志失败: {e}")
+
+    def log(self, kind: int, question: str = "", db_name: str = "", model: str = "", semantic=None,
+            sql: str = "", success: bool = True, total_seconds: float = 0.0,
+            stages: Optional[Dict[str, float]] = None, row_count: int = -1) -> None:
+        """记录一次翻译或执行，stages 为 metrics.track_stages 收集的分阶段耗时"""
+        stages = stages or {}
+        self.append(QueryRecord(
+            kind, time.time(), success, total_seconds, stages.get("llm", 0.0), stages.get("db", 0.0),
+            row_count, semantic_hash(semantic), sql_fingerprint(sql).hash if sql else 0,
+            question, db_name, model, sql
+        ))
+
+    def files(self) -> List[str]:
+        """从最旧到最新的日志文件"""
+        backups = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)]
+        return [p for p in backups + [self.path] if os.path.exists(p)]
+
+    def records(self, since: Optional[float] = None) -> Iterator[QueryRecord]:
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        for path in self.files():
+            for record in read_records(path):
+                if since is None or record.ts >= since:
+                    yield record
+
+    def top_queries(self, order: str = "slow", top: int = 10, since: Optional[float] = None,
+                    kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按查询分组统计，order 为 slow（按平均耗时）或 frequent（按次数）
+
+        有SQL的记录按 (类型, 数据库, SQL形态指纹) 分组，只有字面量不同的SQL归为一组；
+        翻译失败没有SQL时按问题分组。
+        """
+        groups: Dict[Tuple[int, str, Any], Dict[str, Any]] = {}
+        for r in self.records(since):
+            if kind is not None and _KIND_NAMES.get(r.kind) != kind:
+                continue
+            key = (r.kind, r.db_name, r.sql_hash or r.question)
+            g = groups.get(key)
+            if g is None:
+                g = groups[key] = {
+                    "kind": _KIND_NAMES.get(r.kind, str(r.kind)),
+                    "db_name": r.db_name,
+                    "fingerprint": f"{r.sql_hash:016x}",
+                    "shape": sql_fingerprint(r.sql).shape,
+                    "sql": r.sql,
+                    "question": r.question,
+                    "models": set(),
+                    "count": 0,
+                    "failures": 0,
+                    "latencies": [],
+                    "llm_seconds": 0.0,
+                    "db_seconds": 0.0,
+                    "rows": 0,
+                    "rows_known": 0,
+                    "last_seen": 0.0,
+                }
+            g["count"] += 1
+            g["failures"] += 0 if r.success else 1
+            g["latencies"].append(r.total_seconds)
+            g["llm_seconds"] += r.llm_seconds
+            g["db_seconds"] += r.db_seconds
+            if r.row_count >= 0:
+                g["rows"] += r.row_count
+                g["rows_known"] += 1
+            if r.model:
+                g["models"].add(r.model)
+            if r.question and not g["question"]:
+                g["question"] = r.question
+            g["last_seen"] = max(g["last_seen"], r.ts)
+
+        items = []
+        for g in groups.values():
+            latencies = sorted(g.pop("latencies"))
+            count = g["count"]
+            rows, rows_known = g.pop("rows"), g.pop("rows_known")
+            g["models"] = sorted(g["models"])
+            g["avg_seconds"] = round(sum(latencies) / count, 4)
+            g["p95_seconds"] = round(latencies[min(count - 1, int(count * 0.95))], 4)
+            g["max_seconds"] = round(latencies[-1], 4)
+            g["avg_llm_seconds"] = round(g.pop("llm_seconds") / count, 4)
+            g["avg_db_seconds"] = round(g.pop("db_seconds") / count, 4)
+            g["avg_rows"] = round(rows / rows_known, 1) if rows_known else None
+            items.append(g)
+        if order == "frequent":
+            items.sort(key=lambda g: (g["count"], g["avg_seconds"]), reverse=True)
+        else:
+            items.sort(key=lambda g: (g["avg_seconds"], g["count"]), reverse=True)
+        return items[:top]
+
+    def top_questions(self, top_n: int) -> List[Tuple[str, str]]:
+        """翻译成功次数最多的 (问题, 数据库)，供缓存预热使用"""
+        counts: Dict[Tuple[str, str], int] = {}
+        for r in self.records():
+            if r.kind == KIND_TRANSLATE and r.success and r.question:
+                key = (r.question.strip(), r.db_name)
+                counts[key] = counts.get(key, 0) + 1
+        return [key for key, _ in sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:top_n]]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# 全局查询日志实例
+query_log = QueryLog()
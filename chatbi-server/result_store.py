@@ -0,0 +1,256 @@
+"""
+查询结果物化模块 - 在内存预算内保存查询结果，超出预算时落盘
+结果行按批从游标读取；超过行数或字节预算后，全部结果以紧凑的行数组格式写入临时文件，
+客户端拿到 result_id 后可以分页读取或整体下载，单个进程的内存占用与结果大小无关
+"""
+
+import os
+import csv
+import io
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+from array import array
+from typing import Any, Dict, Iterator, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 内存预算：超过任一上限即落盘
+RESULT_MEMORY_ROWS = int(os.getenv("RESULT_MEMORY_ROWS", "10000"))
+RESULT_MEMORY_BYTES = int(os.getenv("RESULT_MEMORY_BYTES", str(16 * 1024 * 1024)))
+# 落盘结果的默认分页大小，也是响应中预览的行数
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "1000"))
+RESULT_FETCH_BATCH = int(os.getenv("RESULT_FETCH_BATCH", "1000"))
+RESULT_SPILL_DIR = os.getenv("RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "chatbi-results"))
+RESULT_SPILL_TTL = float(os.getenv("RESULT_SPILL_TTL", "3600"))
+
+_ROW_OVERHEAD = 64
+
+
+def convert_value(value: Any) -> Any:
+    """把数据库返回值转换为可JSON序列化的形式"""
+    if hasattr(value, 'isoformat'):  # datetime 对象
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode('utf-8', errors='replace')
+    return value
+
+
+def _estimate_size(values: List[Any]) -> int:
+    """粗略估算一行在内存中的字节数"""
+    size = _ROW_OVERHEAD
+    for v in values:
+        size += len(v) + 49 if isinstance(v, str) else 32
+    return size
+
+
+class SpilledResult:
+    """落盘的查询结果
+
+    文件每行是一行数据的JSON数组（不重复列名），并每隔 page_size 行记录一次文件偏移，
+    分页读取时直接定位到所在页。
+    """
+
+    def __init__(self, result_id: str, path: str, columns: List[str], page_size: int):
+        self.result_id = result_id
+        self.path = path
+        self.columns = columns
+        self.page_size = page_size
+        self.row_count = 0
+        self.size_bytes = 0
+        self.created_at = time.time()
+        self._page_offsets = array("Q")
+
+    def append(self, f, values: List[Any]) -> None:
+        if self.row_count % self.page_size == 0:
+            self._page_offsets.append(self.size_bytes)
+        line = json.dumps(values, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+        f.write(line)
+        self.size_bytes += len(line)
+        self.row_count += 1
+
+    def iter_rows(self, offset: int = 0, limit: Optional[int] = None) -> Iterator[List[Any]]:
+        """从第 offset 行开始依次读取行数组"""
+        if offset >= self.row_count:
+            return
+        end = self.row_count if limit is None else min(self.row_count, offset + limit)
+        page = offset // self.page_size
+        with open(self.path, "rb") as f:
+            f.seek(self._page_offsets[page])
+            index = page * self.page_size
+            for line in f:
+                if index >= end:
+                    break
+                if index >= offset:
+                    yield json.loads(line)
+                index += 1
+
+    def page(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        limit = self.page_size if limit is None else limit
+        return [dict(zip(self.columns, values)) for values in self.iter_rows(offset, limit)]
+
+    def iter_csv(self) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+        for i, values in enumerate(self.iter_rows(), 1):
+            writer.writerow(values)
+            if i % RESULT_FETCH_BATCH == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def iter_ndjson(self) -> Iterator[str]:
+        for values in self.iter_rows():
+            yield json.dumps(dict(zip(self.columns, values)), ensure_ascii=False) + "\n"
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "result_id": self.result_id,
+            "columns": self.columns,
+            "row_count": self.row_count,
+            "size_bytes": self.size_bytes,
+            "created_at": self.created_at,
+        }
+
+
+class MaterializedResult:
+    """物化后的查询结果：data 为内存中的行（落盘时只是第一页预览），result_id 非空表示已落盘"""
+
+    def __init__(self, data: List[Dict[str, Any]], columns: List[str], row_count: int,
+                 result_id: Optional[str] = None):
+        self.data = data
+        self.columns = columns
+        self.row_count = row_count
+        self.result_id = result_id
+
+
+class ResultStore:
+    """落盘结果的登记表，过期结果在登记新结果时清理"""
+
+    def __init__(
+        self,
+        directory: str = RESULT_SPILL_DIR,
+        max_rows: int = RESULT_MEMORY_ROWS,
+        max_bytes: int = RESULT_MEMORY_BYTES,
+        page_size: int = RESULT_PAGE_SIZE,
+        ttl: float = RESULT_SPILL_TTL,
+    ):
+        self.directory = directory
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.page_size = page_size
+        self.ttl = ttl
+        self._results: Dict[str, SpilledResult] = {}
+        self._lock = threading.Lock()
+
+    def materialize(self, cursor, batch_size: int = RESULT_FETCH_BATCH) -> MaterializedResult:
+        """按批读取游标（元组行），在内存预算内返回全部结果，超出预算时落盘"""
+        columns = [desc[0] for desc in cursor.description] if cursor.description else []
+        rows: List[List[Any]] = []
+        used = 0
+        spilled: Optional[SpilledResult] = None
+        f = None
+        try:
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    values = [convert_value(v) for v in row]
+                    if spilled is not None:
+                        spilled.append(f, values)
+                        continue
+                    rows.append(values)
+                    used += _estimate_size(values)
+                    if len(rows) > self.max_rows or used > self.max_bytes:
+                        spilled, f = self._spill(columns, rows)
+                        # 只保留第一页作为预览
+                        del rows[self.page_size:]
+        except BaseException:
+            if spilled is not None:
+                f.close()
+                self._remove_file(spilled)
+            raise
+        if f is not None:
+            f.close()
+
+        if spilled is None:
+            return MaterializedResult([dict(zip(columns, v)) for v in rows], columns, len(rows))
+
+        self._register(spilled)
+        metrics.incr("results.spilled")
+        metrics.observe("results.spilled_bytes", spilled.size_bytes)
+        logger.info(f"查询结果超出内存预算，已落盘 - result_id: {spilled.result_id}, "
+                    f"行数: {spilled.row_count}, 文件大小: {spilled.size_bytes}字节")
+        return MaterializedResult([dict(zip(columns, v)) for v in rows], columns,
+                                  spilled.row_count, spilled.result_id)
+
+    def _spill(self, columns: List[str], rows: List[List[Any]]):
+        os.makedirs(self.directory, exist_ok=True)
+        result_id = uuid.uuid4().hex
+        spilled = SpilledResult(result_id, os.path.join(self.directory, f"{result_id}.jsonl"),
+                                columns, self.page_size)
+        f = open(spilled.path, "wb")
+        for values in rows:
+            spilled.append(f, values)
+        return spilled, f
+
+    def _register(self, spilled: SpilledResult) -> None:
+        now = time.time()
+        with self._lock:
+            expired = [r for r in self._results.values() if now - r.created_at > self.ttl]
+            for r in expired:
+                del self._results[r.result_id]
+            self._results[spilled.result_id] = spilled
+        for r in expired:
+            self._remove_file(r)
+
+    def get(self, result_id: str) -> Optional[SpilledResult]:
+        with self._lock:
+            result = self._results.get(result_id)
+        if result is None or time.time() - result.created_at > self.ttl:
+            return None
+        return result
+
+    def delete(self, result_id: str) -> bool:
+        with self._lock:
+            result = self._results.pop(result_id, None)
+        if result is None:
+            return False
+        self._remove_file(result)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            results = list(self._results.values())
+            self._results.clear()
+        for r in results:
+            self._remove_file(r)
+
+    @staticmethod
+    def _remove_file(result: SpilledResult) -> None:
+        try:
+            os.remove(result.path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            results = list(self._results.values())
+        return {
+            "spilled_results": len(results),
+            "spilled_bytes": sum(r.size_bytes for r in results),
+            "max_rows": self.max_rows,
+            "max_bytes": self.max_bytes,
+        }
+
+
+# 全局结果存储实例
+result_store = ResultStore()
@@ -0,0 +1,367 @@
+"""
+流量汇总模块 - 维护 ip_flow 按分钟/小时/天汇总的 bps 统计，并把可由汇总表回答的聚合查询改写到汇总表
+汇总表按 (时间桶, ip, intf) 保存样本数、bps 总和、最小值和最大值，后台线程定时增量刷新：
+分钟表来自原始数据，小时表来自分钟表，天表来自小时表
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "0") == "1"
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "60"))
+# 每次刷新回溯的时间（秒），覆盖迟到的数据
+ROLLUP_LATENESS = int(os.getenv("ROLLUP_LATENESS", "600"))
+# 汇总表超过该时间（秒）未成功刷新时不再改写查询
+ROLLUP_MAX_STALENESS = float(os.getenv("ROLLUP_MAX_STALENESS", "300"))
+
+SOURCE_TABLE = "ip_flow"
+
+# (级别, 桶宽秒数, 汇总表, 数据来源表, 桶表达式)，从粗到细
+LEVELS = [
+    ("day", 86400, "ip_flow_rollup_day", "ip_flow_rollup_hour", "DATE(bucket)"),
+    ("hour", 3600, "ip_flow_rollup_hour", "ip_flow_rollup_minute", "DATE_FORMAT(bucket, '%%Y-%%m-%%d %%H:00:00')"),
+    ("minute", 60, "ip_flow_rollup_minute", SOURCE_TABLE, "DATE_FORMAT(`timestamp`, '%%Y-%%m-%%d %%H:%%i:00')"),
+]
+
+_CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS {table} (
+  bucket DATETIME NOT NULL,
+  ip VARCHAR(45) NOT NULL,
+  intf VARCHAR(100) NOT NULL,
+  sample_count BIGINT NOT NULL,
+  bps_sum DECIMAL(38, 0) NOT NULL,
+  bps_min BIGINT NOT NULL,
+  bps_max BIGINT NOT NULL,
+  PRIMARY KEY (bucket, intf, ip),
+  INDEX (ip, intf, bucket)
+)
+"""
+
+_REFRESH_SQL = """
+INSERT INTO {table} (bucket, ip, intf, sample_count, bps_sum, bps_min, bps_max)
+SELECT * FROM (
+  SELECT {bucket} AS b, ip, intf, {count} AS c, {sum} AS s, {min} AS lo, {max} AS hi
+  FROM {source} {where}
+  GROUP BY b, ip, intf
+) AS src
+ON DUPLICATE KEY UPDATE sample_count = src.c, bps_sum = src.s, bps_min = src.lo, bps_max = src.hi
+"""
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _floor(value: datetime, seconds: int) -> datetime:
+    if seconds >= 86400:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if seconds >= 3600:
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(second=0, microsecond=0)
+
+
+class RollupManager:
+    """汇总表的建表、增量刷新与新鲜度状态"""
+
+    def __init__(
+        self,
+        connect: Optional[Callable[[], Any]] = None,
+        interval: float = ROLLUP_REFRESH_INTERVAL,
+        lateness: int = ROLLUP_LATENESS,
+        max_staleness: float = ROLLUP_MAX_STALENESS,
+    ):
+        """
+        Args:
+            connect: 返回一个指向 ip_flow 所在数据库的新连接
+        """
+        self.connect = connect
+        self.interval = interval
+        self.lateness = lateness
+        self.max_staleness = max_staleness
+        self.last_refresh: Optional[Dict[str, Any]] = None
+        self._last_success = 0.0
+        self._tables_ready = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_fresh(self) -> bool:
+        """汇总表是否足够新，可以用来回答查询"""
+        return self._last_success > 0 and time.monotonic() - self._last_success <= self.max_staleness
+
+    def refresh(self, full: bool = False) -> Dict[str, Any]:
+        """增量刷新所有级别；full=True 时从头重建"""
+        if self.connect is None:
+            raise RuntimeError("未配置汇总表的数据库连接")
+        started = time.monotonic()
+        with self._lock:
+            conn = self.connect()
+            try:
+                cursor = conn.cursor()
+                if not self._tables_ready:
+                    for _, _, table, _, _ in LEVELS:
+                        cursor.execute(_CREATE_TABLE_SQL.format(table=table))
+                    self._tables_ready = True
+
+                since = None if full else self._refresh_start(cursor)
+                rows: Dict[str, int] = {}
+                # 先刷新细粒度，再逐级向上汇总
+                for level, seconds, table, source, bucket in reversed(LEVELS):
+                    rows[level] = self._refresh_level(cursor, table, source, bucket, seconds, since)
+                conn.commit()
+            finally:
+                conn.close()
+
+        self._last_success = time.monotonic()
+        stats = {
+            "since": since.isoformat() if since else None,
+            "rows": rows,
+            "duration": time.monotonic() - started,
+            "finished_at": time.time(),
+        }
+        self.last_refresh = stats
+        metrics.observe("rollup.refresh_seconds", stats["duration"])
+        logger.info(f"流量汇总表刷新完成 - 起点: {stats['since'] or '全量'}, 行数: {rows}, "
+                    f"耗时: {stats['duration']:.2f}秒")
+        return stats
+
+    def _refresh_start(self, cursor) -> Optional[datetime]:
+        """从分钟表的最新时间桶往前回溯 lateness 秒作为本次刷新起点，表为空时全量刷新"""
+        cursor.execute(f"SELECT MAX(bucket) FROM {LEVELS[-1][2]}")
+        row = cursor.fetchone()
+        if not row or row[0] is None:
+            return None
+        # 各级别再分别对齐到自己的桶边界，被涉及的时间桶都会完整重算
+        return _floor(row[0] - timedelta(seconds=self.lateness), 60)
+
+    @staticmethod
+    def _refresh_level(cursor, table: str, source: str, bucket: str, seconds: int,
+                       since: Optional[datetime]) -> int:
+        raw = source == SOURCE_TABLE
+        time_column = "`timestamp`" if raw else "bucket"
+        sql = _REFRESH_SQL.format(
+            table=table,
+            source=source,
+            bucket=bucket,
+            where=f"WHERE {time_column} >= %s",
+            count="COUNT(*)" if raw else "SUM(sample_count)",
+            sum="SUM(bps)" if raw else "SUM(bps_sum)",
+            min="MIN(bps)" if raw else "MIN(bps_min)",
+            max="MAX(bps)" if raw else "MAX(bps_max)",
+        )
+        # 始终绑定参数：没有参数时驱动不会把 %% 还原为 %
+        cursor.execute(sql, (_floor(since, seconds) if since else _EPOCH,))
+        return cursor.rowcount
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="rollup-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                metrics.incr("rollup.refresh_failed")
+                logger.warning(f"流量汇总表刷新失败: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.connect is not None,
+            "fresh": self.is_fresh(),
+            "last_refresh": self.last_refresh,
+        }
+
+
+# 全局汇总管理器，由服务启动时配置连接
+rollup_manager = RollupManager()
+
+
+# ---------------- 查询改写 ----------------
+
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_QUALIFIER_PATTERN = re.compile(rf"`?\b{SOURCE_TABLE}\b`?\s*\.\s*")
+_TIMESTAMP_PATTERN = re.compile(r"`?\btimestamp\b`?", re.IGNORECASE)
+_AGGREGATE_PATTERN = re.compile(
+    r"\b(SUM|AVG|MIN|MAX|COUNT)\s*\(\s*(DISTINCT\s+)?`?(\w+|\*)`?\s*\)", re.IGNORECASE
+)
+_UNSUPPORTED_COLUMN_PATTERN = re.compile(r"`?\b(bps|id|created_at)\b`?")
+_TS = r"`?timestamp`?"
+# 时间分桶函数 -> 需要的最细时间粒度（秒）
+_TIME_FUNCTIONS: List[Tuple[re.Pattern, Optional[int]]] = [
+    (re.compile(rf"\bDATE_FORMAT\s*\(\s*{_TS}\s*,\s*'([^']*)'\s*\)", re.IGNORECASE), None),
+    (re.compile(rf"\bFROM_UNIXTIME\s*\(\s*FLOOR\s*\(\s*UNIX_TIMESTAMP\s*\(\s*{_TS}\s*\)\s*/\s*(\d+)\s*\)"
+                rf"\s*\*\s*(\d+)\s*\)", re.IGNORECASE), None),
+    (re.compile(rf"\b(?:DATE|YEAR|MONTH|DAY|DAYOFMONTH|DAYOFWEEK|DAYOFYEAR|WEEKDAY|WEEK|YEARWEEK|QUARTER"
+                rf"|DAYNAME|MONTHNAME|TO_DAYS)\s*\(\s*{_TS}\s*\)", re.IGNORECASE), 86400),
+    (re.compile(rf"\bHOUR\s*\(\s*{_TS}\s*\)", re.IGNORECASE), 3600),
+    (re.compile(rf"\bMINUTE\s*\(\s*{_TS}\s*\)", re.IGNORECASE), 60),
+]
+_FORMAT_GRANULARITY = [("sSfTrUuVvXx", 1), ("i", 60), ("HhIkl", 3600)]
+_DATETIME_LITERAL = re.compile(r"^'(\d{4}-\d{2}-\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?'$")
+
+
+class _Ineligible(Exception):
+    """查询无法由汇总表精确回答"""
+
+
+def _format_granularity(fmt: str) -> int:
+    specifiers = set(re.findall(r"%(.)", fmt))
+    for chars, seconds in _FORMAT_GRANULARITY:
+        if specifiers & set(chars):
+            return seconds
+    return 86400
+
+
+def _literal_granularity(literal: str) -> int:
+    """时间字面量对齐到的最粗粒度，只有对齐的边界才能精确换算到时间桶"""
+    match = _DATETIME_LITERAL.match(literal.strip())
+    if not match:
+        raise _Ineligible(f"无法识别的时间值: {literal}")
+    _, hour, minute, second = match.groups()
+    if second not in (None, "00"):
+        return 1
+    if minute not in (None, "00"):
+        return 60
+    if hour not in (None, "00"):
+        return 3600
+    return 86400
+
+
+class _Rewriter:
+    def __init__(self):
+        self.granularity = 86400 * 366
+
+    def _require(self, seconds: int) -> None:
+        if seconds < 60:
+            raise _Ineligible("时间粒度细于分钟")
+        self.granularity = min(self.granularity, seconds)
+
+    def expr(self, expr: str) -> str:
+        """改写一个表达式：bps 聚合换算为汇总列，时间分桶函数作用于 bucket"""
+        body = _QUALIFIER_PATTERN.sub("", expr)
+
+        # 时间列只能出现在分桶函数中
+        stripped = _STRING_PATTERN.sub("''", body)
+        total = len(_TIMESTAMP_PATTERN.findall(stripped))
+        wrapped = 0
+        for pattern, seconds in _TIME_FUNCTIONS:
+            for match in pattern.finditer(body):
+                wrapped += 1
+                if seconds is not None:
+                    self._require(seconds)
+                elif match.re is _TIME_FUNCTIONS[0][0]:
+                    self._require(_format_granularity(match.group(1)))
+                else:
+                    step, factor = int(match.group(1)), int(match.group(2))
+                    if step != factor:
+                        raise _Ineligible("时间分桶表达式不一致")
+                    # 按UTC纪元对齐的桶与本地时区的小时/天边界未必重合，只按分钟粒度换算
+                    self._require(60 if step % 60 == 0 else 1)
+        if wrapped != total:
+            raise _Ineligible("直接使用了原始时间列")
+        body = _TIMESTAMP_PATTERN.sub("bucket", body)
+
+        def aggregate(match: re.Match) -> str:
+            func, distinct, column = match.group(1).upper(), match.group(2), match.group(3).lower()
+            if distinct:
+                if column in ("ip", "intf"):
+                    return match.group(0)
+                raise _Ineligible(f"不支持的去重聚合: {match.group(0)}")
+            if func == "COUNT" and column in ("*", "bps", "ip", "intf"):
+                return "SUM(sample_count)"
+            if column != "bps":
+                raise _Ineligible(f"不支持的聚合: {match.group(0)}")
+            return {
+                "SUM": "SUM(bps_sum)",
+                "AVG": "(SUM(bps_sum) / SUM(sample_count))",
+                "MIN": "MIN(bps_min)",
+                "MAX": "MAX(bps_max)",
+            }[func]
+
+        body = _AGGREGATE_PATTERN.sub(aggregate, body)
+        if _UNSUPPORTED_COLUMN_PATTERN.search(_STRING_PATTERN.sub("''", body)):
+            raise _Ineligible("引用了汇总表中没有的列")
+        return body
+
+    def condition(self, cond) -> Any:
+        """改写 WHERE 条件：维度列原样保留，原始时间列只接受对齐边界上的 >= / <"""
+        left = _QUALIFIER_PATTERN.sub("", cond.left).strip()
+        if _TIMESTAMP_PATTERN.fullmatch(left):
+            if cond.op.strip() not in (">=", "<"):
+                raise _Ineligible(f"时间条件无法换算到时间桶: {cond.op}")
+            self._require(_literal_granularity(cond.right))
+            return cond.model_copy(update={"left": "bucket"})
+        if _TIMESTAMP_PATTERN.search(cond.right) or _UNSUPPORTED_COLUMN_PATTERN.search(
+                _STRING_PATTERN.sub("''", cond.right)):
+            raise _Ineligible("条件右侧引用了列")
+        return cond.model_copy(update={"left": self.expr(cond.left)})
+
+
+def route_to_rollup(semantic, require_fresh: bool = True) -> Optional[str]:
+    """把 ip_flow 上的聚合查询改写到能回答它的最粗粒度汇总表
+
+    只有单表查询、bps 只出现在 SUM/AVG/MIN/MAX/COUNT 中、时间只按分钟及以上粒度分桶或按对齐边界过滤时才改写；
+    不满足条件或汇总表不够新时返回 None，调用方继续使用原始SQL。
+    """
+    from translator import render_mysql_sql, ColumnRef
+
+    q = semantic.query
+    if q.from_ != [SOURCE_TABLE] or q.joins:
+        return None
+    if require_fresh and not rollup_manager.is_fresh():
+        return None
+
+    rewriter = _Rewriter()
+    try:
+        grouped = {_QUALIFIER_PATTERN.sub("", g).replace("`", "").strip() for g in q.group_by or []}
+        select: List[Any] = []
+        for col in q.select:
+            column = col.column
+            if col.table and col.table != SOURCE_TABLE:
+                return None
+            if column == "*":
+                raise _Ineligible("SELECT *")
+            if not _AGGREGATE_PATTERN.search(column) and column.replace("`", "") not in grouped \
+                    and col.alias not in grouped:
+                raise _Ineligible(f"非聚合列未分组: {column}")
+            # 未指定别名时保留原来的列名，结果对调用方透明
+            alias = col.alias or (column.replace("`", "") if col.table is None else None)
+            select.append(ColumnRef(column=rewriter.expr(column), alias=alias))
+        if not q.group_by and not any(_AGGREGATE_PATTERN.search(c.column) for c in q.select):
+            raise _Ineligible("不是聚合查询")
+
+        rewritten = q.model_copy(update={
+            "select": select,
+            "where": [rewriter.condition(c) for c in q.where or []] or None,
+            "group_by": [rewriter.expr(g) for g in q.group_by or []] or None,
+            "having": [rewriter.condition(c) for c in q.having or []] or None,
+            "order_by": [o.model_copy(update={"by": rewriter.expr(o.by)}) for o in q.order_by or []] or None,
+        })
+    except _Ineligible as e:
+        metrics.incr("rollup.ineligible")
+        logger.debug(f"查询不能使用汇总表: {e}")
+        return None
+
+    for level, seconds, table, _, _ in LEVELS:
+        if rewriter.granularity % seconds == 0:
+            metrics.incr(f"rollup.routed.{level}")
+            routed = rewritten.model_copy(update={"from_": [table]})
+            return render_mysql_sql(semantic.model_copy(update={"query": routed}))
+    return None
@@ -3,10 +3,26 @@
 用于为LLM提供更丰富的上下文信息，提高SQL生成的准确性
 """
 
-from typing import Dict, List, Optional, Any
+import os
+import json
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Any
 from pydantic import BaseModel, Field
 from enum import Enum
 
+logger = logging.getLogger(__name__)
+
+# 语义模式文件目录：每个 <数据库名>.yaml / .yml / .json 文件定义一个数据库，同名时覆盖内置模式
+SEMANTIC_SCHEMA_DIR = os.getenv(
+    "SEMANTIC_SCHEMA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "semantic_schemas")
+)
+# 检查模式文件变更的间隔（秒），<=0 表示不自动热加载
+SEMANTIC_SCHEMA_RELOAD_INTERVAL = float(os.getenv("SEMANTIC_SCHEMA_RELOAD_INTERVAL", "5"))
+
+SCHEMA_FILE_EXTENSIONS = (".yaml", ".yml", ".json")
+
 
 class DataType(str, Enum):
     """数据类型枚举"""
@@ -54,41 +70,313 @@ class DatabaseSemantic(BaseModel):
     version: Optional[str] = Field(default="1.0", description="版本号")
 
 
+class Relationship(NamedTuple):
+    """外键关系：source_table.source_field -> target_table.target_field"""
+    source_table: str
+    source_field: str
+    target_table: str
+    target_field: str
+
+
+def load_schema_file(path: str) -> DatabaseSemantic:
+    """解析单个YAML/JSON语义模式文件，未写 name 时使用文件名作为数据库名"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+        else:
+            import yaml  # 只有用到YAML文件时才需要 PyYAML
+            data = yaml.safe_load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"语义模式文件格式错误，顶层应为对象: {path}")
+    data.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    return DatabaseSemantic(**data)
+
+
+class _SchemaSource(NamedTuple):
+    """尚未解析的模式来源：模式文件（path 与 (mtime, size) 签名）或内置工厂函数"""
+    loader: Callable[[], DatabaseSemantic]
+    path: Optional[str] = None
+    signature: Optional[Tuple[int, int]] = None
+
+
 class SemanticSchemaManager:
-    """语义模式管理器"""
+    """语义模式管理器
+    
+    模式可以直接 add_schema，也可以登记为惰性来源（内置工厂函数或模式目录中的文件），
+    首次用到某个数据库时才解析；模式目录变更后只重新加载变化的文件，并通知监听者失效派生缓存。
+    """
     
     def __init__(self):
+        # 已解析的模式
         self.schemas: Dict[str, DatabaseSemantic] = {}
+        # 可惰性加载的模式来源
+        self._sources: Dict[str, _SchemaSource] = {}
+        self._builtins: Dict[str, Callable[[], DatabaseSemantic]] = {}
+        self._load_lock = threading.RLock()
+        self._listeners: List[Callable[[str], None]] = []
+        self._schema_dir: Optional[str] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        # 索引在 add_schema 时构建，查询均为 O(1)
+        self._table_index: Dict[str, Dict[str, TableSemantic]] = {}
+        self._field_index: Dict[str, Dict[Tuple[str, str], FieldSemantic]] = {}
+        self._type_index: Dict[str, Dict[DataType, List[Tuple[str, FieldSemantic]]]] = {}
+        self._relationship_index: Dict[str, Dict[str, List[Relationship]]] = {}
+        # 连接图：每张表出发的BFS前驱表 {起点: {终点: (前一张表, 关系)}}，用于还原最短连接路径
+        self._join_parents: Dict[str, Dict[str, Dict[str, Tuple[str, Relationship]]]] = {}
     
     def add_schema(self, schema: DatabaseSemantic):
         """添加语义模式"""
-        self.schemas[schema.name] = schema
+        with self._load_lock:
+            replaced = schema.name in self.schemas
+            self.schemas[schema.name] = schema
+            self._sources.pop(schema.name, None)
+            self.reindex(schema.name)
+        if replaced:
+            self._notify(schema.name)
+    
+    def register_schema(self, db_name: str, loader: Callable[[], DatabaseSemantic]):
+        """登记惰性加载的模式，首次使用时才调用 loader 构建"""
+        with self._load_lock:
+            self._builtins[db_name] = loader
+            if db_name in self._sources and self._sources[db_name].path:
+                # 模式文件优先于内置模式
+                return
+            self._sources[db_name] = _SchemaSource(loader)
+    
+    def add_listener(self, callback: Callable[[str], None]):
+        """注册模式变更回调，参数为发生变化的数据库名"""
+        self._listeners.append(callback)
+    
+    def _notify(self, db_name: str):
+        for callback in list(self._listeners):
+            try:
+                callback(db_name)
+            except Exception as e:
+                logger.error(f"语义模式变更回调失败 - 数据库: {db_name}, 错误: {e}")
+    
+    def list_databases(self) -> List[str]:
+        """所有可用的数据库名（含尚未加载的）"""
+        with self._load_lock:
+            return sorted(set(self.schemas) | set(self._sources))
+    
+    def _ensure_loaded(self, db_name: str):
+        if db_name in self.schemas or db_name not in self._sources:
+            return
+        with self._load_lock:
+            source = self._sources.get(db_name)
+            if db_name in self.schemas or source is None:
+                return
+            schema = self._parse(db_name, source)
+            if schema is None:
+                return
+            self.schemas[db_name] = schema
+            self.reindex(db_name)
+    
+    @staticmethod
+    def _parse(db_name: str, source: _SchemaSource) -> Optional[DatabaseSemantic]:
+        try:
+            schema = source.loader()
+        except Exception as e:
+            logger.error(f"加载语义模式失败 - 数据库: {db_name}, 来源: {source.path or '内置'}, 错误: {e}")
+            return None
+        if schema.name != db_name:
+            logger.warning(f"语义模式名与文件名不一致，以文件名为准 - 文件: {source.path}, name: {schema.name}")
+            schema = schema.model_copy(update={"name": db_name})
+        logger.info(f"已加载语义模式 - 数据库: {db_name}, 表数量: {len(schema.tables)}")
+        return schema
+    
+    @staticmethod
+    def _scan_dir(schema_dir: str) -> Dict[str, Tuple[str, Tuple[int, int]]]:
+        """扫描模式目录，返回 {数据库名: (文件路径, (mtime_ns, size))}"""
+        found: Dict[str, Tuple[str, Tuple[int, int]]] = {}
+        try:
+            entries = sorted(os.scandir(schema_dir), key=lambda e: e.name)
+        except FileNotFoundError:
+            return found
+        for entry in entries:
+            db_name, ext = os.path.splitext(entry.name)
+            if ext.lower() not in SCHEMA_FILE_EXTENSIONS or not entry.is_file() or db_name in found:
+                continue
+            stat = entry.stat()
+            found[db_name] = (entry.path, (stat.st_mtime_ns, stat.st_size))
+        return found
+    
+    def load_directory(self, schema_dir: str) -> List[str]:
+        """从目录登记模式文件（不解析），之后可用 reload_changed 增量热加载"""
+        self._schema_dir = schema_dir
+        return self.reload_changed()
+    
+    def reload_changed(self) -> List[str]:
+        """对比模式目录中文件的修改时间与大小，增量处理新增、修改、删除的文件
+        
+        已加载的模式立即重新解析并整体替换（解析失败时保留旧版本），未加载的只更新来源；
+        返回发生变化的数据库名，并逐个通知监听者。
+        """
+        if not self._schema_dir:
+            return []
+        found = self._scan_dir(self._schema_dir)
+        changed: List[str] = []
+        with self._load_lock:
+            for db_name, source in list(self._sources.items()):
+                if source.path and db_name not in found:
+                    # 文件被删除，有内置模式时退回内置模式
+                    if db_name in self._builtins:
+                        self._sources[db_name] = _SchemaSource(self._builtins[db_name])
+                    else:
+                        del self._sources[db_name]
+                    self.schemas.pop(db_name, None)
+                    self.reindex(db_name)
+                    changed.append(db_name)
+            for db_name, (path, signature) in found.items():
+                current = self._sources.get(db_name)
+                if current is not None and current.path == path and current.signature == signature:
+                    continue
+                source = _SchemaSource(lambda path=path: load_schema_file(path), path, signature)
+                self._sources[db_name] = source
+                if db_name in self.schemas:
+                    schema = self._parse(db_name, source)
+                    if schema is None:
+                        # 解析失败时继续使用旧版本，等待文件再次修改
+                        continue
+                    self.schemas[db_name] = schema
+                    self.reindex(db_name)
+                changed.append(db_name)
+        for db_name in changed:
+            self._notify(db_name)
+        if changed:
+            logger.info(f"语义模式目录有变化 - 数据库: {changed}")
+        return changed
+    
+    def start_watcher(self, interval: float = SEMANTIC_SCHEMA_RELOAD_INTERVAL):
+        """启动后台线程，按间隔检查模式目录变更"""
+        if interval <= 0 or not self._schema_dir or (self._watcher and self._watcher.is_alive()):
+            return
+        self._stop_event.clear()
+        
+        def watch():
+            while not self._stop_event.wait(interval):
+                try:
+                    self.reload_changed()
+                except Exception as e:
+                    logger.error(f"检查语义模式目录失败: {e}")
+        
+        self._watcher = threading.Thread(target=watch, name="schema-watcher", daemon=True)
+        self._watcher.start()
+    
+    def stop_watcher(self):
+        self._stop_event.set()
+    
+    def reindex(self, db_name: str):
+        """重建指定数据库的索引（直接修改了模式对象后需要调用）"""
+        schema = self.schemas.get(db_name)
+        if not schema:
+            for index in (self._table_index, self._field_index, self._type_index,
+                          self._relationship_index, self._join_parents):
+                index.pop(db_name, None)
+            return
+        
+        tables: Dict[str, TableSemantic] = {}
+        fields: Dict[Tuple[str, str], FieldSemantic] = {}
+        by_type: Dict[DataType, List[Tuple[str, FieldSemantic]]] = {}
+        relationships: Dict[str, List[Relationship]] = {}
+        for table in schema.tables:
+            # 同名表/字段以第一次出现的为准，与线性查找的行为一致
+            tables.setdefault(table.name, table)
+            for field in table.fields:
+                fields.setdefault((table.name, field.name), field)
+                by_type.setdefault(field.data_type, []).append((table.name, field))
+                for target_table, target_field in (field.relationships or {}).items():
+                    rel = Relationship(table.name, field.name, target_table, target_field)
+                    relationships.setdefault(table.name, []).append(rel)
+                    if target_table != table.name:
+                        relationships.setdefault(target_table, []).append(rel)
+        
+        self._table_index[db_name] = tables
+        self._field_index[db_name] = fields
+        self._type_index[db_name] = by_type
+        self._relationship_index[db_name] = relationships
+        self._join_parents[db_name] = self._build_join_parents(tables, relationships)
+    
+    @staticmethod
+    def _build_join_parents(
+        tables: Dict[str, TableSemantic],
+        relationships: Dict[str, List[Relationship]]
+    ) -> Dict[str, Dict[str, Tuple[str, Relationship]]]:
+        """对每张表做一次BFS，预计算到其他所有表的最短连接路径（以前驱形式保存）"""
+        adjacency: Dict[str, List[Tuple[str, Relationship]]] = {}
+        for table_name, rels in relationships.items():
+            for rel in rels:
+                if rel.source_table == table_name and rel.target_table in tables:
+                    adjacency.setdefault(rel.source_table, []).append((rel.target_table, rel))
+                    adjacency.setdefault(rel.target_table, []).append((rel.source_table, rel))
+        
+        parents: Dict[str, Dict[str, Tuple[str, Relationship]]] = {}
+        # 没有任何外键关系的孤立表不需要保存路径
+        for start in adjacency:
+            visited = {start: None}
+            frontier = [start]
+            while frontier:
+                next_frontier = []
+                for node in frontier:
+                    for neighbor, rel in adjacency.get(node, []):
+                        if neighbor not in visited:
+                            visited[neighbor] = (node, rel)
+                            next_frontier.append(neighbor)
+                frontier = next_frontier
+            parents[start] = {k: v for k, v in visited.items() if v is not None}
+        return parents
+    
+    def get_join_path(self, db_name: str, from_table: str, to_table: str) -> Optional[List[Tuple[str, str]]]:
+        """获取两表之间的最短连接路径
+        
+        返回从 from_table 出发依次需要连接的 (表名, 连接条件) 列表；
+        同一张表返回空列表，不连通返回 None
+        """
+        self._ensure_loaded(db_name)
+        if from_table == to_table:
+            return [] if from_table in self._table_index.get(db_name, {}) else None
+        parents = self._join_parents.get(db_name, {}).get(from_table)
+        if not parents or to_table not in parents:
+            return None
+        
+        steps: List[Tuple[str, str]] = []
+        node = to_table
+        while node != from_table:
+            prev, rel = parents[node]
+            condition = f"{rel.source_table}.{rel.source_field} = {rel.target_table}.{rel.target_field}"
+            steps.append((node, condition))
+            node = prev
+        steps.reverse()
+        return steps
     
     def get_schema(self, db_name: str) -> Optional[DatabaseSemantic]:
         """获取语义模式"""
+        self._ensure_loaded(db_name)
         return self.schemas.get(db_name)
     
     def get_table_semantic(self, db_name: str, table_name: str) -> Optional[TableSemantic]:
         """获取表格语义"""
-        schema = self.get_schema(db_name)
-        if not schema:
-            return None
-        
-        for table in schema.tables:
-            if table.name == table_name:
-                return table
-        return None
+        self._ensure_loaded(db_name)
+        return self._table_index.get(db_name, {}).get(table_name)
     
     def get_field_semantic(self, db_name: str, table_name: str, field_name: str) -> Optional[FieldSemantic]:
         """获取字段语义"""
-        table = self.get_table_semantic(db_name, table_name)
-        if not table:
-            return None
-        
-        for field in table.fields:
-            if field.name == field_name:
-                return field
-        return None
+        self._ensure_loaded(db_name)
+        return self._field_index.get(db_name, {}).get((table_name, field_name))
+    
+    def get_fields_by_type(self, db_name: str, data_type: DataType) -> List[Tuple[str, FieldSemantic]]:
+        """按数据类型获取字段，返回 (表名, 字段) 列表"""
+        self._ensure_loaded(db_name)
+        return list(self._type_index.get(db_name, {}).get(data_type, []))
+    
+    def get_relationships(self, db_name: str, table_name: Optional[str] = None) -> List[Relationship]:
+        """获取外键关系；指定表名时返回与该表相关（引用或被引用）的关系"""
+        self._ensure_loaded(db_name)
+        index = self._relationship_index.get(db_name, {})
+        if table_name is not None:
+            return list(index.get(table_name, []))
+        return list(dict.fromkeys(rel for rels in index.values() for rel in rels))
     
     def build_semantic_hint(self, db_name: str, table_names: Optional[List[str]] = None) -> str:
         """构建语义提示信息"""
@@ -132,6 +420,56 @@ class SemanticSchemaManager:
             lines.append("")
         
         return "\n".join(lines)
+    
+    def build_compact_hint(
+        self,
+        db_name: str,
+        table_names: Optional[List[str]] = None,
+        drop: Optional[Iterable[str]] = None
+    ) -> str:
+        """构建紧凑的语义提示信息
+        
+        每张表一行表头、每个字段一行，省略固定的标签文字。
+        drop 指定要省略的细节：examples, business_rules, common_queries,
+        description, constraints, field_meaning
+        """
+        schema = self.get_schema(db_name)
+        if not schema:
+            return "(无语义模式定义)"
+        
+        drop = set(drop or ())
+        lines = [f"数据库 {schema.name}: {schema.description}（{schema.business_domain}）"]
+        
+        for table in schema.tables:
+            if table_names and table.name not in table_names:
+                continue
+            
+            header = f"表 {table.name}: {table.business_meaning}"
+            if "description" not in drop:
+                header += f"，{table.description}"
+            if table.primary_key:
+                header += f" PK({table.primary_key})"
+            lines.append(header)
+            
+            if table.common_queries and "common_queries" not in drop:
+                lines.append(f" 常见查询: {'; '.join(table.common_queries)}")
+            if table.business_rules and "business_rules" not in drop:
+                lines.append(f" 规则: {'; '.join(table.business_rules)}")
+            
+            for field in table.fields:
+                field_info = f" {field.name} {field.data_type.value}"
+                if "field_meaning" not in drop:
+                    field_info += f" {field.business_meaning}"
+                if field.relationships:
+                    rels = [f"{k}.{v}" for k, v in field.relationships.items()]
+                    field_info += f" ->{','.join(rels)}"
+                if field.constraints and "constraints" not in drop:
+                    field_info += f" [{','.join(field.constraints)}]"
+                if field.examples and "examples" not in drop:
+                    field_info += f" 例:{','.join(field.examples)}"
+                lines.append(field_info)
+        
+        return "\n".join(lines)
 
 
 # 预定义的示例语义模式
@@ -461,6 +799,7 @@ def create_ip_flow_schema() -> DatabaseSemantic:
 # 全局语义模式管理器实例
 semantic_manager = SemanticSchemaManager()
 
-# 初始化示例模式
-semantic_manager.add_schema(create_sample_shop_schema())
-semantic_manager.add_schema(create_ip_flow_schema())
+# 登记示例模式（首次使用时才构建），模式目录中的同名文件优先
+semantic_manager.load_directory(SEMANTIC_SCHEMA_DIR)
+semantic_manager.register_schema("shop", create_sample_shop_schema)
+semantic_manager.register_schema("network", create_ip_flow_schema)
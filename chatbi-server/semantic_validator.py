@@ -0,0 +1,128 @@
+"""
+语义SQL校验模块 - 用语义模式和渲染器检查LLM生成的 SemanticSQL
+返回错误（无法使用）与警告（可疑，降低置信度），供级联翻译决定是否升级到大模型
+"""
+
+import re
+from typing import List, Optional, Set
+
+from semantic_schema import semantic_manager
+
+_QUALIFIED_PATTERN = re.compile(r"`?\b([A-Za-z_]\w*)`?\.`?([A-Za-z_]\w*|\*)`?")
+_IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_]\w*$")
+_AGGREGATE_PATTERN = re.compile(r"\b(COUNT|SUM|AVG|MAX|MIN|GROUP_CONCAT)\s*\(", re.IGNORECASE)
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+
+
+class ValidationResult:
+    """校验结果"""
+
+    def __init__(self, errors: List[str], warnings: List[str]):
+        self.errors = errors
+        self.warnings = warnings
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    @property
+    def confidence(self) -> float:
+        """基于校验结果的置信度：有错误为0，每条警告扣0.2"""
+        if self.errors:
+            return 0.0
+        return max(0.0, 1.0 - 0.2 * len(self.warnings))
+
+
+def _strip_strings(expr: str) -> str:
+    return _STRING_PATTERN.sub("''", expr or "")
+
+
+def validate_semantic(semantic, db_name: str) -> ValidationResult:
+    """校验 SemanticSQL 是否与语义模式一致且可以渲染"""
+    from translator import render_mysql_sql
+
+    errors: List[str] = []
+    warnings: List[str] = []
+    q = semantic.query
+
+    try:
+        render_mysql_sql(semantic)
+    except Exception as e:
+        errors.append(f"无法渲染SQL: {e}")
+        return ValidationResult(errors, warnings)
+
+    if not q.from_:
+        errors.append("缺少主表")
+    if not q.select:
+        errors.append("缺少查询列")
+
+    schema = semantic_manager.get_schema(db_name)
+    if not schema:
+        # 没有语义模式时只能做结构检查
+        return ValidationResult(errors, warnings)
+
+    tables: List[str] = list(q.from_) + [j.table for j in (q.joins or [])]
+    known_tables: Set[str] = set()
+    for table in tables:
+        if semantic_manager.get_table_semantic(db_name, table) is None:
+            errors.append(f"未知的表: {table}")
+        else:
+            known_tables.add(table)
+
+    aliases: Set[str] = {c.alias for c in q.select if c.alias}
+
+    def check_expr(expr: Optional[str], where: str) -> None:
+        for table, column in _QUALIFIED_PATTERN.findall(_strip_strings(expr or "")):
+            if table not in tables:
+                errors.append(f"{where} 引用了未出现在 FROM/JOIN 中的表: {table}.{column}")
+            elif column != "*" and table in known_tables and \
+                    semantic_manager.get_field_semantic(db_name, table, column) is None:
+                errors.append(f"{where} 引用了未知的字段: {table}.{column}")
+
+    def check_bare_column(column: str, where: str) -> None:
+        if not _IDENTIFIER_PATTERN.match(column) or column in aliases:
+            return
+        if known_tables and not any(semantic_manager.get_field_semantic(db_name, t, column) for t in known_tables):
+            errors.append(f"{where} 引用了未知的字段: {column}")
+
+    for col in q.select:
+        if col.table:
+            if col.table not in tables:
+                errors.append(f"SELECT 引用了未出现在 FROM/JOIN 中的表: {col.table}")
+            elif col.column != "*" and col.table in known_tables and \
+                    semantic_manager.get_field_semantic(db_name, col.table, col.column) is None:
+                errors.append(f"SELECT 引用了未知的字段: {col.table}.{col.column}")
+        elif col.column != "*":
+            check_expr(col.column, "SELECT")
+            check_bare_column(col.column, "SELECT")
+
+    for join in q.joins or []:
+        if not join.on:
+            warnings.append(f"JOIN {join.table} 缺少连接条件")
+        check_expr(join.on, "JOIN")
+    for cond in (q.where or []) + (q.having or []):
+        check_expr(cond.left, "条件")
+        check_bare_column(cond.left, "条件")
+    for expr in q.group_by or []:
+        check_expr(expr, "GROUP BY")
+        check_bare_column(expr, "GROUP BY")
+    for item in q.order_by or []:
+        check_expr(item.by, "ORDER BY")
+        check_bare_column(item.by, "ORDER BY")
+
+    # 有分组时，非聚合的查询列应出现在 GROUP BY 中
+    if q.group_by:
+        grouped = {g.replace("`", "").strip() for g in q.group_by}
+        for col in q.select:
+            expr = f"{col.table}.{col.column}" if col.table else col.column
+            if _AGGREGATE_PATTERN.search(expr) or col.column == "*":
+                continue
+            if expr.replace("`", "") not in grouped and col.column not in grouped:
+                warnings.append(f"查询列 {expr} 未出现在 GROUP BY 中")
+    elif q.having:
+        warnings.append("存在 HAVING 但没有 GROUP BY")
+
+    if len(tables) > 1 and not q.joins:
+        warnings.append("多个主表之间没有连接条件")
+
+    return ValidationResult(errors, warnings)
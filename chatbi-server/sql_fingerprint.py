@@ -0,0 +1,291 @@
+"""
+SQL指纹模块 - 把只有字面量不同的SQL归为同一种查询形态
+统一空白、标识符引号和关键字大小写，字面量替换为占位符 ?，得到稳定的指纹与参数向量，
+结果缓存、执行计划检查和查询日志统计都按查询形态分组
+"""
+
+import re
+import hashlib
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple
+
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>/\*.*?\*/|--[^\n]*|\#[^\n]*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<quoted>`(?:[^`]|``)*`)
+  | (?P<placeholder>%\(\w+\)s|%s|\?)
+  | (?P<hex>0[xX][0-9A-Fa-f]+)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<op><=>|<>|!=|>=|<=|\|\||&&|:=|[-+*/%=<>(),.;!~^&|@])
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# 统一为大写的关键字与常用函数名；其他标识符保持原样（表名在Linux上区分大小写）
+KEYWORDS = frozenset("""
+    SELECT DISTINCT FROM WHERE AND OR NOT IN IS NULL LIKE BETWEEN EXISTS AS ON USING JOIN INNER LEFT RIGHT
+    OUTER CROSS STRAIGHT_JOIN NATURAL GROUP BY HAVING ORDER ASC DESC LIMIT OFFSET UNION ALL CASE WHEN THEN
+    ELSE END WITH ROLLUP INTERVAL DIV MOD XOR REGEXP RLIKE TRUE FALSE DATE TIME TIMESTAMP YEAR MONTH DAY
+    HOUR MINUTE SECOND WEEK QUARTER COUNT SUM AVG MIN MAX CAST CONVERT COALESCE IFNULL IF DATE_FORMAT
+    DATE_SUB DATE_ADD NOW CURDATE FROM_UNIXTIME UNIX_TIMESTAMP FLOOR CEIL ROUND SIGNED UNSIGNED CHAR
+    DECIMAL BINARY FORCE USE IGNORE INDEX KEY FOR UPDATE SHARE LOCK MODE SQL_NO_CACHE
+""".split())
+
+_STRING_ESCAPES = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+_ESCAPE_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+
+# 字面量在token序列中的内部标记，与SQL中原有的 ? / %s 占位符区分开
+_LITERAL = "\0"
+_LITERAL_LIST = "\0+"
+
+# 后面紧跟字符串时构成类型字面量或字符集引导（DATE '2024-01-01'、_utf8mb4'x'），不能换成占位符
+_TYPED_LITERAL_PREFIXES = {"DATE", "TIME", "TIMESTAMP", "COLLATE", "ESCAPE", "AS"}
+# 括号中的数值是类型长度/精度（DECIMAL(10, 2)），不能换成占位符
+_TYPE_WORDS = {"DECIMAL", "NUMERIC", "CHAR", "VARCHAR", "BINARY", "VARBINARY", "DATETIME", "TIME", "TIMESTAMP",
+               "FLOAT", "DOUBLE"}
+_CLAUSE_WORDS = {"SELECT", "FROM", "WHERE", "GROUP", "HAVING", "WINDOW", "ORDER", "LIMIT", "UNION", "FOR",
+                 "LOCK", "INTO"}
+
+_NO_SPACE_BEFORE = {",", ")", ".", "("}
+_NO_SPACE_AFTER = {"(", ".", "@"}
+
+
+class SQLFingerprint(NamedTuple):
+    """fingerprint 为查询形态的64位哈希（十六进制），shape 为归一化后的SQL，
+    params 与 shape 中的占位符一一对应，IN 列表对应一个元组
+    """
+
+    fingerprint: str
+    shape: str
+    params: Tuple[Any, ...]
+
+    @property
+    def hash(self) -> int:
+        return int(self.fingerprint, 16)
+
+    @property
+    def key(self) -> Tuple[str, Tuple[Any, ...]]:
+        """区分字面量的缓存键：形态相同、字面量也相同的SQL结果相同
+
+        数值参数保留原始精度（1.0 与 1.00 返回的列值不同），所以 Decimal 按文本比较。
+        """
+        return self.fingerprint, _exact(self.params)
+
+
+class Token(NamedTuple):
+    """SQL原文中的一个token，start/end 为在原文中的位置"""
+
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+def iter_tokens(sql: str) -> Iterator[Token]:
+    """按原文切分SQL，跳过空白和注释；用于需要在原SQL上定位子句、插入条件的改写"""
+    for match in _TOKEN_PATTERN.finditer(sql):
+        if match.lastgroup not in ("space", "comment"):
+            yield Token(match.lastgroup, match.group(), match.start(), match.end())
+
+
+def stable_hash(text: str) -> int:
+    """跨进程稳定的64位哈希（内置 hash 每次启动都会变化）"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _exact(params: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    return tuple(
+        _exact(p) if isinstance(p, tuple) else str(p) if isinstance(p, Decimal) else p
+        for p in params
+    )
+
+
+def _unescape_string(literal: str) -> str:
+    quote = literal[0]
+    body = literal[1:-1].replace(quote * 2, quote)
+
+    def replace(match: "re.Match") -> str:
+        ch = match.group(1)
+        # \% 与 \_ 在 LIKE 模式中保留反斜杠
+        if ch in "%_":
+            return match.group(0)
+        return _STRING_ESCAPES.get(ch, ch)
+
+    return _ESCAPE_PATTERN.sub(replace, body)
+
+
+def _number_value(literal: str) -> Any:
+    if literal.isdigit():
+        return int(literal)
+    try:
+        return Decimal(literal)
+    except InvalidOperation:
+        return literal
+
+
+def _literal_value(token: Token) -> Any:
+    return _unescape_string(token.text) if token.kind == "string" else _number_value(token.text)
+
+
+def parameterize(expr: str, max_depth: Optional[int] = None) -> Tuple[str, List[Any]]:
+    """把表达式中的字符串、数值字面量替换为 %s 占位符，返回 (SQL, 参数列表)，其余部分保持原文
+
+    ORDER BY / GROUP BY 的列序号、类型长度、类型字面量等必须是常量的位置保留原样；
+    max_depth 限制只替换括号层数不超过该值的字面量。
+    """
+    parts: List[str] = []
+    params: List[Any] = []
+    last = 0
+    depth = 0
+    prev: Optional[Token] = None
+    by_depth: Optional[int] = None  # 所在 ORDER BY / GROUP BY 列表的括号层数，其中的数值可能是列序号
+    type_args = False  # DECIMAL(10, 2) 中的长度与精度
+    for token in iter_tokens(expr):
+        text = token.text
+        upper = text.upper() if token.kind == "word" else ""
+        if text == "(":
+            type_args = prev is not None and prev.kind == "word" and prev.text.upper() in _TYPE_WORDS
+            depth += 1
+        elif text == ")":
+            type_args = False
+            depth -= 1
+            if by_depth is not None and depth < by_depth:
+                by_depth = None
+        elif upper == "BY":
+            by_depth = depth
+        elif upper in _CLAUSE_WORDS and by_depth == depth:
+            by_depth = None
+        bindable = token.kind in ("string", "number") and (max_depth is None or depth <= max_depth)
+        if token.kind == "number" and (by_depth is not None or type_args):
+            bindable = False
+        if bindable and token.kind == "string" and prev is not None and prev.kind == "word" and (
+                prev.text.upper() in _TYPED_LITERAL_PREFIXES or prev.text.startswith("_")):
+            bindable = False
+        if bindable:
+            parts.append(expr[last:token.start])
+            parts.append("%s")
+            params.append(_literal_value(token))
+            last = token.end
+        prev = token
+    parts.append(expr[last:])
+    return "".join(parts), params
+
+
+def parameterize_sql(sql: str) -> Tuple[str, List[Any]]:
+    """把查询顶层 WHERE / HAVING 中的字面量换成 %s 占位符，用于服务端预处理语句
+
+    SELECT 列表、GROUP BY 中的表达式保持原文：列名取自 SELECT 原文，ONLY_FULL_GROUP_BY 也要求两者一致；
+    HAVING 同理只替换比较的值，不替换函数参数。末尾的分号会被去掉。
+    """
+    spans: List[Tuple[int, int, Optional[int]]] = []
+    depth = 0
+    start: Optional[int] = None
+    max_depth: Optional[int] = None
+    for token in iter_tokens(sql):
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+        elif depth == 0 and token.kind == "word" and token.text.upper() in _CLAUSE_WORDS:
+            if start is not None:
+                spans.append((start, token.start, max_depth))
+                start = None
+            upper = token.text.upper()
+            if upper in ("WHERE", "HAVING"):
+                start, max_depth = token.end, (0 if upper == "HAVING" else None)
+    body = sql.rstrip().rstrip(";").rstrip()
+    if start is not None:
+        spans.append((start, len(body), max_depth))
+
+    parts: List[str] = []
+    params: List[Any] = []
+    last = 0
+    for begin, end, limit in spans:
+        fragment, fragment_params = parameterize(body[begin:end], limit)
+        parts.append(body[last:begin])
+        parts.append(fragment)
+        params.extend(fragment_params)
+        last = end
+    parts.append(body[last:])
+    return "".join(parts), params
+
+
+def _tokenize(sql: str) -> Tuple[List[str], List[Any]]:
+    """切分为归一化后的token，字面量替换为 ?，同时收集参数"""
+    tokens: List[str] = []
+    params: List[Any] = []
+    for match in _TOKEN_PATTERN.finditer(sql):
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "string":
+            tokens.append(_LITERAL)
+            params.append(_unescape_string(text))
+        elif kind == "number":
+            tokens.append(_LITERAL)
+            params.append(_number_value(text))
+        elif kind == "quoted":
+            tokens.append(text[1:-1].replace("``", "`"))
+        elif kind == "word":
+            upper = text.upper()
+            tokens.append(upper if upper in KEYWORDS else text)
+        else:
+            tokens.append(text)
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return tokens, params
+
+
+def _collapse_in_lists(tokens: List[str], params: List[Any]) -> Tuple[List[str], List[Any]]:
+    """IN (?, ?, ?) 不论元素个数都归为 IN (?+)，对应的参数合并为一个元组
+
+    这样占位符与参数一一对应，IN (1, 2) AND y IN (3) 与 IN (1) AND y IN (2, 3) 不会得到相同的参数向量。
+    """
+    out: List[str] = []
+    grouped: List[Any] = []
+    i = 0
+    n = 0  # 已经过的字面量个数
+    while i < len(tokens):
+        if tokens[i] == "IN" and i + 2 < len(tokens) and tokens[i + 1] == "(":
+            j = i + 2
+            while j + 1 < len(tokens) and tokens[j] == _LITERAL and tokens[j + 1] == ",":
+                j += 2
+            if j + 1 < len(tokens) and tokens[j] == _LITERAL and tokens[j + 1] == ")":
+                count = (j - i - 2) // 2 + 1
+                out.extend(["IN", "(", _LITERAL_LIST, ")"])
+                grouped.append(tuple(params[n:n + count]))
+                n += count
+                i = j + 2
+                continue
+        if tokens[i] == _LITERAL:
+            grouped.append(params[n])
+            n += 1
+        out.append(tokens[i])
+        i += 1
+    return out, grouped
+
+
+def _join(tokens: List[str]) -> str:
+    parts: List[str] = []
+    prev = None
+    for token in tokens:
+        if prev is not None and token not in _NO_SPACE_BEFORE and prev not in _NO_SPACE_AFTER:
+            parts.append(" ")
+        parts.append("?" if token == _LITERAL else "?+" if token == _LITERAL_LIST else token)
+        prev = token
+    return "".join(parts)
+
+
+@lru_cache(maxsize=4096)
+def sql_fingerprint(sql: str) -> SQLFingerprint:
+    """计算SQL的查询形态指纹与参数向量
+
+    同一条SQL在一次请求中会被缓存、日志、索引建议多次用到，结果按SQL文本缓存。
+    """
+    tokens, params = _tokenize(sql or "")
+    tokens, params = _collapse_in_lists(tokens, params)
+    shape = _join(tokens)
+    return SQLFingerprint(f"{stable_hash(shape):016x}" if shape else "0" * 16, shape, tuple(params))
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# 测试直接导入服务模块，不依赖安装；后台任务、查询日志和预加载在测试中关闭
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WARMUP_ENABLED", "0")
+os.environ.setdefault("PRELOAD_HEAVY_IMPORTS", "0")
+os.environ.setdefault("QUERY_LOG_ENABLED", "0")
+# 与请求模型字段的字面默认值不同，检验预热与请求使用同一个默认模型
+os.environ.setdefault("OLLAMA_MODEL", "test-model:latest")
@@ -0,0 +1,56 @@
+import pytest
+
+from approximate import approximate_query, sample_manager, sample_table_name
+from translator import SemanticSQL
+
+
+def _semantic(select, **query):
+    return SemanticSQL.model_validate({
+        "intent": "按IP统计流量",
+        "query": {"select": select, "from": ["ip_flow"], **query},
+    })
+
+
+@pytest.fixture
+def fresh_sample(monkeypatch):
+    sample = sample_table_name("ip_flow", sample_manager.buckets)
+    monkeypatch.setattr(sample_manager, "sample_table", lambda db_name, table: sample)
+    return sample
+
+
+def test_without_sample_table_is_not_rewritten():
+    semantic = _semantic([{"column": "ip"}, {"column": "SUM(bps)", "alias": "total"}], group_by=["ip"])
+    sql, info = approximate_query(semantic, "shop")
+    assert sql is None
+    assert info["applied"] is False
+    assert "样本表" in info["reason"]
+    assert "SUM(bps)" in info["exact_sql"]
+
+
+def test_rewrites_onto_sample_table(fresh_sample):
+    semantic = _semantic(
+        [{"column": "ip"}, {"column": "SUM(bps)", "alias": "total"}],
+        group_by=["ip"],
+        having=[{"left": "SUM(bps)", "op": ">", "right": "1000"}],
+        order_by=[{"by": "SUM(bps)", "direction": "desc"}],
+    )
+    sql, info = approximate_query(semantic, "shop")
+    assert info["applied"] is True
+    assert info["method"] == "sample_table" and info["table"] == fresh_sample
+    assert info["margins"] == {"total": "total_margin"}
+    assert f"FROM `{fresh_sample}`" in sql
+    assert "CRC32" not in sql
+    # HAVING 与 ORDER BY 中的聚合按采样率放大
+    assert sql.count(f"* 10000 / {sample_manager.buckets})") >= 3
+
+
+@pytest.mark.parametrize("column", ["MAX(bps)", "COUNT(DISTINCT ip)"])
+def test_non_estimable_aggregates_are_rejected(fresh_sample, column):
+    sql, info = approximate_query(_semantic([{"column": column}]), "shop")
+    assert sql is None and info["applied"] is False
+
+
+def test_different_rate_does_not_use_sample_table(fresh_sample):
+    semantic = _semantic([{"column": "COUNT(*)", "alias": "n"}])
+    sql, info = approximate_query(semantic, "shop", rate=0.5)
+    assert sql is None and info["applied"] is False
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import app
+import conversation
+from translator import SemanticSQL
+from warmup import traffic_gate
+
+SEMANTIC = SemanticSQL.model_validate({
+    "intent": "订单总数",
+    "query": {"select": [{"column": "COUNT(*)", "alias": "n"}], "from": ["orders"]},
+})
+
+
+def _execute(success):
+    def execute(request, sql, prepared=None):
+        # 执行期间仍计为线上流量
+        assert traffic_gate.active == 1
+        if success:
+            return dict(success=True, sql=sql, data=[{"n": 3}], columns=["n"], row_count=1, execution_time=0.0)
+        return dict(success=False, sql=sql, data=None, columns=None, row_count=0, execution_time=0.0,
+                    error="Table 'shop.orders' doesn't exist")
+    return execute
+
+
+@pytest.fixture
+def translated(monkeypatch):
+    monkeypatch.setattr(conversation, "nl_to_mysql", lambda **kwargs: (SEMANTIC, "SELECT COUNT(*) AS `n` FROM `orders`"))
+
+
+def _events(stream):
+    return [json.loads(line) for line in stream]
+
+
+def test_events_in_order(monkeypatch, translated):
+    monkeypatch.setattr(app, "_ask_execute", _execute(True))
+    events = _events(app._ask_events(app.AskRequest(question="订单总数")))
+    assert [e["event"] for e in events] == ["translation", "result", "done"]
+    assert events[0]["success"] is True and events[0]["mysql_sql"] == "SELECT COUNT(*) AS `n` FROM `orders`"
+    assert events[1]["data"] == [{"n": 3}]
+    assert events[2]["success"] is True
+
+
+def test_execution_failure_is_reported_in_result(monkeypatch, translated):
+    monkeypatch.setattr(app, "_ask_execute", _execute(False))
+    events = _events(app._ask_events(app.AskRequest(question="订单总数")))
+    assert [e["event"] for e in events] == ["translation", "result", "done"]
+    assert events[0]["success"] is True
+    assert events[1]["success"] is False and "doesn't exist" in events[1]["error"]
+    assert events[2]["success"] is False
+
+
+def test_translation_failure_skips_result(monkeypatch):
+    def fail(**kwargs):
+        raise RuntimeError("模型不可用")
+
+    monkeypatch.setattr(conversation, "nl_to_mysql", fail)
+    monkeypatch.setattr(app, "_ask_execute", None)
+    events = _events(app._ask_events(app.AskRequest(question="订单总数")))
+    assert [e["event"] for e in events] == ["translation", "done"]
+    assert events[0]["success"] is False and events[0]["error"] == "模型不可用"
+    assert events[1]["success"] is False
+    assert traffic_gate.active == 0
+
+
+def test_stream_counts_as_live_traffic_until_finished(monkeypatch, translated):
+    monkeypatch.setattr(app, "_ask_execute", _execute(True))
+    assert "/ask" not in app.LIVE_TRAFFIC_PATHS
+    stream = app._ask_events(app.AskRequest(question="订单总数"))
+    next(stream)
+    assert traffic_gate.active == 1
+    next(stream)
+    assert traffic_gate.active == 1
+    list(stream)
+    assert traffic_gate.active == 0
+
+
+def test_closed_stream_leaves_the_gate(monkeypatch, translated):
+    monkeypatch.setattr(app, "_ask_execute", _execute(True))
+    stream = app._ask_events(app.AskRequest(question="订单总数"))
+    next(stream)
+    # 客户端断开时 StreamingResponse 关闭生成器
+    stream.close()
+    assert traffic_gate.active == 0
@@ -0,0 +1,44 @@
+import io
+import json
+
+import main
+from translator import SemanticSQL
+
+
+def test_schema_is_introspected_once_per_db_name(monkeypatch, tmp_path):
+    loaded = []
+
+    def load_schema(database=None):
+        loaded.append(database)
+        return {f"{database or 'default'}_table": [("id", "int")]}
+
+    seen = {}
+
+    def translate(question, schema, db_name, **kwargs):
+        seen[question] = (db_name, schema)
+        semantic = SemanticSQL.model_validate({"intent": question, "query": {"select": [{"column": "id"}],
+                                                                             "from": ["t"]}})
+        return semantic, "SELECT id FROM t"
+
+    monkeypatch.setattr(main, "_load_schema", load_schema)
+    monkeypatch.setattr(main, "nl_to_mysql", translate)
+    monkeypatch.setenv("DB_NAME", "shop")
+    questions = tmp_path / "questions.jsonl"
+    questions.write_text("\n".join(json.dumps(q, ensure_ascii=False) for q in [
+        {"question": "a"},
+        {"question": "b", "db_name": "network"},
+        {"question": "c", "db_name": "network"},
+        {"question": "d", "db_name": "shop"},
+    ]), encoding="utf-8")
+    output = tmp_path / "results.jsonl"
+
+    summary = main.run_batch(str(questions), str(output))
+
+    assert summary["succeeded"] == 4
+    assert loaded == [None, "network"]
+    assert seen["a"] == ("shop", {"default_table": [("id", "int")]})
+    assert seen["b"] == ("network", {"network_table": [("id", "int")]})
+    assert seen["c"][1] is seen["b"][1]
+    assert seen["d"][1] is seen["a"][1]
+    records = [json.loads(line) for line in io.StringIO(output.read_text(encoding="utf-8"))]
+    assert {r["id"]: r["db_name"] for r in records} == {1: "shop", 2: "network", 3: "network", 4: "shop"}
@@ -0,0 +1,43 @@
+import time
+
+import translator
+from cache import TTLCache, translation_cache
+from translator import SemanticSQL
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache("test_lru", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache("test_ttl", maxsize=8, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert not cache.contains("a")
+
+
+def test_warmed_translation_is_hit_by_default_request(monkeypatch):
+    import app
+
+    calls = []
+    semantic = SemanticSQL.model_validate({"intent": "用户", "query": {"select": [{"column": "*"}], "from": ["users"]}})
+
+    def fake_nl_to_semantic(**kwargs):
+        calls.append(kwargs["model"])
+        return semantic.model_copy(deep=True)
+
+    monkeypatch.setattr(translator, "nl_to_semantic", fake_nl_to_semantic)
+    translation_cache.invalidate()
+    app._warmup_translate("预热测试问题", "shop")
+
+    request = app.QueryRequest(question="预热测试问题")
+    translator.nl_to_mysql(question=request.question, model=request.model, db_name=request.db_name)
+    assert calls == [app.OLLAMA_MODEL]
+    assert app.AskRequest(question="x").model == request.model == app.OLLAMA_MODEL
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+import translator
+from translator import SemanticSQL, TranslationError
+
+LARGE = "qwen2.5:7b"
+
+SEMANTIC = SemanticSQL.model_validate({"intent": "用户", "query": {"select": [{"column": "*"}], "from": ["users"]}})
+
+
+def _fake_llm(small_behaviour, large_delay=0.0):
+    calls = []
+
+    def fake(question, schema=None, model=LARGE, base_url=None, db_name="shop", max_reasks=None):
+        calls.append(model)
+        if model == translator.OLLAMA_SMALL_MODEL:
+            return small_behaviour()
+        time.sleep(large_delay)
+        return SEMANTIC.model_copy(deep=True)
+
+    return fake, calls
+
+
+def _raise(error):
+    def behaviour():
+        raise error
+    return behaviour
+
+
+@pytest.mark.parametrize("error", [
+    TranslationError("无法解析"),
+    ConnectionError("connection refused"),
+    TimeoutError("timed out"),
+    RuntimeError("model 'qwen2.5:1.5b' not found"),
+])
+def test_small_model_failure_escalates(monkeypatch, error):
+    fake, calls = _fake_llm(_raise(error))
+    monkeypatch.setattr(translator, "_llm_to_semantic", fake)
+    monkeypatch.setattr(translator, "CASCADE_HEDGE_DELAY", 0)
+
+    assert translator._cascade_to_semantic("所有用户", model=LARGE, db_name="shop") == SEMANTIC
+    assert calls == [translator.OLLAMA_SMALL_MODEL, LARGE]
+
+
+def test_hedged_small_model_failure_uses_large_result(monkeypatch):
+    def slow_failure():
+        time.sleep(0.05)
+        raise ConnectionError("connection reset")
+
+    # 对冲启动的大模型比小模型的失败晚返回
+    fake, calls = _fake_llm(slow_failure, large_delay=0.2)
+    monkeypatch.setattr(translator, "_llm_to_semantic", fake)
+    monkeypatch.setattr(translator, "CASCADE_HEDGE_DELAY", 0.01)
+
+    assert translator._cascade_to_semantic("所有用户", model=LARGE, db_name="shop") == SEMANTIC
+    assert sorted(calls) == sorted([translator.OLLAMA_SMALL_MODEL, LARGE])
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from conversation import conversations
+from translator import ColumnRef, Condition, OrderItem, SemanticDelta, SemanticSQL, apply_delta
+
+
+def _semantic(**query):
+    return SemanticSQL.model_validate({
+        "intent": "每个用户的消费总额",
+        "query": {
+            "select": [{"column": "user_id"}, {"column": "SUM(amount)", "alias": "total"}],
+            "from": ["orders"],
+            "where": [{"left": "status", "op": "=", "right": "paid"}],
+            "group_by": ["user_id"],
+            **query,
+        },
+    })
+
+
+def test_add_where_replaces_condition_on_same_expression():
+    previous = _semantic()
+    merged = apply_delta(previous, SemanticDelta(add_where=[
+        Condition(left="`status`", op="=", right="refunded"),
+        Condition(left="created_at", op=">=", right="2024-05-01"),
+    ]))
+    assert [(c.left, c.right) for c in merged.query.where] == [("`status`", "refunded"),
+                                                               ("created_at", "2024-05-01")]
+    # 上一轮的语义SQL不被修改
+    assert [c.right for c in previous.query.where] == ["paid"]
+
+
+def test_group_by_swaps_dimension_columns():
+    merged = apply_delta(_semantic(), SemanticDelta(group_by=["category"]))
+    assert [c.column for c in merged.query.select] == ["category", "SUM(amount)"]
+    assert merged.query.group_by == ["category"]
+
+
+def test_remove_select_keeps_at_least_one_column_and_limit_zero_clears():
+    merged = apply_delta(_semantic(limit=10), SemanticDelta(remove_select=["user_id", "total"], limit=0))
+    assert [c.column for c in merged.query.select] == ["user_id", "SUM(amount)"]
+    assert merged.query.limit is None
+
+
+def test_add_select_and_order_by():
+    merged = apply_delta(_semantic(), SemanticDelta(
+        add_select=[ColumnRef(column="COUNT(*)", alias="orders"), ColumnRef(column="sum(`amount`)")],
+        order_by=[OrderItem(by="total", direction="desc")],
+    ))
+    assert [c.column for c in merged.query.select] == ["user_id", "SUM(amount)", "COUNT(*)"]
+    assert merged.query.order_by[0].by == "total"
+
+
+@pytest.mark.parametrize("success", [True, False])
+def test_ask_remembers_turn_only_after_successful_execution(monkeypatch, success):
+    import app
+    import conversation
+
+    semantic = _semantic()
+    monkeypatch.setattr(conversation, "nl_to_mysql", lambda **kwargs: (semantic, "SELECT 1"))
+    monkeypatch.setattr(app, "_ask_execute", lambda request, sql, prepared=None: dict(
+        success=success, sql=sql, data=[] if success else None, columns=[] if success else None,
+        row_count=0, execution_time=0.0, error=None if success else "执行失败"))
+    conversations.forget("c1")
+
+    request = app.AskRequest(question="每个用户的消费总额", conversation_id="c1")
+    events = [json.loads(line) for line in app._ask_events(request)]
+
+    assert [e["event"] for e in events] == ["translation", "result", "done"]
+    turn = conversations.last("c1", "shop")
+    assert (turn is not None) is success
+    if success:
+        assert turn.question == "每个用户的消费总额" and turn.turns == 1
+
+
+def test_successful_followup_advances_the_conversation(monkeypatch):
+    import app
+    import conversation
+
+    monkeypatch.setattr(conversation, "followup_to_semantic", lambda question, previous, **kwargs: apply_delta(
+        previous, SemanticDelta(add_where=[Condition(left="created_at", op=">=", right="2024-05-01")])))
+    monkeypatch.setattr(app, "_ask_execute", lambda request, sql, prepared=None: dict(
+        success=True, sql=sql, data=[], columns=[], row_count=0, execution_time=0.0))
+    conversations.forget("c2")
+    conversations.remember("c2", "shop", "每个用户的消费总额", _semantic())
+
+    request = app.AskRequest(question="只看5月以后", conversation_id="c2")
+    events = [json.loads(line) for line in app._ask_events(request)]
+
+    assert events[0]["followup"] is True
+    turn = conversations.last("c2", "shop")
+    assert turn.turns == 2 and len(turn.semantic.query.where) == 2
@@ -0,0 +1,41 @@
+from datasource import DatasourceRegistry
+
+
+def _registry(spec):
+    return DatasourceRegistry({"host": "db", "port": 3306, "user": "u", "password": "p"}, {"network": spec})
+
+
+def test_unconfigured_database_uses_primary():
+    registry = _registry({})
+    endpoint = registry.choose("shop")
+    assert endpoint.role == "primary" and endpoint.config["database"] == "shop"
+    assert endpoint.config["host"] == "db"
+
+
+def test_reads_round_robin_over_healthy_replicas():
+    registry = _registry({"replicas": [{"host": "r1"}, {"host": "r2", "name": "replica-b"}], "max_lag": 10})
+    datasource = registry.get("network")
+    chosen = [datasource.choose().name for _ in range(4)]
+    assert chosen == ["replica1", "replica-b", "replica1", "replica-b"]
+    assert datasource.choose(read_only=False) is datasource.primary
+
+
+def test_lagging_or_down_replicas_fall_back_to_primary():
+    registry = _registry({"replicas": [{"host": "r1"}, {"host": "r2"}], "max_lag": 10})
+    datasource = registry.get("network")
+    first, second = datasource.replicas
+    first.lag = 30
+    assert {datasource.choose().name for _ in range(3)} == {second.name}
+    second.lag = None
+    assert datasource.choose() is datasource.primary
+    first.lag = 0
+    first.mark_down("connection refused")
+    assert datasource.choose() is datasource.primary
+
+
+def test_prefers_least_loaded_replica():
+    registry = _registry({"replicas": [{"host": "r1"}, {"host": "r2"}]})
+    datasource = registry.get("network")
+    busy, idle = datasource.replicas
+    busy.pool._in_use = 1
+    assert {datasource.choose().name for _ in range(3)} == {idle.name}
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+from delta_refresh import _Ineligible, merge_rows, plan_delta
+
+BUCKET_SQL = ("SELECT DATE_FORMAT(`timestamp`, '%Y-%m-%d %H:00:00') AS hour, SUM(bps) AS total "
+              "FROM ip_flow WHERE ip = '10.0.0.1' GROUP BY hour ORDER BY hour")
+
+
+def test_bucket_query_is_accepted():
+    plan = plan_delta(BUCKET_SQL, "hour")
+    assert plan.source_column == "`timestamp`"
+    sql = plan.render(BUCKET_SQL, datetime(2024, 5, 1, 10))
+    assert "WHERE `timestamp` >= '2024-05-01 10:00:00' AND (ip = '10.0.0.1') GROUP BY hour" in sql
+
+
+def test_group_by_expression_or_position_is_accepted():
+    by_expr = "SELECT DATE(created_at) AS d, COUNT(*) FROM orders GROUP BY DATE(`created_at`)"
+    by_position = "SELECT DATE(created_at) AS d, COUNT(*) FROM orders GROUP BY 1"
+    assert plan_delta(by_expr, "d").source_column == "created_at"
+    assert plan_delta(by_position, "d").source_column == "created_at"
+
+
+def test_aggregated_time_column_is_rejected():
+    sql = "SELECT ip, MAX(`timestamp`) AS last_seen, SUM(bps) AS total FROM ip_flow GROUP BY ip"
+    with pytest.raises(_Ineligible):
+        plan_delta(sql, "last_seen")
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT ip, DATE(`timestamp`) AS d, SUM(bps) FROM ip_flow GROUP BY ip",
+    "SELECT DATE(`timestamp`) AS d, SUM(bps) FROM ip_flow",
+    "SELECT DATE(`timestamp`) AS d, SUM(bps) FROM ip_flow GROUP BY d WITH ROLLUP",
+])
+def test_aggregate_query_must_group_by_time_column(sql):
+    with pytest.raises(_Ineligible):
+        plan_delta(sql, "d")
+
+
+def test_non_floor_bucket_is_rejected():
+    with pytest.raises(_Ineligible):
+        plan_delta("SELECT DATE(`timestamp`) + INTERVAL 1 DAY AS d FROM ip_flow", "d")
+
+
+def test_merge_replaces_buckets_after_watermark():
+    prior = [{"d": datetime(2024, 5, 1, h), "v": h} for h in range(3)]
+    fresh = [{"d": datetime(2024, 5, 1, 2), "v": 20}, {"d": datetime(2024, 5, 1, 3), "v": 30}]
+    merged = merge_rows(prior, fresh, "d", since=datetime(2024, 5, 1, 2))
+    assert [r["v"] for r in merged] == [0, 1, 20, 30]
+
+
+def test_merge_drops_buckets_outside_window_and_applies_limit():
+    prior = [{"d": datetime(2024, 5, 1, h), "v": h} for h in range(3, -1, -1)]
+    fresh = [{"d": datetime(2024, 5, 1, 4), "v": 40}, {"d": datetime(2024, 5, 1, 3), "v": 30}]
+    merged = merge_rows(prior, fresh, "d", since=datetime(2024, 5, 1, 3),
+                        window_start=datetime(2024, 5, 1, 1), limit=3)
+    assert [r["v"] for r in merged] == [40, 30, 2]
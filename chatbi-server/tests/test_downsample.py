@@ -0,0 +1,61 @@
+import math
+from datetime import date, datetime, timedelta
+
+from downsample import downsample, lttb_indices, minmax_indices
+
+
+def _series(n):
+    start = datetime(2024, 5, 1)
+    # 平稳序列中间有一个尖峰
+    return [(start + timedelta(minutes=i), 1000 if i == n // 2 else math.sin(i / 10)) for i in range(n)]
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    ys = [1000.0 if i == 500 else math.sin(i / 10) for i in range(1000)]
+    picked = lttb_indices([float(i) for i in range(1000)], ys, 50)
+    assert len(picked) == 50 and picked[0] == 0 and picked[-1] == 999 and 500 in picked
+
+
+def test_minmax_keeps_bucket_extremes():
+    ys = [float(i % 7) for i in range(100)]
+    ys[42] = -5.0
+    picked = minmax_indices(ys, 10)
+    assert 42 in picked and picked == sorted(picked)
+    assert len(picked) <= 2 * 10 + 2
+
+
+def test_downsample_time_series():
+    rows = _series(2000)
+    data, info = downsample(["minute", "bps"], lambda: iter(rows), len(rows), 100)
+    assert info["applied"] is True and info["x"] == "minute" and info["series"] == ["bps"]
+    assert 3 <= len(data) <= 100
+    assert data[0]["minute"] == rows[0][0] and data[-1]["minute"] == rows[-1][0]
+    assert max(r["bps"] for r in data) == 1000
+    assert [r["minute"] for r in data] == sorted(r["minute"] for r in data)
+
+
+def test_unsorted_rows_are_returned_in_time_order():
+    rows = list(reversed(_series(500)))
+    data, info = downsample(["minute", "bps"], lambda: iter(rows), len(rows), 50, method="minmax")
+    assert info["applied"] is True
+    assert [r["minute"] for r in data] == sorted(r["minute"] for r in data)
+
+
+def test_small_or_categorical_results_are_not_downsampled():
+    rows = _series(50)
+    assert downsample(["minute", "bps"], lambda: iter(rows), len(rows), 100)[0] is None
+    mixed = [(t, "10.0.0.1", v) for t, v in _series(500)]
+    data, info = downsample(["minute", "ip", "bps"], lambda: iter(mixed), len(mixed), 100)
+    assert data is None and "ip" in info["reason"]
+    data, info = downsample(["minute", "bps"], lambda: iter(rows), len(rows), 10, method="avg")
+    assert data is None and info["applied"] is False
+
+
+def test_date_axis_matches_spilled_strings():
+    start = date(2020, 1, 1)
+    rows = [(start + timedelta(days=i), math.sin(i / 10)) for i in range(2000)]
+    spilled = [(d.isoformat(), v) for d, v in rows]
+    data, info = downsample(["d", "v"], lambda: iter(rows), len(rows), 100)
+    spilled_data, spilled_info = downsample(["d", "v"], lambda: iter(spilled), len(spilled), 100)
+    assert info["applied"] is True and info["x"] == "d"
+    assert [r["d"].isoformat() for r in data] == [r["d"] for r in spilled_data]
@@ -0,0 +1,52 @@
+import pytest
+
+from db_pool import StatementCache
+
+
+class FakeCursor:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursors = []
+
+    def cursor(self, prepared=False):
+        self.cursors.append(FakeCursor())
+        return self.cursors[-1]
+
+
+def test_statements_are_keyed_on_exact_text():
+    cache = StatementCache(size=8)
+    conn = FakeConnection()
+    lower = "SELECT sum(amount) FROM orders WHERE id = %s"
+    upper = "SELECT SUM(amount) FROM orders WHERE id = %s"
+    first = cache.cursor(conn, lower)
+    assert cache.cursor(conn, "".join(lower)) is first
+    cursor, operation = cache.cursor(conn, upper)
+    assert cursor is not first[0] and operation == upper
+
+
+def test_lru_eviction_and_discard_close_cursors():
+    cache = StatementCache(size=2)
+    conn = FakeConnection()
+    a, _ = cache.cursor(conn, "SELECT a FROM t WHERE x = %s")
+    b, _ = cache.cursor(conn, "SELECT b FROM t WHERE x = %s")
+    cache.cursor(conn, "SELECT a FROM t WHERE x = %s")
+    cache.cursor(conn, "SELECT c FROM t WHERE x = %s")
+    assert b.closed and not a.closed
+    cache.discard(conn, "SELECT a FROM t WHERE x = %s")
+    assert a.closed
+
+
+def test_unsafe_fallback_sql_is_rejected(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "_materialize_query", None)
+    with pytest.raises(ValueError):
+        app.execute_mysql_query("DELETE FROM orders", "shop",
+                                prepared=("SELECT * FROM orders WHERE id = %s", [1]))
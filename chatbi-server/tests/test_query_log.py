@@ -0,0 +1,91 @@
+import builtins
+import inspect
+
+import query_log
+from query_log import KIND_EXECUTE, KIND_TRANSLATE, QueryLog, QueryRecord, read_records
+
+
+def _record(question="q", sql="SELECT 1", total=0.5, kind=KIND_EXECUTE):
+    return QueryRecord(kind, 1700000000.0, True, total, 0.0, total, 3, 0, 7, question, "shop", "m", sql)
+
+
+def test_pack_unpack_round_trip():
+    record = QueryRecord(KIND_TRANSLATE, 1700000000.5, False, 1.5, 1.25, 0.0, -1, 11, 22,
+                         "最活跃的用户", "shop", "qwen2.5:7b", "SELECT * FROM users WHERE name = '张三'")
+    data = record.pack()
+    restored = QueryRecord.unpack(data[query_log._LENGTH.size:])
+    assert [getattr(restored, k) for k in QueryRecord.__slots__] == [getattr(record, k) for k in QueryRecord.__slots__]
+
+
+def test_torn_tail_is_ignored_and_truncated_on_reopen(tmp_path):
+    path = str(tmp_path / "queries.bin")
+    log = QueryLog(path, enabled=True)
+    log.append(_record("a"))
+    log.append(_record("b"))
+    log.close()
+    with open(path, "ab") as f:
+        f.write(_record("c").pack()[:-5])
+
+    assert [r.question for r in read_records(path)] == ["a", "b"]
+    log = QueryLog(path, enabled=True)
+    log.append(_record("d"))
+    log.close()
+    assert [r.question for r in read_records(path)] == ["a", "b", "d"]
+
+
+def test_rotation_keeps_backups_in_order(tmp_path):
+    path = str(tmp_path / "queries.bin")
+    size = len(_record("x").pack())
+    log = QueryLog(path, max_bytes=size * 2 + 10, backups=2, enabled=True)
+    for i in range(7):
+        log.append(_record(str(i)))
+    log.close()
+    assert log.files() == [f"{path}.2", f"{path}.1", path]
+    assert [r.question for r in log.records()] == ["2", "3", "4", "5", "6"]
+
+
+def test_read_records_reads_incrementally(tmp_path, monkeypatch):
+    path = str(tmp_path / "queries.bin")
+    log = QueryLog(path, enabled=True)
+    for i in range(50):
+        log.append(_record(str(i), sql="SELECT * FROM ip_flow WHERE ip = '10.0.0.%d'" % i))
+    log.close()
+
+    sizes = []
+    real_open = builtins.open
+
+    class Recorder:
+        def __init__(self, f):
+            self._f = f
+
+        def read(self, size=-1):
+            sizes.append(size)
+            return self._f.read(size)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self._f.close()
+
+    monkeypatch.setattr(query_log, "open", lambda *a, **k: Recorder(real_open(*a, **k)), raising=False)
+    assert len(list(read_records(path))) == 50
+    # 不整体读取文件，每次读取不超过一条记录
+    assert all(0 <= size <= len(_record("x", sql="x" * 64).pack()) for size in sizes)
+
+
+def test_top_queries_groups_by_shape(tmp_path):
+    log = QueryLog(str(tmp_path / "queries.bin"), enabled=True)
+    for ip, total in (("10.0.0.1", 1.0), ("10.0.0.2", 3.0)):
+        log.log(KIND_EXECUTE, db_name="network", sql=f"SELECT * FROM ip_flow WHERE ip = '{ip}'",
+                total_seconds=total, row_count=2)
+    log.log(KIND_EXECUTE, db_name="network", sql="SELECT 1", total_seconds=0.1)
+    top = log.top_queries(order="frequent")
+    log.close()
+    assert top[0]["count"] == 2 and top[0]["avg_seconds"] == 2.0 and top[0]["avg_rows"] == 2.0
+
+
+def test_top_queries_endpoint_runs_off_the_event_loop():
+    import app
+
+    assert not inspect.iscoroutinefunction(app.get_top_queries)
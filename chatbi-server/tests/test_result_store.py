@@ -0,0 +1,61 @@
+import csv
+import io
+from decimal import Decimal
+
+from result_store import ResultStore
+
+
+class FakeCursor:
+    def __init__(self, columns, rows):
+        self.description = [(c,) for c in columns]
+        self._rows = list(rows)
+
+    def fetchmany(self, size):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+
+def _store(tmp_path, **kwargs):
+    return ResultStore(directory=str(tmp_path), **{"max_rows": 10, "page_size": 4, **kwargs})
+
+
+def test_small_result_stays_in_memory(tmp_path):
+    store = _store(tmp_path)
+    result = store.materialize(FakeCursor(["id", "amount"], [(1, Decimal("1.50")), (2, None)]), batch_size=1)
+    assert result.result_id is None and result.row_count == 2
+    assert result.data == [{"id": 1, "amount": 1.5}, {"id": 2, "amount": None}]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_oversized_result_spills_and_pages(tmp_path):
+    store = _store(tmp_path)
+    result = store.materialize(FakeCursor(["id", "name"], [(i, f"用户{i}") for i in range(25)]), batch_size=3)
+    assert result.result_id is not None and result.row_count == 25
+    # 内存中只保留第一页作为预览
+    assert [r["id"] for r in result.data] == [0, 1, 2, 3]
+
+    spilled = store.get(result.result_id)
+    assert [r["id"] for r in spilled.page(9, 5)] == [9, 10, 11, 12, 13]
+    assert [r["id"] for r in spilled.page(22)] == [22, 23, 24]
+    assert spilled.page(25) == []
+    rows = list(csv.reader(io.StringIO("".join(spilled.iter_csv()))))
+    assert rows[0] == ["id", "name"] and rows[-1] == ["24", "用户24"] and len(rows) == 26
+
+
+def test_byte_budget_also_spills(tmp_path):
+    store = _store(tmp_path, max_rows=1000, max_bytes=500)
+    result = store.materialize(FakeCursor(["blob"], [("x" * 100,) for _ in range(10)]))
+    assert result.result_id is not None and result.row_count == 10
+
+
+def test_delete_and_expiry_remove_files(tmp_path):
+    store = _store(tmp_path)
+    first = store.materialize(FakeCursor(["id"], [(i,) for i in range(20)]))
+    assert store.delete(first.result_id) and not store.delete(first.result_id)
+    assert list(tmp_path.iterdir()) == []
+
+    store.ttl = 0
+    expired = store.materialize(FakeCursor(["id"], [(i,) for i in range(20)]))
+    assert store.get(expired.result_id) is None
+    store.materialize(FakeCursor(["id"], [(i,) for i in range(20)]))
+    assert len(list(tmp_path.iterdir())) == 1
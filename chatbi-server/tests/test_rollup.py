@@ -0,0 +1,182 @@
+from datetime import datetime
+
+import pytest
+
+import rollup
+from rollup import RollupManager, route_to_rollup
+from translator import SemanticSQL
+
+
+def _semantic(select, **query):
+    return SemanticSQL.model_validate({
+        "intent": "接口流量统计",
+        "query": {"select": select, "from": ["ip_flow"], **query},
+    })
+
+
+def _route(*args, **kwargs):
+    return route_to_rollup(_semantic(*args, **kwargs), require_fresh=False)
+
+
+class FakeCursor:
+    def __init__(self, max_bucket):
+        self.executed = []
+        self.max_bucket = max_bucket
+        self.rowcount = 7
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return (self.max_bucket,)
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.committed = self.closed = False
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        self.closed = True
+
+
+# ---------------- 增量刷新 ----------------
+
+def test_incremental_refresh_goes_from_minute_to_day():
+    cursor = FakeCursor(datetime(2024, 5, 1, 10, 7, 30))
+    conn = FakeConnection(cursor)
+    manager = RollupManager(connect=lambda: conn, lateness=600)
+    stats = manager.refresh()
+
+    assert conn.committed and conn.closed
+    creates = [sql for sql, _ in cursor.executed if "CREATE TABLE" in sql]
+    assert len(creates) == 3
+    inserts = [(sql, params) for sql, params in cursor.executed if "INSERT INTO" in sql]
+    assert [sql.split()[2] for sql, _ in inserts] == ["ip_flow_rollup_minute", "ip_flow_rollup_hour",
+                                                      "ip_flow_rollup_day"]
+    # 最新桶回溯 lateness 后各级别分别对齐到自己的桶边界
+    assert [params for _, params in inserts] == [(datetime(2024, 5, 1, 9, 57),), (datetime(2024, 5, 1, 9),),
+                                                 (datetime(2024, 5, 1),)]
+    assert stats["since"] == "2024-05-01T09:57:00" and stats["rows"] == {"minute": 7, "hour": 7, "day": 7}
+
+    minute_sql = inserts[0][0]
+    assert "FROM ip_flow WHERE `timestamp` >= %s" in minute_sql
+    assert "COUNT(*) AS c, SUM(bps) AS s, MIN(bps) AS lo, MAX(bps) AS hi" in minute_sql
+    hour_sql = inserts[1][0]
+    assert "SUM(sample_count) AS c, SUM(bps_sum) AS s, MIN(bps_min) AS lo, MAX(bps_max) AS hi" in hour_sql
+    # 驱动绑定参数时把 %% 还原为 %，格式串到达MySQL时是正常的 DATE_FORMAT 格式
+    assert "DATE_FORMAT(`timestamp`, '%Y-%m-%d %H:%i:00')" in minute_sql % ("'2024-05-01 09:57:00'",)
+    assert "DATE_FORMAT(bucket, '%Y-%m-%d %H:00:00')" in hour_sql % ("'2024-05-01 09:00:00'",)
+
+
+def test_empty_or_full_refresh_starts_from_epoch():
+    cursor = FakeCursor(None)
+    manager = RollupManager(connect=lambda: FakeConnection(cursor))
+    assert manager.refresh()["since"] is None
+    cursor.executed.clear()
+    manager.refresh(full=True)
+    inserts = [params for sql, params in cursor.executed if "INSERT INTO" in sql]
+    assert inserts == [(datetime(1970, 1, 1),)] * 3
+    # 表只在第一次刷新时创建，全量刷新不再查询最新时间桶
+    assert not any("CREATE TABLE" in sql or "MAX(bucket)" in sql for sql, _ in cursor.executed)
+
+
+def test_freshness_cutoff(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rollup.time, "monotonic", lambda: now[0])
+    manager = RollupManager(connect=lambda: FakeConnection(FakeCursor(None)), max_staleness=300)
+    assert not manager.is_fresh()
+    manager.refresh()
+    assert manager.is_fresh()
+    now[0] += 301
+    assert not manager.is_fresh()
+
+    monkeypatch.setattr(rollup, "rollup_manager", manager)
+    semantic = _semantic([{"column": "ip"}, {"column": "SUM(bps)", "alias": "total"}], group_by=["ip"])
+    assert route_to_rollup(semantic) is None
+    assert route_to_rollup(semantic, require_fresh=False) is not None
+    manager.refresh()
+    assert "ip_flow_rollup_day" in route_to_rollup(semantic)
+
+
+# ---------------- 查询改写 ----------------
+
+def test_aggregates_map_to_rollup_columns():
+    sql = _route([{"column": "ip"}, {"column": "SUM(bps)", "alias": "total"}, {"column": "AVG(bps)", "alias": "avg"},
+                  {"column": "MIN(bps)", "alias": "lo"}, {"column": "MAX(`bps`)", "alias": "hi"},
+                  {"column": "COUNT(*)", "alias": "n"}, {"column": "COUNT(DISTINCT intf)", "alias": "intfs"}],
+                 group_by=["ip"])
+    assert sql.startswith("SELECT ip AS `ip`, SUM(bps_sum) AS `total`, (SUM(bps_sum) / SUM(sample_count)) AS `avg`, "
+                          "MIN(bps_min) AS `lo`, MAX(bps_max) AS `hi`, SUM(sample_count) AS `n`, "
+                          "COUNT(DISTINCT intf) AS `intfs` FROM `ip_flow_rollup_day`")
+
+
+def test_unaliased_aggregate_keeps_its_column_name():
+    sql = _route([{"column": "intf"}, {"column": "SUM(bps)"}], group_by=["intf"])
+    assert "SUM(bps_sum) AS `SUM(bps)`" in sql
+
+
+@pytest.mark.parametrize("bucket, table", [
+    ("DATE(`timestamp`)", "ip_flow_rollup_day"),
+    ("DATE_FORMAT(`timestamp`, '%Y-%m-%d')", "ip_flow_rollup_day"),
+    ("HOUR(`timestamp`)", "ip_flow_rollup_hour"),
+    ("DATE_FORMAT(`timestamp`, '%Y-%m-%d %H:00')", "ip_flow_rollup_hour"),
+    ("DATE_FORMAT(`timestamp`, '%Y-%m-%d %H:%i')", "ip_flow_rollup_minute"),
+    ("FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(`timestamp`) / 300) * 300)", "ip_flow_rollup_minute"),
+])
+def test_coarsest_table_for_time_bucket(bucket, table):
+    sql = _route([{"column": bucket, "alias": "t"}, {"column": "AVG(bps)", "alias": "avg"}], group_by=["t"])
+    assert f"FROM `{table}`" in sql
+    assert "bucket" in sql and "timestamp" not in sql
+
+
+@pytest.mark.parametrize("literal, table", [
+    ("'2024-05-01'", "ip_flow_rollup_day"),
+    ("'2024-05-01 10:00:00'", "ip_flow_rollup_hour"),
+    ("'2024-05-01 10:05'", "ip_flow_rollup_minute"),
+])
+def test_aligned_time_filters(literal, table):
+    sql = _route([{"column": "ip"}, {"column": "SUM(bps)", "alias": "total"}], group_by=["ip"],
+                 where=[{"left": "`timestamp`", "op": ">=", "right": literal}])
+    assert f"FROM `{table}`" in sql and f"WHERE bucket >= {literal}" in sql
+
+
+@pytest.mark.parametrize("query", [
+    # bps 出现在 WHERE 中：汇总表没有单条样本的值
+    dict(where=[{"left": "bps", "op": ">", "right": "100"}]),
+    # 未对齐到分钟的时间字面量
+    dict(where=[{"left": "`timestamp`", "op": ">=", "right": "'2024-05-01 10:05:30'"}]),
+    # 只接受 >= 与 <
+    dict(where=[{"left": "`timestamp`", "op": ">", "right": "'2024-05-01'"}]),
+    dict(where=[{"left": "`timestamp`", "op": ">=", "right": "NOW() - INTERVAL 1 HOUR"}]),
+    dict(having=[{"left": "SUM(bps)", "op": ">", "right": "bps"}]),
+])
+def test_unsupported_filters_are_not_routed(query):
+    assert _route([{"column": "ip"}, {"column": "SUM(bps)", "alias": "total"}], group_by=["ip"], **query) is None
+
+
+@pytest.mark.parametrize("select, group_by", [
+    ([{"column": "`timestamp`"}, {"column": "SUM(bps)"}], ["`timestamp`"]),
+    ([{"column": "DATE_FORMAT(`timestamp`, '%H:%i:%s')", "alias": "t"}, {"column": "SUM(bps)"}], ["t"]),
+    ([{"column": "ip"}, {"column": "bps"}], None),
+    ([{"column": "ip"}, {"column": "SUM(bps)"}], None),
+    ([{"column": "*"}], None),
+    ([{"column": "ip"}, {"column": "COUNT(DISTINCT bps)"}], ["ip"]),
+    ([{"column": "ip"}, {"column": "SUM(id)"}], ["ip"]),
+])
+def test_unsupported_queries_are_not_routed(select, group_by):
+    assert _route(select, group_by=group_by) is None
+
+
+def test_other_tables_and_joins_are_not_routed():
+    other = SemanticSQL.model_validate({"intent": "x", "query": {
+        "select": [{"column": "SUM(amount)"}], "from": ["orders"]}})
+    joined = _semantic([{"column": "SUM(bps)"}], joins=[{"table": "devices", "on": "devices.ip = ip_flow.ip"}])
+    assert route_to_rollup(other, require_fresh=False) is None
+    assert route_to_rollup(joined, require_fresh=False) is None
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+import semantic_schema
+from semantic_schema import (SEMANTIC_SCHEMA_DIR, DatabaseSemantic, SemanticSchemaManager,
+                             create_sample_shop_schema, load_schema_file)
+
+
+def _schema_yaml(table, meaning="订单表"):
+    return f"""
+description: 测试数据库
+business_domain: 测试
+tables:
+  - name: {table}
+    business_meaning: {meaning}
+    description: {meaning}
+    fields:
+      - name: id
+        data_type: integer
+        business_meaning: 主键
+"""
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    # 保证签名变化，不依赖文件系统的时间精度
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = SemanticSchemaManager()
+    manager.changes = []
+    manager.add_listener(manager.changes.append)
+    return manager
+
+
+def test_shipped_shop_schema_matches_builtin():
+    path = os.path.join(SEMANTIC_SCHEMA_DIR, "shop.yaml")
+    assert load_schema_file(path) == create_sample_shop_schema()
+
+
+def test_files_are_registered_without_parsing(manager, tmp_path, monkeypatch):
+    _write(tmp_path / "sales.yaml", _schema_yaml("orders"))
+    (tmp_path / "stock.json").write_text(json.dumps({
+        "description": "库存", "business_domain": "仓储",
+        "tables": [{"name": "items", "business_meaning": "商品", "description": "商品", "fields": []}],
+    }), encoding="utf-8")
+    (tmp_path / "notes.txt").write_text("不是模式文件", encoding="utf-8")
+    parsed = []
+    monkeypatch.setattr(semantic_schema, "load_schema_file",
+                        lambda path: parsed.append(os.path.basename(path)) or load_schema_file(path))
+
+    assert manager.load_directory(str(tmp_path)) == ["sales", "stock"]
+    assert manager.list_databases() == ["sales", "stock"]
+    assert parsed == [] and manager.schemas == {}
+
+    assert manager.get_table_semantic("sales", "orders").business_meaning == "订单表"
+    assert manager.get_schema("sales").name == "sales"
+    assert parsed == ["sales.yaml"]
+    assert manager.get_table_semantic("stock", "items") is not None
+    assert parsed == ["sales.yaml", "stock.json"]
+
+
+def test_changed_file_is_reloaded_and_listeners_notified(manager, tmp_path):
+    path = tmp_path / "sales.yaml"
+    _write(path, _schema_yaml("orders"))
+    manager.load_directory(str(tmp_path))
+    assert manager.get_table_semantic("sales", "orders") is not None
+    manager.changes.clear()
+
+    assert manager.reload_changed() == []
+    _write(path, _schema_yaml("invoices", "发票表"))
+    assert manager.reload_changed() == ["sales"]
+    assert manager.changes == ["sales"]
+    assert manager.get_table_semantic("sales", "orders") is None
+    assert manager.get_table_semantic("sales", "invoices").business_meaning == "发票表"
+
+    _write(tmp_path / "hr.yaml", _schema_yaml("staff"))
+    assert manager.reload_changed() == ["hr"]
+    assert "hr" not in manager.schemas and "hr" in manager.list_databases()
+
+
+def test_parse_error_keeps_previous_version(manager, tmp_path):
+    path = tmp_path / "sales.yaml"
+    _write(path, _schema_yaml("orders"))
+    manager.load_directory(str(tmp_path))
+    old = manager.get_schema("sales")
+    manager.changes.clear()
+
+    _write(path, "tables: [未闭合")
+    assert manager.reload_changed() == []
+    assert manager.get_schema("sales") is old and manager.changes == []
+    # 同一个坏文件不会反复解析，修好后重新加载
+    assert manager.reload_changed() == []
+    _write(path, _schema_yaml("invoices"))
+    assert manager.reload_changed() == ["sales"]
+    assert manager.get_table_semantic("sales", "invoices") is not None
+
+
+def test_deleted_file_falls_back_to_builtin(manager, tmp_path):
+    builtin = DatabaseSemantic(name="shop", description="内置", business_domain="电商", tables=[])
+    path = tmp_path / "shop.yaml"
+    _write(path, _schema_yaml("orders"))
+    manager.load_directory(str(tmp_path))
+    manager.register_schema("shop", lambda: builtin)
+    assert manager.get_table_semantic("shop", "orders") is not None
+    manager.changes.clear()
+
+    path.unlink()
+    assert manager.reload_changed() == ["shop"]
+    assert manager.changes == ["shop"]
+    assert manager.get_schema("shop") is builtin
+    assert manager.get_table_semantic("shop", "orders") is None
+
+
+def test_deleted_file_without_builtin_is_removed(manager, tmp_path):
+    path = tmp_path / "sales.yaml"
+    _write(path, _schema_yaml("orders"))
+    manager.load_directory(str(tmp_path))
+    manager.get_schema("sales")
+    path.unlink()
+    assert manager.reload_changed() == ["sales"]
+    assert manager.get_schema("sales") is None and manager.list_databases() == []
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from cache import result_cache
+from result_store import MaterializedResult
+from sql_fingerprint import parameterize_sql, sql_fingerprint
+
+
+def test_same_shape_ignores_case_backticks_and_whitespace():
+    a = sql_fingerprint("select ip, sum(bps) from `ip_flow` where ip = '10.0.0.1'  limit 10")
+    b = sql_fingerprint("SELECT ip,SUM(bps) FROM ip_flow WHERE ip = \"10.0.0.2\" LIMIT 10")
+    assert a.fingerprint == b.fingerprint
+    assert a.params == ("10.0.0.1", 10) and b.params == ("10.0.0.2", 10)
+    assert a.key != b.key
+
+
+def test_in_lists_of_any_length_share_a_shape():
+    a = sql_fingerprint("SELECT * FROM t WHERE id IN (1, 2)")
+    b = sql_fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3.5)")
+    assert a.fingerprint == b.fingerprint
+    assert b.params == ((1, 2, Decimal("3.5")),)
+
+
+def test_comments_are_ignored():
+    a = sql_fingerprint("SELECT 1 /* 注释 */ FROM t -- 行尾注释")
+    b = sql_fingerprint("SELECT 1 FROM t")
+    assert a.key == b.key
+
+
+def test_result_cache_distinguishes_column_labels(monkeypatch):
+    import app
+
+    def fake_materialize(endpoint, sql, prepared=None):
+        label = sql[len("SELECT "):sql.index(" FROM")]
+        return MaterializedResult([{label: 42}], [label], 1)
+
+    monkeypatch.setattr(app, "_materialize_query", fake_materialize)
+    result_cache.invalidate()
+    lower = app.execute_mysql_query("SELECT sum(amount) FROM orders", "shop")
+    upper = app.execute_mysql_query("SELECT SUM(amount) FROM orders", "shop")
+    assert lower[1] == ["sum(amount)"]
+    assert upper[1] == ["SUM(amount)"] and upper[0] == [{"SUM(amount)": 42}]
+    # 同一SQL原文仍然命中缓存
+    monkeypatch.setattr(app, "_materialize_query", None)
+    assert app.execute_mysql_query("SELECT SUM(amount) FROM orders", "shop") == upper
+
+
+def test_parameterize_sql_replaces_where_and_having_literals():
+    sql, params = parameterize_sql(
+        "SELECT name, COUNT(*) FROM t WHERE name = 'a%b' AND id IN (1, 2) "
+        "GROUP BY name HAVING COUNT(*) > 5 ORDER BY 2 LIMIT 10;")
+    assert sql == ("SELECT name, COUNT(*) FROM t WHERE name = %s AND id IN (%s, %s) "
+                   "GROUP BY name HAVING COUNT(*) > %s ORDER BY 2 LIMIT 10")
+    assert params == ["a%b", 1, 2, 5]
+
+
+def test_parameterize_sql_keeps_select_list_and_typed_literals():
+    sql, params = parameterize_sql(
+        "SELECT DATE_FORMAT(ts, '%Y') y FROM t WHERE ts >= DATE '2024-01-01' AND x > 1.5")
+    assert sql == "SELECT DATE_FORMAT(ts, '%Y') y FROM t WHERE ts >= DATE '2024-01-01' AND x > %s"
+    assert params == [Decimal("1.5")]
+
+
+def test_parameterize_sql_keeps_having_function_arguments():
+    assert parameterize_sql("SELECT a FROM t GROUP BY a HAVING ROUND(SUM(x), 2) > 3") == \
+        ("SELECT a FROM t GROUP BY a HAVING ROUND(SUM(x), 2) > %s", [3])
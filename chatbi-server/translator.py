@@ -1,15 +1,57 @@
-from typing import List, Optional, Dict, Any, Tuple
-
-from pydantic import BaseModel, Field, field_validator
-
-# LangChain / Ollama
-from langchain_ollama import ChatOllama
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+import os
+import re
+import json
+import time
+import logging
+import contextvars
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, List, Optional, Dict, Any, Tuple, TypeVar
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+if TYPE_CHECKING:
+    # langchain_ollama 导入耗时超过1秒，首次调用LLM时才导入
+    from langchain_ollama import ChatOllama
 
 # 语义模式
 from semantic_schema import semantic_manager, DatabaseSemantic
 
+# 缓存
+from cache import translation_cache
+from metrics import metrics, record_stage
+from prompt_budget import token_estimator, fit_semantic_hint
+from llm_router import get_router
+from json_stream import StreamingJSONParser, parse_json_tolerant
+from rollup import route_to_rollup
+from sql_fingerprint import parameterize
+
+logger = logging.getLogger(__name__)
+
+# 提示词配置
+PROMPT_COMPACT = os.getenv("PROMPT_COMPACT", "1") == "1"
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# 模型在Ollama中的驻留时间，避免模型被卸载后重新加载、丢失KV缓存
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# 级联翻译配置：direct 直接使用请求的模型，cascade 先用小模型、必要时升级
+TRANSLATION_MODE = os.getenv("TRANSLATION_MODE", "direct")
+OLLAMA_SMALL_MODEL = os.getenv("OLLAMA_SMALL_MODEL", "qwen2.5:1.5b")
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.8"))
+# 结构化输出：把 SemanticSQL 的JSON Schema作为Ollama的 format，约束模型只生成合法JSON
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") == "1"
+# 输出无法解析时带着错误信息追问的最大次数
+LLM_MAX_REASKS = int(os.getenv("LLM_MAX_REASKS", "2"))
+
+# 追问提示词中表结构提示的token预算
+FOLLOWUP_TOKEN_BUDGET = int(os.getenv("FOLLOWUP_TOKEN_BUDGET", "400"))
+
+CASCADE_HEDGE_DELAY = float(os.getenv("CASCADE_HEDGE_DELAY", "0"))
+_cascade_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CASCADE_WORKERS", "8")),
+                                       thread_name_prefix="cascade")
+
 
 class ColumnRef(BaseModel):
     table: Optional[str] = Field(default=None, description="表名，可选")
@@ -39,7 +81,7 @@ class Condition(BaseModel):
 
 class Join(BaseModel):
     table: str
-    on: str = Field(description="连接条件，如 a.id = b.a_id")
+    on: Optional[str] = Field(default=None, description="连接条件，如 a.id = b.a_id；为空时按外键关系自动补全")
     kind: str = Field(default="inner", description="连接类型：inner/left/right/full")
 
 
@@ -67,6 +109,20 @@ class SemanticSQL(BaseModel):
     query: SelectQuery
 
 
+class SemanticDelta(BaseModel):
+    """追问对上一轮 SemanticSQL 的修改，未给出的部分保持不变"""
+    intent: Optional[str] = Field(default=None, description="修改后的查询意图")
+    new_question: bool = Field(default=False, description="追问与上一轮无关、需要完整翻译时为 true")
+    add_select: Optional[List[ColumnRef]] = None
+    remove_select: Optional[List[str]] = Field(default=None, description="要去掉的查询列：列名、表达式或别名")
+    add_where: Optional[List[Condition]] = Field(default=None, description="新增过滤条件，替换左侧表达式相同的旧条件")
+    remove_where: Optional[List[str]] = Field(default=None, description="要去掉的过滤条件的左侧表达式")
+    group_by: Optional[List[str]] = Field(default=None, description="新的分组列，替换原分组")
+    add_having: Optional[List[Condition]] = None
+    order_by: Optional[List[OrderItem]] = Field(default=None, description="新的排序，替换原排序")
+    limit: Optional[int] = Field(default=None, description="新的行数上限，0 表示不限制")
+
+
 def _quote_identifier(name: str) -> str:
     if name is None or name == "*" or name.strip() == "*":
         return name
@@ -77,18 +133,37 @@ def _quote_identifier(name: str) -> str:
     return f"`{name}`"
 
 
-def _render_condition(cond: Condition) -> str:
+def _render_condition(cond: Condition, params: Optional[List[Any]] = None, max_depth: Optional[int] = None) -> str:
+    right = cond.right
+    if params is not None:
+        # 右侧值中的字面量换成占位符，值追加到 params
+        right, values = parameterize(right, max_depth)
+        params.extend(values)
     op = cond.op.strip().lower()
     if op == "in":
-        return f"{cond.left} IN ({cond.right})"
+        return f"{cond.left} IN ({right})"
     if op == "between":
-        return f"{cond.left} BETWEEN {cond.right}"
+        return f"{cond.left} BETWEEN {right}"
     if op == "like":
-        return f"{cond.left} LIKE {cond.right}"
-    return f"{cond.left} {cond.op} {cond.right}"
+        return f"{cond.left} LIKE {right}"
+    return f"{cond.left} {cond.op} {right}"
 
 
 def render_mysql_sql(semantic: SemanticSQL) -> str:
+    return _render_sql(semantic)
+
+
+def render_mysql_sql_params(semantic: SemanticSQL) -> Tuple[str, List[Any]]:
+    """渲染参数化SQL：WHERE / HAVING 条件右侧的字面量换成 %s 占位符，返回 (SQL, 参数列表)
+
+    同一形态的查询SQL文本相同，可以复用服务端预处理语句。HAVING 只替换最外层的值，
+    函数参数保持原文，避免与 SELECT / GROUP BY 中的表达式不一致。
+    """
+    params: List[Any] = []
+    return _render_sql(semantic, params), params
+
+
+def _render_sql(semantic: SemanticSQL, params: Optional[List[Any]] = None) -> str:
     q = semantic.query
 
     select_parts: List[str] = []
@@ -107,12 +182,13 @@ def render_mysql_sql(semantic: SemanticSQL) -> str:
         chunks = []
         for j in q.joins:
             kind = j.kind.upper() if j.kind else "INNER"
-            chunks.append(f" {kind} JOIN {_quote_identifier(j.table)} ON {j.on}")
+            on_sql = f" ON {j.on}" if j.on else ""
+            chunks.append(f" {kind} JOIN {_quote_identifier(j.table)}{on_sql}")
         join_sql = "".join(chunks)
 
     where_sql = ""
     if q.where and len(q.where) > 0:
-        where_sql = " WHERE " + " AND ".join(_render_condition(c) for c in q.where)
+        where_sql = " WHERE " + " AND ".join(_render_condition(c, params) for c in q.where)
 
     group_sql = ""
     if q.group_by and len(q.group_by) > 0:
@@ -120,7 +196,7 @@ def render_mysql_sql(semantic: SemanticSQL) -> str:
 
     having_sql = ""
     if q.having and len(q.having) > 0:
-        having_sql = " HAVING " + " AND ".join(_render_condition(c) for c in q.having)
+        having_sql = " HAVING " + " AND ".join(_render_condition(c, params, 0) for c in q.having)
 
     order_sql = ""
     if q.order_by and len(q.order_by) > 0:
@@ -133,6 +209,103 @@ def render_mysql_sql(semantic: SemanticSQL) -> str:
     )
 
 
+_QUALIFIED_REF_PATTERN = re.compile(r"`?\b([A-Za-z_]\w*)`?\.`?([A-Za-z_]\w*)`?")
+_STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+
+
+def _qualified_refs(expr: Optional[str]) -> List[Tuple[str, str]]:
+    """提取表达式中的 table.column 引用（忽略字符串字面量）"""
+    return _QUALIFIED_REF_PATTERN.findall(_STRING_LITERAL_PATTERN.sub("''", expr or ""))
+
+
+def _referenced_tables(semantic: SemanticSQL) -> List[str]:
+    """查询列、条件、分组、排序中引用到的表"""
+    q = semantic.query
+    exprs: List[Optional[str]] = []
+    tables: List[str] = []
+    for col in q.select:
+        if col.table:
+            tables.append(col.table)
+        else:
+            exprs.append(col.column)
+    exprs.extend(c.left for c in (q.where or []) + (q.having or []))
+    exprs.extend(q.group_by or [])
+    exprs.extend(o.by for o in (q.order_by or []))
+    for expr in exprs:
+        tables.extend(t for t, _ in _qualified_refs(expr))
+    return list(dict.fromkeys(tables))
+
+
+def _join_condition_valid(on: Optional[str], table: str, joined: List[str], db_name: str) -> bool:
+    """连接条件是否引用了待连接表与已连接表，且字段都存在"""
+    refs = _qualified_refs(on)
+    if not refs:
+        return False
+    tables = {t for t, _ in refs}
+    if table not in tables or not tables <= set(joined) | {table}:
+        return False
+    return all(semantic_manager.get_field_semantic(db_name, t, c) is not None for t, c in refs)
+
+
+def _shortest_join_path(db_name: str, joined: List[str], target: str) -> Optional[List[Tuple[str, str]]]:
+    """从任一已连接表到目标表的最短连接路径"""
+    best: Optional[List[Tuple[str, str]]] = None
+    for source in joined:
+        path = semantic_manager.get_join_path(db_name, source, target)
+        if path is not None and (best is None or len(path) < len(best)):
+            best = path
+    return best
+
+
+def repair_joins(semantic: SemanticSQL, db_name: str) -> SemanticSQL:
+    """按语义模式的连接图补全或修正 joins
+
+    - 多个主表转换为从第一个主表出发的连接
+    - 缺失或无效的连接条件替换为外键最短路径上的条件，必要时插入中间表
+    - 查询中引用了但没有连接的表自动补上连接
+    """
+    q = semantic.query
+    if not q.from_ or semantic_manager.get_table_semantic(db_name, q.from_[0]) is None:
+        return semantic
+
+    base = q.from_[0]
+    joined = [base]
+    joins: List[Join] = []
+    changed = len(q.from_) > 1
+    pending = [Join(table=t) for t in q.from_[1:]] + list(q.joins or [])
+    required = [t for t in _referenced_tables(semantic)
+                if semantic_manager.get_table_semantic(db_name, t) is not None]
+    pending += [Join(table=t) for t in required if t not in q.from_ and all(j.table != t for j in q.joins or [])]
+
+    for join in pending:
+        if join.table in joined:
+            changed = True
+            continue
+        if _join_condition_valid(join.on, join.table, joined, db_name):
+            joins.append(join)
+            joined.append(join.table)
+            continue
+        path = _shortest_join_path(db_name, joined, join.table)
+        if not path:
+            # 连接图中不连通，保留原样
+            joins.append(join)
+            joined.append(join.table)
+            continue
+        for table, condition in path:
+            if table not in joined:
+                joins.append(Join(table=table, on=condition, kind=join.kind))
+                joined.append(table)
+        changed = True
+
+    if not changed:
+        return semantic
+    metrics.incr("joins.repaired")
+    repaired = semantic.model_copy(deep=True)
+    repaired.query.from_ = [base]
+    repaired.query.joins = joins or None
+    return repaired
+
+
 def _build_schema_hint(schema: Dict[str, List[Tuple[str, str]]]) -> str:
     if not schema:
         return "(无显式表结构; 保持常识即可)"
@@ -163,29 +336,103 @@ def _get_enhanced_schema_hint(
         return f"语义模式定义:\n{semantic_hint}\n\n物理表结构:\n{physical_hint}"
 
 
-def _make_llm(model: str = "qwen2.5:7b", base_url: Optional[str] = None) -> ChatOllama:
+def _make_llm(
+    model: str = "qwen2.5:7b",
+    base_url: Optional[str] = None,
+    format: Optional[Any] = None,
+) -> "ChatOllama":
+    from langchain_ollama import ChatOllama
+
     return ChatOllama(
         model=model, 
         base_url=base_url or "http://localhost:11434",
         temperature=0.1,
-        timeout=300.0
+        timeout=300.0,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        format=format
     )
 
 
-def nl_to_semantic(
-    question: str,
-    schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    """展开 $ref 并去掉 title/description/default，得到便于Ollama转为语法约束的精简schema"""
+    if isinstance(node, dict):
+        if "$ref" in node:
+            return _inline_refs(defs[node["$ref"].split("/")[-1]], defs)
+        return {
+            k: _inline_refs(v, defs)
+            for k, v in node.items()
+            if k not in ("$defs", "title", "description", "default")
+        }
+    if isinstance(node, list):
+        return [_inline_refs(v, defs) for v in node]
+    return node
+
+
+@lru_cache(maxsize=1)
+def semantic_sql_json_schema() -> Dict[str, Any]:
+    """SemanticSQL 的JSON Schema，作为Ollama结构化输出的 format"""
+    schema = SemanticSQL.model_json_schema(by_alias=True)
+    return _inline_refs(schema, schema.get("$defs", {}))
+
+
+@lru_cache(maxsize=1)
+def semantic_delta_json_schema() -> Dict[str, Any]:
+    """SemanticDelta 的JSON Schema，作为追问时结构化输出的 format"""
+    schema = SemanticDelta.model_json_schema(by_alias=True)
+    return _inline_refs(schema, schema.get("$defs", {}))
+
+
+def _generate(
+    messages: Any,
     model: str = "qwen2.5:7b",
     base_url: Optional[str] = None,
-    db_name: str = "shop",
-) -> SemanticSQL:
-    import json
-    
-    # 使用增强的架构提示，包含语义信息
-    schema_hint = _get_enhanced_schema_hint(db_name, schema)
-    
-    # Create a more detailed prompt with semantic information
-    prompt_text = f"""你是一个优秀的数据分析助理。根据自然语言问题和提供的数据库结构信息（包含语义含义和物理结构），生成一个JSON对象用于表示语义SQL（S2SQL）。
+    affinity_key: Optional[str] = None,
+    json_schema: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, Any]:
+    """通过节点池流式调用LLM，顶层JSON对象闭合后不再接收多余输出
+
+    对象闭合后仍会读完空白块，以拿到结尾块中的token用量。json_schema 为结构化输出的格式，默认为 SemanticSQL。
+
+    Returns:
+        (输出文本, 合并后的消息块，携带token用量等元数据)
+    """
+    output_format = (json_schema or semantic_sql_json_schema()) if LLM_STRUCTURED_OUTPUT else None
+
+    def stream(llm: Any) -> Tuple[str, Any]:
+        parser = StreamingJSONParser()
+        merged = None
+        for chunk in llm.stream(messages):
+            if parser.done and chunk.content.strip():
+                # 对象闭合后模型仍在输出多余内容，直接断开
+                metrics.incr("llm.stream_early_stop")
+                break
+            merged = chunk if merged is None else merged + chunk
+            parser.feed(chunk.content)
+        return parser.text, merged
+
+    router = get_router(base_url)
+    start = time.time()
+    try:
+        return router.call(
+            model,
+            lambda url: _make_llm(model=model, base_url=url, format=output_format),
+            stream,
+            affinity_key=affinity_key
+        )
+    finally:
+        record_stage("llm", time.time() - start)
+
+
+_COMPACT_PROMPT_PREFIX = """你是数据分析助理。根据数据库结构信息，把问题转换为表示语义SQL（S2SQL）的JSON对象。
+
+{schema_hint}
+
+只输出如下格式的JSON，不要其他内容；没有的部分用null：
+{{"intent":"查询意图","query":{{"select":[{{"table":"表名或null","column":"列名或表达式","alias":"别名或null"}}],"from":["主表名"],"joins":[{{"table":"表名","kind":"inner"}}],"where":[{{"left":"左侧表达式","op":"操作符","right":"右侧值"}}],"group_by":["分组列"],"having":[同where],"order_by":[{{"by":"排序表达式","direction":"asc"}}],"limit":null}}}}
+
+注意：按字段含义选聚合函数；时间字段用日期函数过滤/分组；-> 为外键，joins 只需给出表名，连接条件会自动补全；布尔字段用于状态过滤。"""
+
+_VERBOSE_PROMPT_PREFIX = """你是一个优秀的数据分析助理。根据自然语言问题和提供的数据库结构信息（包含语义含义和物理结构），生成一个JSON对象用于表示语义SQL（S2SQL）。
 
 {schema_hint}
 
@@ -220,52 +467,371 @@ def nl_to_semantic(
 2. 时间字段通常用于过滤和分组，注意使用合适的日期函数
 3. 外键关系用于表连接，注意关联条件
 4. 布尔字段通常用于状态过滤
-5. 金额字段通常用于聚合和排序
+5. 金额字段通常用于聚合和排序"""
 
-问题：{question}"""
+# 提示词前缀缓存：键为 (db_name, 语义模式版本, 物理结构摘要, 紧凑模式, token预算)
+_prefix_cache: Dict[Tuple[str, str, str, bool, int], str] = {}
+_prefix_lock = threading.Lock()
+
+
+def _build_compact_physical_hint(
+    db_name: str,
+    physical_schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+) -> str:
+    """紧凑物理结构提示：只保留语义模式中没有覆盖的表和列"""
+    if not physical_schema:
+        return ""
+    lines: List[str] = []
+    for table, cols in physical_schema.items():
+        table_semantic = semantic_manager.get_table_semantic(db_name, table)
+        known = {f.name for f in table_semantic.fields} if table_semantic else set()
+        extra = [f"{c} {t}" for c, t in cols if c not in known]
+        if extra:
+            lines.append(f"{table}: {', '.join(extra)}")
+    return "\n".join(lines)
+
+
+def _render_prompt_prefix(
+    db_name: str,
+    physical_schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+) -> str:
+    """生成提示词前缀（系统消息），内容只取决于数据库结构，与问题无关
+
+    PROMPT_COMPACT 开启时使用紧凑编码，并按 PROMPT_TOKEN_BUDGET 依次省略低价值细节。
+    """
+    if not PROMPT_COMPACT:
+        # 使用增强的架构提示，包含语义信息
+        schema_hint = _get_enhanced_schema_hint(db_name, physical_schema)
+        return _VERBOSE_PROMPT_PREFIX.format(schema_hint=schema_hint)
+
+    physical_hint = _build_compact_physical_hint(db_name, physical_schema)
+    skeleton = _COMPACT_PROMPT_PREFIX.format(schema_hint=physical_hint)
+    hint_budget = max(0, PROMPT_TOKEN_BUDGET - token_estimator.estimate(skeleton))
+
+    if semantic_manager.get_schema(db_name):
+        semantic_hint, _, dropped = fit_semantic_hint(db_name, hint_budget)
+        if dropped:
+            metrics.incr("prompt.budget_trimmed")
+        schema_hint = f"{semantic_hint}\n{physical_hint}" if physical_hint else semantic_hint
+    else:
+        schema_hint = physical_hint or "(无表结构信息，请根据常识推断)"
+
+    return _COMPACT_PROMPT_PREFIX.format(schema_hint=schema_hint)
+
+
+def get_prompt_prefix(
+    db_name: str,
+    physical_schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+) -> str:
+    """获取字节级稳定的提示词前缀
+
+    同一 (db_name, 语义模式版本, 物理结构) 总是返回完全相同的字符串，
+    使Ollama可以复用已计算的KV缓存，只需评估问题部分。
+    """
+    schema = semantic_manager.get_schema(db_name)
+    version = schema.version if schema and schema.version else ""
+    key = (db_name, version, _schema_digest(physical_schema), PROMPT_COMPACT, PROMPT_TOKEN_BUDGET)
+    prefix = _prefix_cache.get(key)
+    if prefix is not None:
+        metrics.incr("prompt.prefix.hit")
+        return prefix
+
+    metrics.incr("prompt.prefix.miss")
+    with _prefix_lock:
+        prefix = _prefix_cache.get(key)
+        if prefix is None:
+            prefix = _render_prompt_prefix(db_name, physical_schema)
+            _prefix_cache[key] = prefix
+    return prefix
+
+
+def invalidate_prompt_prefix(db_name: Optional[str] = None) -> None:
+    """清除提示词前缀缓存，db_name 为空时全部清除"""
+    with _prefix_lock:
+        for key in [k for k in _prefix_cache if db_name is None or k[0] == db_name]:
+            del _prefix_cache[key]
+
+
+def _on_schema_changed(db_name: str) -> None:
+    """语义模式热加载后，失效该数据库的提示词前缀和翻译缓存"""
+    invalidate_prompt_prefix(db_name)
+    removed = translation_cache.invalidate(lambda key: key[0] == db_name)
+    logger.info(f"语义模式已更新，清除派生缓存 - 数据库: {db_name}, 翻译缓存条目: {removed}")
+
+
+semantic_manager.add_listener(_on_schema_changed)
+
+
+def _build_prompt(
+    question: str,
+    db_name: str,
+    physical_schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+) -> Tuple[List[Tuple[str, str]], int, int]:
+    """构建对话消息，返回 (消息列表, 估算总token数, 估算前缀token数)
+
+    系统消息是稳定前缀，问题放在单独的用户消息中。
+    """
+    prefix = get_prompt_prefix(db_name, physical_schema)
+    question_text = f"问题：{question}"
+    prefix_tokens = token_estimator.estimate(prefix)
+    messages = [("system", prefix), ("human", question_text)]
+    return messages, prefix_tokens + token_estimator.estimate(question_text), prefix_tokens
+
+
+def _report_prompt_tokens(
+    response: Any,
+    messages: List[Tuple[str, str]],
+    estimated_tokens: int,
+    prefix_tokens: int,
+) -> None:
+    """记录Ollama返回的真实提示词token数与评估耗时
+
+    Ollama命中前缀KV缓存时只评估未命中的部分，prompt_eval_count 会明显小于提示词总长度，
+    据此统计前缀复用率；只有未复用时才用真实token数校准估算器。
+    """
+    usage = getattr(response, "usage_metadata", None) or {}
+    response_metadata = getattr(response, "response_metadata", None) or {}
+    actual = usage.get("input_tokens") or response_metadata.get("prompt_eval_count")
+    metrics.observe("llm.prompt_tokens_estimated", estimated_tokens)
+
+    eval_duration = response_metadata.get("prompt_eval_duration")
+    if eval_duration:
+        metrics.observe("llm.prompt_eval_seconds", eval_duration / 1e9)
+    if not actual:
+        return
+
+    metrics.observe("llm.prompt_tokens", actual)
+    if actual < estimated_tokens - prefix_tokens / 2:
+        metrics.incr("llm.kv_prefix.reused")
+    else:
+        metrics.incr("llm.kv_prefix.evaluated")
+        raw = sum(token_estimator.raw(text) for _, text in messages)
+        token_estimator.calibrate(raw, actual)
+    logger.info(f"LLM提示词token数 - 实际评估: {actual}, 估算总数: {estimated_tokens}")
+
+
+class TranslationError(Exception):
+    """LLM输出无法转换为 SemanticSQL"""
+
+    def __init__(self, message: str, content: Optional[str] = None):
+        super().__init__(message)
+        self.content = content
+
+
+_REASK_TEMPLATE = "上面的输出无法转换为语义SQL：{error}\n请修正后只输出完整的JSON对象。"
+
+
+def _describe_error(error: Exception) -> str:
+    """把解析/校验错误压缩成适合回传给模型的简短描述"""
+    if isinstance(error, ValidationError):
+        return "；".join(
+            f"{'.'.join(str(p) for p in item['loc'])}: {item['msg']}" for item in error.errors()[:5]
+        )
+    return str(error)
+
+
+def _clean_condition_list(items: Any) -> Any:
+    if not isinstance(items, list):
+        return items
+    return [
+        cond for cond in items
+        if cond and isinstance(cond, dict) and cond.get('left') and cond.get('op') and cond.get('right') is not None
+    ]
+
+
+def _clean_conditions(data: Dict[str, Any]) -> Dict[str, Any]:
+    """清理无效的 where/having 条件"""
+    query = data.get('query')
+    if not isinstance(query, dict):
+        return data
+    for key in ('where', 'having'):
+        if key in query:
+            query[key] = _clean_condition_list(query[key] or [])
+    return data
+
+
+_T = TypeVar("_T")
+
+
+def _generate_parsed(
+    messages: List[Tuple[str, str]],
+    parse: Callable[[str], _T],
+    model: str,
+    base_url: Optional[str],
+    db_name: str,
+    max_reasks: Optional[int],
+    estimated_tokens: int,
+    prefix_tokens: int,
+    json_schema: Optional[Dict[str, Any]] = None,
+) -> _T:
+    """调用LLM并用 parse 解析输出
+
+    输出无法解析或不符合模型定义时，带着错误信息追问，最多 max_reasks 次（默认 LLM_MAX_REASKS），
+    仍然失败则抛出 TranslationError。
+    """
+    max_reasks = LLM_MAX_REASKS if max_reasks is None else max_reasks
+
+    conversation = list(messages)
+    last_error: Optional[TranslationError] = None
+    for attempt in range(max_reasks + 1):
+        started = time.monotonic()
+        content, response = _generate(conversation, model=model, base_url=base_url, affinity_key=db_name,
+                                      json_schema=json_schema)
+        _report_prompt_tokens(response, conversation, estimated_tokens, prefix_tokens)
+        try:
+            return parse(content)
+        except Exception as e:
+            metrics.incr("llm.parse_failures")
+            metrics.observe("llm.wasted_seconds", time.monotonic() - started)
+            error_text = _describe_error(e)
+            last_error = TranslationError(f"无法解析LLM输出: {error_text}", content)
+            logger.warning(f"LLM输出解析失败 - 模型: {model}, 第{attempt + 1}次, 错误: {error_text}")
+
+        if attempt < max_reasks:
+            metrics.incr("llm.reasks")
+            conversation += [("ai", content), ("human", _REASK_TEMPLATE.format(error=error_text[:500]))]
+            estimated_tokens = sum(token_estimator.estimate(text) for _, text in conversation)
+
+    raise last_error
+
+
+def _llm_to_semantic(
+    question: str,
+    schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+    model: str = "qwen2.5:7b",
+    base_url: Optional[str] = None,
+    db_name: str = "shop",
+    max_reasks: Optional[int] = None,
+) -> SemanticSQL:
+    """调用LLM生成 SemanticSQL，解析失败时追问，仍然失败则抛出 TranslationError"""
+    messages, estimated_tokens, prefix_tokens = _build_prompt(question, db_name, schema)
+
+    def parse(content: str) -> SemanticSQL:
+        data = _clean_conditions(parse_json_tolerant(content))
+        return repair_joins(SemanticSQL(**data), db_name)
+
+    return _generate_parsed(messages, parse, model, base_url, db_name, max_reasks, estimated_tokens, prefix_tokens)
+
+
+def _accept_small_model(semantic: SemanticSQL, db_name: str) -> Tuple[bool, str]:
+    """判断小模型的结果能否直接采用，返回 (是否采用, 升级原因)"""
+    from semantic_validator import validate_semantic
+
+    result = validate_semantic(semantic, db_name)
+    if not result.valid:
+        return False, "validation"
+    if result.confidence < CASCADE_MIN_CONFIDENCE:
+        return False, "confidence"
+    return True, ""
+
+
+def _cascade_to_semantic(
+    question: str,
+    schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+    model: str = "qwen2.5:7b",
+    base_url: Optional[str] = None,
+    db_name: str = "shop",
+) -> SemanticSQL:
+    """级联翻译：先用小模型，解析/校验失败或置信度不足时升级到大模型
+
+    CASCADE_HEDGE_DELAY > 0 时，小模型在该时间内未返回就同时启动大模型（对冲），
+    小模型结果可用则直接采用，否则等待大模型。
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+
+    def run(m: str) -> SemanticSQL:
+        # 小模型不追问，解析失败直接升级
+        return _llm_to_semantic(question, schema=schema, model=m, base_url=base_url, db_name=db_name,
+                                max_reasks=0 if m == OLLAMA_SMALL_MODEL else None)
+
+    # 在调用方的上下文中运行，使LLM耗时计入当前请求的分阶段计时
+    small = _cascade_executor.submit(contextvars.copy_context().run, run, OLLAMA_SMALL_MODEL)
+    large = None
+    if CASCADE_HEDGE_DELAY > 0:
+        done, _ = wait([small], timeout=CASCADE_HEDGE_DELAY)
+        if not done:
+            metrics.incr("cascade.hedged")
+            large = _cascade_executor.submit(contextvars.copy_context().run, run, model)
+
+    # 对冲时大模型可能先返回，先返回且有效的大模型结果直接采用
+    if large is not None:
+        done, _ = wait([small, large], return_when=FIRST_COMPLETED)
+        if large in done and large.exception() is None:
+            metrics.incr("cascade.large_first")
+            return large.result()
 
-    llm = _make_llm(model=model, base_url=base_url)
-    
     try:
-        response = llm.invoke(prompt_text)
-        # Parse the JSON response
-        json_str = response.content.strip()
-        # Remove any markdown formatting if present
-        if json_str.startswith("```json"):
-            json_str = json_str[7:]
-        if json_str.endswith("```"):
-            json_str = json_str[:-3]
-        
-        data = json.loads(json_str)
-        
-        # 清理无效的条件
-        if 'query' in data and 'where' in data['query']:
-            valid_conditions = []
-            for cond in data['query']['where']:
-                if cond and isinstance(cond, dict) and cond.get('left') and cond.get('op') and cond.get('right') is not None:
-                    valid_conditions.append(cond)
-            data['query']['where'] = valid_conditions
-        
-        # 清理无效的having条件
-        if 'query' in data and 'having' in data['query']:
-            valid_having = []
-            for cond in data['query']['having']:
-                if cond and isinstance(cond, dict) and cond.get('left') and cond.get('op') and cond.get('right') is not None:
-                    valid_having.append(cond)
-            data['query']['having'] = valid_having
-        
-        return SemanticSQL(**data)
+        semantic = small.result()
+        accepted, reason = _accept_small_model(semantic, db_name)
+    except TranslationError:
+        accepted, reason = False, "parse"
     except Exception as e:
-        print(f"Error parsing LLM response: {e}")
-        print(f"Response was: {response.content if 'response' in locals() else 'No response'}")
-        # Return a simple fallback
-        return SemanticSQL(
-            intent="查询用户信息",
-            query=SelectQuery(
-                select=[ColumnRef(column="*")],
-                from_=["users"]
-            )
-        )
+        # 小模型未拉取、超时或节点不可用时同样升级，对冲时直接等待已启动的大模型
+        logger.warning(f"小模型调用失败 - 模型: {OLLAMA_SMALL_MODEL}, 错误: {e}")
+        accepted, reason = False, "error"
+    if accepted:
+        metrics.incr("cascade.small_accepted")
+        return semantic
+
+    metrics.incr(f"cascade.escalated.{reason}")
+    logger.info(f"小模型结果不可用，升级到 {model} - 原因: {reason}")
+    if large is None:
+        return run(model)
+    return large.result()
+
+
+def nl_to_semantic(
+    question: str,
+    schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+    model: str = "qwen2.5:7b",
+    base_url: Optional[str] = None,
+    db_name: str = "shop",
+    mode: Optional[str] = None,
+) -> SemanticSQL:
+    from fast_path import try_fast_path
+    
+    # 简单问题直接由模板生成，跳过LLM调用
+    fast = try_fast_path(question, db_name)
+    if fast is not None:
+        return fast
+    
+    mode = mode or TRANSLATION_MODE
+    try:
+        if mode == "cascade" and OLLAMA_SMALL_MODEL and OLLAMA_SMALL_MODEL != model:
+            return _cascade_to_semantic(question, schema=schema, model=model, base_url=base_url, db_name=db_name)
+        return _llm_to_semantic(question, schema=schema, model=model, base_url=base_url, db_name=db_name)
+    except TranslationError as e:
+        metrics.incr("llm.translation_failures")
+        logger.error(f"无法生成语义SQL - 问题: '{question}', 错误: {e}, LLM输出: {e.content}")
+        raise
+
+
+def _normalize_question(question: str) -> str:
+    """规范化问题文本，用于缓存键（合并空白、去除首尾标点）"""
+    return " ".join(question.split()).strip("。？?！! ")
+
+
+def _schema_digest(schema: Optional[Dict[str, List[Tuple[str, str]]]]) -> str:
+    """物理表结构摘要，物理结构变化时缓存自然失效"""
+    if not schema:
+        return ""
+    import hashlib
+
+    canonical = repr(sorted((t, tuple(map(tuple, cols))) for t, cols in schema.items()))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def translation_cache_key(
+    question: str,
+    db_name: str,
+    model: str,
+    schema: Optional[Dict[str, List[Tuple[str, str]]]] = None,
+    mode: Optional[str] = None,
+) -> Tuple[str, str, str, str]:
+    """翻译缓存键"""
+    if (mode or TRANSLATION_MODE) == "cascade":
+        model = f"{OLLAMA_SMALL_MODEL}>{model}"
+    return (db_name, model, _normalize_question(question), _schema_digest(schema))
 
 
 def nl_to_mysql(
@@ -274,10 +840,153 @@ def nl_to_mysql(
     model: str = "qwen2.5:7b",
     base_url: Optional[str] = None,
     db_name: str = "shop",
+    use_cache: bool = True,
+    mode: Optional[str] = None,
 ) -> Tuple[SemanticSQL, str]:
-    semantic = nl_to_semantic(question=question, schema=schema, model=model, base_url=base_url, db_name=db_name)
+    key = translation_cache_key(question, db_name, model, schema, mode)
+    if use_cache:
+        cached = translation_cache.get(key)
+        if cached is not None:
+            semantic, sql = cached
+            return semantic.model_copy(deep=True), route_to_rollup(semantic) or sql
+
+    semantic = nl_to_semantic(question=question, schema=schema, model=model, base_url=base_url, db_name=db_name, mode=mode)
     sql = render_mysql_sql(semantic)
-    return semantic, sql
+    # 缓存原始SQL，汇总表是否可用在每次返回时判断
+    translation_cache.set(key, (semantic.model_copy(deep=True), sql))
+    return semantic, route_to_rollup(semantic) or sql
+
+
+_FOLLOWUP_PROMPT = """你是数据分析助理。用户在上一轮查询的基础上追问，只输出对上一轮语义SQL的修改。
+
+{schema_hint}
+
+只输出如下格式的JSON，不要其他内容；不修改的部分省略或用null：
+{{"intent":"修改后的查询意图","add_select":[{{"table":"表名或null","column":"列名或表达式","alias":"别名或null"}}],"remove_select":["列名或别名"],"add_where":[{{"left":"左侧表达式","op":"操作符","right":"右侧值"}}],"remove_where":["左侧表达式"],"group_by":["分组列"],"add_having":[同add_where],"order_by":[{{"by":"排序表达式","direction":"desc"}}],"limit":null}}
+
+注意：add_where 替换左侧表达式相同的旧条件；group_by 给出完整的新分组，原分组列会换成新分组列；引用新表时 joins 会自动补全；追问与上一轮无关时只输出 {{"new_question":true}}。"""
+
+
+def _followup_tables(semantic: SemanticSQL, db_name: str) -> List[str]:
+    """上一轮查询用到的表及与其直接关联的表，追问提示只包含这些表的结构"""
+    q = semantic.query
+    tables = list(dict.fromkeys(q.from_ + [j.table for j in q.joins or []] + _referenced_tables(semantic)))
+    for table in list(tables):
+        for rel in semantic_manager.get_relationships(db_name, table):
+            tables.extend((rel.source_table, rel.target_table))
+    return list(dict.fromkeys(tables))
+
+
+def _build_followup_prompt(
+    question: str,
+    previous: SemanticSQL,
+    db_name: str,
+) -> Tuple[List[Tuple[str, str]], int, int]:
+    """构建追问消息，返回 (消息列表, 估算总token数, 估算系统消息token数)
+
+    系统消息只取决于涉及的表，同一会话的连续追问可以复用Ollama的前缀KV缓存；上一轮语义SQL放在用户消息中。
+    """
+    if semantic_manager.get_schema(db_name):
+        schema_hint, _, _ = fit_semantic_hint(db_name, FOLLOWUP_TOKEN_BUDGET, _followup_tables(previous, db_name))
+    else:
+        schema_hint = "(无表结构信息，沿用上一轮的表和列)"
+    previous_json = json.dumps(previous.model_dump(by_alias=True, exclude_none=True),
+                               ensure_ascii=False, separators=(",", ":"))
+    system = _FOLLOWUP_PROMPT.format(schema_hint=schema_hint)
+    question_text = f"上一轮语义SQL：{previous_json}\n追问：{question}"
+    system_tokens = token_estimator.estimate(system)
+    messages = [("system", system), ("human", question_text)]
+    return messages, system_tokens + token_estimator.estimate(question_text), system_tokens
+
+
+def _expr_key(expr: Optional[str]) -> str:
+    """比较表达式用的规范形式：去掉反引号、合并空白、忽略大小写"""
+    return " ".join((expr or "").replace("`", "").split()).lower()
+
+
+def _column_keys(col: ColumnRef) -> set:
+    keys = {_expr_key(col.column)}
+    if col.table:
+        keys.add(_expr_key(f"{col.table}.{col.column}"))
+    if col.alias:
+        keys.add(_expr_key(col.alias))
+    return keys
+
+
+def _replace_conditions(existing: Optional[List[Condition]], added: List[Condition]) -> List[Condition]:
+    lefts = {_expr_key(c.left) for c in added}
+    return [c for c in existing or [] if _expr_key(c.left) not in lefts] + added
+
+
+def apply_delta(semantic: SemanticSQL, delta: SemanticDelta) -> SemanticSQL:
+    """把追问的修改合并到上一轮的 SemanticSQL，返回新对象"""
+    merged = semantic.model_copy(deep=True)
+    q = merged.query
+    if delta.intent:
+        merged.intent = delta.intent
+
+    if delta.remove_select:
+        removed = {_expr_key(x) for x in delta.remove_select}
+        # 查询列不能为空，全部去掉时保留原样
+        q.select = [c for c in q.select if not _column_keys(c) & removed] or q.select
+    for col in delta.add_select or []:
+        if not any(_column_keys(col) & _column_keys(c) for c in q.select):
+            q.select.append(col)
+
+    if delta.remove_where:
+        removed = {_expr_key(x) for x in delta.remove_where}
+        q.where = [c for c in q.where or [] if _expr_key(c.left) not in removed]
+    if delta.add_where:
+        q.where = _replace_conditions(q.where, delta.add_where)
+    q.where = q.where or None
+
+    if delta.group_by is not None:
+        new_keys = {_expr_key(g) for g in delta.group_by}
+        dropped = {_expr_key(g) for g in q.group_by or []} - new_keys
+        # 不再分组的维度列从查询列中去掉，新的分组列放在查询列最前面
+        select = [c for c in q.select if not _column_keys(c) & dropped]
+        selected = set().union(*(_column_keys(c) for c in select))
+        dimensions = [ColumnRef(column=g) for g in delta.group_by if _expr_key(g) not in selected]
+        q.select = dimensions + select or q.select
+        q.group_by = list(delta.group_by) or None
+    if delta.add_having:
+        q.having = _replace_conditions(q.having, delta.add_having)
+
+    if delta.order_by is not None:
+        q.order_by = delta.order_by or None
+    if delta.limit is not None:
+        q.limit = delta.limit or None
+    return merged
+
+
+def followup_to_semantic(
+    question: str,
+    previous: SemanticSQL,
+    model: str = "qwen2.5:7b",
+    base_url: Optional[str] = None,
+    db_name: str = "shop",
+) -> Optional[SemanticSQL]:
+    """把追问翻译为对上一轮 SemanticSQL 的修改并合并
+
+    提示词只包含上一轮的语义SQL和相关表的紧凑结构，模型只输出修改部分。
+    模型判断追问与上一轮无关时返回 None，由调用方完整翻译；解析失败时抛出 TranslationError。
+    """
+    messages, estimated_tokens, system_tokens = _build_followup_prompt(question, previous, db_name)
+
+    def parse(content: str) -> Optional[SemanticSQL]:
+        data = parse_json_tolerant(content)
+        if isinstance(data, dict):
+            for key in ("add_where", "add_having"):
+                data[key] = _clean_condition_list(data.get(key))
+        delta = SemanticDelta(**data)
+        if delta.new_question:
+            return None
+        return repair_joins(apply_delta(previous, delta), db_name)
+
+    semantic = _generate_parsed(messages, parse, model, base_url, db_name, None, estimated_tokens, system_tokens,
+                                json_schema=semantic_delta_json_schema())
+    metrics.incr("followup.new_question" if semantic is None else "followup.applied")
+    return semantic
 
 
 def _merge_s2sql_and_physical(s2sql: str, semantic_name: str, physical_sql: str, support_with: bool) -> str:
@@ -0,0 +1,164 @@
+"""
+缓存预热模块 - 启动时及周期性地预先翻译常见问题
+预热任务在后台低优先级线程中运行，只在没有线上请求时才会推进，避免与用户请求争抢LLM
+"""
+
+import os
+import re
+import threading
+import time
+import logging
+from collections import Counter
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 预热问题：(问题, 数据库名)
+WarmupItem = Tuple[str, str]
+
+
+class TrafficGate:
+    """线上流量闸门：记录正在处理的用户请求数，供后台任务让路"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._last_activity = 0.0
+
+    def enter(self) -> None:
+        with self._cond:
+            self._active += 1
+            self._last_activity = time.monotonic()
+
+    def exit(self) -> None:
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._last_activity = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def wait_idle(self, idle_seconds: float, stop_event: threading.Event) -> bool:
+        """阻塞直到连续空闲 idle_seconds 秒；收到停止信号时返回 False"""
+        with self._cond:
+            while not stop_event.is_set():
+                if self._active == 0:
+                    idle_for = time.monotonic() - self._last_activity
+                    if idle_for >= idle_seconds:
+                        return True
+                    self._cond.wait(timeout=idle_seconds - idle_for)
+                else:
+                    self._cond.wait(timeout=1.0)
+        return False
+
+
+# 全局流量闸门实例
+traffic_gate = TrafficGate()
+
+
+_LOG_QUESTION_PATTERN = re.compile(r"开始处理查询请求 - 问题: '(?P<question>.*)', 数据库: (?P<db>\S+?),")
+
+
+def load_top_questions_from_log(path: str, top_n: int) -> List[WarmupItem]:
+    """从服务日志中统计出现次数最多的 top_n 个问题"""
+    if top_n <= 0 or not path or not os.path.exists(path):
+        return []
+    counter: Counter = Counter()
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            match = _LOG_QUESTION_PATTERN.search(line)
+            if match:
+                counter[(match.group("question"), match.group("db"))] += 1
+    return [item for item, _ in counter.most_common(top_n)]
+
+
+class CacheWarmer:
+    """后台缓存预热器"""
+
+    def __init__(
+        self,
+        translate: Callable[[str, str], Tuple[Any, str]],
+        questions: Callable[[], List[WarmupItem]],
+        execute: Optional[Callable[[str, str], Any]] = None,
+        gate: TrafficGate = traffic_gate,
+        interval: float = 3600.0,
+        idle_seconds: float = 2.0,
+    ):
+        """
+        Args:
+            translate: (question, db_name) -> (semantic, sql)，需自行写入翻译缓存
+            questions: 返回本轮待预热问题列表
+            execute: (sql, db_name) -> 结果，可选，用于填充结果缓存
+            interval: 两轮预热之间的间隔秒数，<=0 表示只在启动时执行一次
+            idle_seconds: 每个问题开始前要求的连续空闲时间
+        """
+        self.translate = translate
+        self.questions = questions
+        self.execute = execute
+        self.gate = gate
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _lower_priority(self) -> None:
+        """尽量降低预热线程的调度优先级（仅Linux支持按线程设置）"""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+    def _loop(self) -> None:
+        self._lower_priority()
+        while not self._stop.is_set():
+            self.run_once()
+            if self.interval <= 0 or self._stop.wait(self.interval):
+                break
+
+    def run_once(self) -> Dict[str, Any]:
+        """执行一轮预热，返回统计信息"""
+        started = time.monotonic()
+        stats = {"total": 0, "warmed": 0, "failed": 0}
+        try:
+            items = list(dict.fromkeys(self.questions()))
+        except Exception as e:
+            logger.warning(f"获取预热问题失败: {e}")
+            items = []
+        stats["total"] = len(items)
+
+        for question, db_name in items:
+            # 每个问题前都让路给线上请求
+            if not self.gate.wait_idle(self.idle_seconds, self._stop):
+                break
+            try:
+                _, sql = self.translate(question, db_name)
+                if self.execute is not None:
+                    self.execute(sql, db_name)
+                stats["warmed"] += 1
+                metrics.incr("warmup.warmed")
+            except Exception as e:
+                stats["failed"] += 1
+                metrics.incr("warmup.failed")
+                logger.warning(f"预热问题失败 - 问题: '{question}', 数据库: {db_name}, 错误: {e}")
+
+        stats["duration"] = time.monotonic() - started
+        stats["finished_at"] = time.time()
+        self.last_run = stats
+        logger.info(f"缓存预热完成 - 共 {stats['total']} 个问题, 成功 {stats['warmed']}, "
+                    f"失败 {stats['failed']}, 耗时: {stats['duration']:.1f}秒")
+        return stats
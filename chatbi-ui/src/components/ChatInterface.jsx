@@ -1,12 +1,17 @@
 import React, { useState, useRef, useEffect } from 'react'
 import { Send, Copy, Check, Loader2, Database, Code, AlertCircle } from 'lucide-react'
-import { processQuery, executeSQL } from '../utils/api'
+import { processQuery, askQuestion } from '../utils/api'
 import MessageBubble from './MessageBubble'
 import QueryInput from './QueryInput'
 import ResponseDisplay from './ResponseDisplay'
 
+// 会话ID：同一会话中的追问由服务端在上一轮查询的基础上增量翻译
+const newConversationId = () =>
+  window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`
+
 function ChatInterface() {
   const [messages, setMessages] = useState([])
+  const [conversationId, setConversationId] = useState(newConversationId)
   const [isLoading, setIsLoading] = useState(false)
   const [loadingStatus, setLoadingStatus] = useState('')
   const [settings, setSettings] = useState({
@@ -40,37 +45,37 @@ function ChatInterface() {
     setLoadingStatus('正在解析自然语言查询...')
 
     try {
-      const response = await processQuery({
-        question: question.trim(),
-        db_name: settings.dbName,
-        use_semantic: settings.useSemantic,
-        model: settings.model
-      })
-
-      let finalResponse = response
-
-      // 如果查询成功且启用了自动执行，则自动执行 SQL
-      if (response.success && settings.autoExecute && response.mysql_sql) {
-        setLoadingStatus('正在自动执行 SQL 查询...')
-        try {
-          const executeResult = await executeSQL({
-            sql: response.mysql_sql,
-            db_name: settings.dbName
-          })
-          
-          // 将执行结果合并到响应中
-          finalResponse = {
-            ...response,
-            executeResult: executeResult
-          }
-        } catch (executeError) {
-          console.error('自动执行SQL失败:', executeError)
-          // 将执行错误信息添加到响应中
-          finalResponse = {
-            ...response,
-            executeError: executeError.message || '自动执行SQL失败'
+      let finalResponse
+
+      if (settings.autoExecute) {
+        // 启用自动执行时通过 /ask 一次完成翻译与执行，SQL 生成后服务端立即执行
+        const events = await askQuestion({
+          question: question.trim(),
+          db_name: settings.dbName,
+          use_semantic: settings.useSemantic,
+          model: settings.model,
+          conversation_id: conversationId
+        }, (event) => {
+          if (event.event === 'translation' && event.success) {
+            setLoadingStatus('正在自动执行 SQL 查询...')
           }
+        })
+
+        const { event: _translationEvent, ...translation } = events.translation || {}
+        finalResponse = translation
+        // 将执行结果合并到响应中
+        if (events.result) {
+          const { event: _resultEvent, ...executeResult } = events.result
+          finalResponse = { ...translation, executeResult }
         }
+      } else {
+        finalResponse = await processQuery({
+          question: question.trim(),
+          db_name: settings.dbName,
+          use_semantic: settings.useSemantic,
+          model: settings.model,
+          conversation_id: conversationId
+        })
       }
 
       const assistantMessage = {
@@ -101,6 +106,7 @@ function ChatInterface() {
 
   const handleClearChat = () => {
     setMessages([])
+    setConversationId(newConversationId())
   }
 
   return (
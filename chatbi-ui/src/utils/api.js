@@ -57,4 +57,38 @@ export const executeSQL = async (sqlData) => {
   return response.data
 }
 
+// 一次请求完成翻译与执行，服务端以 NDJSON 逐条推送 translation / result / done 事件
+export const askQuestion = async (queryData, onEvent) => {
+  const response = await fetch(`${API_BASE_URL}/ask`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(queryData)
+  })
+  if (!response.ok) {
+    throw new Error(`请求失败: ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  const events = {}
+  let buffer = ''
+  const handleLine = (line) => {
+    if (!line.trim()) return
+    const event = JSON.parse(line)
+    events[event.event] = event
+    onEvent?.(event)
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+    const lines = buffer.split('\n')
+    buffer = lines.pop()
+    lines.forEach(handleLine)
+  }
+  handleLine(buffer)
+  return events
+}
+
 export default api